@@ -0,0 +1,190 @@
+"""
+Keyset-paginated reads for the admin dashboard and its JSON endpoints.
+
+Pages are ordered newest first by (timestamp, id), or by card_id for cards,
+and the cursor is the sort key of the last row returned. Fetching page N
+therefore costs the same as page 1, however large the table gets.
+
+Every reader takes one connection or the list of shard connections. With
+shards, each shard answers the same keyset query and the results are merged
+(scatter-gather); ids are unique across shards, so the sort keys are too.
+A card_id filter only asks that card's shard.
+"""
+import base64
+import json
+from collections import Counter
+
+import db
+import fraud_stats
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        raise Exception("Invalid cursor")
+
+
+def page_size(value):
+    try:
+        size = int(value or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise Exception("Invalid limit")
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _build(sql, where, params, order, limit):
+    sql += (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {order} LIMIT ?"
+    # One extra row tells us whether there is a next page
+    return sql, params + [limit + 1]
+
+
+def _targets(conns, card_id=None):
+    if not isinstance(conns, (list, tuple)):
+        return [conns]
+    if card_id and len(conns) > 1:
+        # A card's rows all live on its own shard
+        return [conns[db.shard_of(card_id, len(conns))]]
+    return conns
+
+
+def _sort_key(row, cursor_columns):
+    # NULLs sort lowest, as in SQLite
+    return tuple((row[column] is not None, row[column] or 0) for column in cursor_columns)
+
+
+def _page(conns, query, limit, cursor_columns, newest_first, card_id=None):
+    sql, params = query
+    targets = _targets(conns, card_id)
+    rows = []
+    for conn in targets:
+        rows += [dict(row) for row in conn.execute(sql, params)]
+    if len(targets) > 1:
+        # Each shard sent its own first limit + 1 rows; keep the overall first
+        rows.sort(key=lambda row: _sort_key(row, cursor_columns), reverse=newest_first)
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([items[-1][column] for column in cursor_columns])
+    return items, next_cursor
+
+
+def _time_filters(where, params, since, until):
+    if since:
+        where.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        where.append("timestamp < ?")
+        params.append(until)
+
+
+def _newest_first(where, params, cursor):
+    if cursor:
+        timestamp, row_id = cursor
+        # Row-value comparison walks the (timestamp, rowid) index directly
+        where.append("(timestamp, id) < (?, ?)")
+        params.extend([timestamp, row_id])
+
+
+# ---------------- QUERIES ----------------
+# Builders return (sql, params) so query_plans.py can EXPLAIN them too
+def fraud_log_query(limit=DEFAULT_PAGE_SIZE, cursor=None, card_id=None, fraud_type=None, since=None, until=None):
+    where, params = [], []
+    if card_id:
+        where.append("card_id = ?")
+        params.append(card_id)
+    if fraud_type:
+        where.append("fraud_type = ?")
+        params.append(fraud_type)
+    _time_filters(where, params, since, until)
+    _newest_first(where, params, decode_cursor(cursor))
+    return _build(
+        "SELECT id, card_id, fraud_type, action_taken, timestamp FROM fraud_log",
+        where, params, "timestamp DESC, id DESC", limit
+    )
+
+
+def transactions_query(limit=DEFAULT_PAGE_SIZE, cursor=None, card_id=None, since=None, until=None):
+    where, params = [], []
+    if card_id:
+        where.append("card_id = ?")
+        params.append(card_id)
+    _time_filters(where, params, since, until)
+    _newest_first(where, params, decode_cursor(cursor))
+    return _build(
+        "SELECT id, card_id, type, amount, status, timestamp, location FROM transactions",
+        where, params, "timestamp DESC, id DESC", limit
+    )
+
+
+def cards_query(limit=DEFAULT_PAGE_SIZE, cursor=None, status=None):
+    where, params = [], []
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    cursor = decode_cursor(cursor)
+    if cursor:
+        where.append("card_id > ?")
+        params.append(cursor[0])
+    return _build(
+        "SELECT card_id, status, pin_attempts, balance FROM card",
+        where, params, "card_id", limit
+    )
+
+
+# ---------------- PAGES ----------------
+def page_fraud_logs(conns, limit=DEFAULT_PAGE_SIZE, **filters):
+    query = fraud_log_query(limit, **filters)
+    return _page(conns, query, limit, ("timestamp", "id"), True, filters.get("card_id"))
+
+
+def page_transactions(conns, limit=DEFAULT_PAGE_SIZE, **filters):
+    query = transactions_query(limit, **filters)
+    return _page(conns, query, limit, ("timestamp", "id"), True, filters.get("card_id"))
+
+
+def page_cards(conns, limit=DEFAULT_PAGE_SIZE, **filters):
+    return _page(conns, cards_query(limit, **filters), limit, ("card_id",), False)
+
+
+# ---------------- AGGREGATES ----------------
+# Read from the fraud_stats rollups, never from fraud_log itself. Each shard
+# rolls up its own rows, so the shard results are summed.
+def fraud_summary(conns):
+    totals = Counter()
+    for conn in _targets(conns):
+        totals.update({row["fraud_type"]: row["total"] for row in fraud_stats.totals_by_type(conn)})
+    labels = sorted(totals)
+    return {
+        "fraud_count": sum(totals.values()),
+        "chart_labels": labels,
+        "chart_values": [totals[label] for label in labels],
+    }
+
+
+def fraud_trend(conns, granularity="day", since=None, fraud_type=None):
+    totals = Counter()
+    for conn in _targets(conns):
+        totals.update({row["bucket"]: row["total"] for row in fraud_stats.trend(conn, granularity, since, fraud_type)})
+    labels = sorted(totals)
+    return {
+        "granularity": granularity,
+        "labels": labels,
+        "values": [totals[label] for label in labels],
+    }
+
+
+def top_fraud_cards(conns, limit=10):
+    limit = page_size(limit)
+    # Cards are disjoint across shards: the top N overall are among each shard's top N
+    cards = [dict(row) for conn in _targets(conns) for row in fraud_stats.top_cards(conn, limit)]
+    return sorted(cards, key=lambda card: card["total"], reverse=True)[:limit]
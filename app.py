@@ -1,11 +1,55 @@
-from flask import Flask, render_template, request, jsonify, Response
-import sqlite3
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from functools import wraps
-import atm_logic
-from atm_session import ATMSession
+import os
+import threading
+import admin_queries
+import atm_service
+import audit_writer
+import card_cache
+import card_index
+import db
+import exporter
+import geo
+import ledger
+import metrics
+import provision
+import rate_limiter
+import velocity
+from atm_session import store as session_store
+from migrations import migrate
 
 app = Flask(__name__)
-DB_NAME = "atmguard.db"
+
+# ---------------- STARTUP ----------------
+_started_pid = None
+_startup_lock = threading.Lock()
+
+
+def startup():
+    """
+    Migrates, warms this process's caches and starts the ledger reconciler,
+    once per serving process. Not done on import: pin_hasher's spawned pool
+    processes and scripts import this module too.
+    """
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _startup_lock:
+        if _started_pid == os.getpid():
+            return
+        migrate()
+        if card_index.ENABLED:
+            card_index.index.load()
+        if velocity.ENABLED:
+            velocity.store.warm()
+        if geo.ENABLED:
+            geo.history.warm()
+        if ledger.RECONCILE_INTERVAL > 0:
+            ledger.reconciler.start()
+        _started_pid = os.getpid()
+
+
+app.before_request(startup)
 
 # ---------------- SECURITY ----------------
 def check_auth(username, password):
@@ -30,23 +74,24 @@ def requires_auth(f):
 
 # ---------------- DATABASE ----------------
 def get_db():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def get_mini_statement(card_id, limit=5):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT amount, status, timestamp
-        FROM transactions
-        WHERE card_id = ?
-        ORDER BY timestamp DESC
-        LIMIT ?
-    """, (card_id, limit))
-    rows = cursor.fetchall()
-    db.close()
-    return rows
+    # Every shard: the admin readers scatter-gather across them
+    return db.shard_connections()
+
+
+@app.before_request
+def reset_db_stats():
+    db.reset_request_stats()
+    metrics.begin_request()
+
+
+@app.after_request
+def add_db_stats(response):
+    # Per-request DB cost, so connection/query reductions are visible
+    stats = db.request_stats()
+    response.headers["X-DB-Connects"] = str(stats["connects"])
+    response.headers["X-DB-Queries"] = str(stats["queries"])
+    metrics.end_request(request.url_rule.rule if request.url_rule else "unmatched", response.status_code)
+    return response
 
 # ---------------- ROUTES ----------------
 
@@ -57,116 +102,189 @@ def home():
 
 @app.route("/atm", methods=["POST"])
 def atm_api():
-    data = request.get_json()
-    card_id = data.get("card_id")
-    pin = data.get("pin")
-    transaction_type = data.get("transaction_type")
-    amount = int(data.get("amount", 0))
-    location = data.get("location", "UNKNOWN_ATM")
-    reset_session = data.get("reset", False)
+    payload, status, headers = atm_service.handle_atm(request.get_json(), request.remote_addr)
+    return jsonify(payload), status, headers
+
+
+# ---------------- ADMIN DASHBOARD ----------------
+@app.route("/admin")
+@requires_auth
+def admin_dashboard():
+    conn = get_db()
+
+    # Only the first page of each table; the page fetches the rest on scroll
+    fraud_logs, fraud_cursor = admin_queries.page_fraud_logs(conn)
+    cards, cards_cursor = admin_queries.page_cards(conn)
+    summary = admin_queries.fraud_summary(conn)
+
+    return render_template("admin.html", 
+                           fraud_logs=fraud_logs, 
+                           fraud_cursor=fraud_cursor,
+                           cards=cards,
+                           cards_cursor=cards_cursor,
+                           **summary)
+
+
+def _admin_page(fetch, **filters):
+    try:
+        items, next_cursor = fetch(
+            get_db(),
+            admin_queries.page_size(request.args.get("limit")),
+            cursor=request.args.get("cursor"),
+            **{name: request.args.get(name) for name in filters}
+        )
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+@app.route("/admin/api/fraud_logs")
+@requires_auth
+def admin_fraud_logs_api():
+    return _admin_page(admin_queries.page_fraud_logs, card_id=None, fraud_type=None, since=None, until=None)
+
+
+@app.route("/admin/api/transactions")
+@requires_auth
+def admin_transactions_api():
+    return _admin_page(admin_queries.page_transactions, card_id=None, since=None, until=None)
+
+
+@app.route("/admin/api/cards")
+@requires_auth
+def admin_cards_api():
+    return _admin_page(admin_queries.page_cards, status=None)
 
-    if not card_id:
-        return jsonify({"status": "error", "message": "Card ID required"}), 400
 
+@app.route("/admin/api/summary")
+@requires_auth
+def admin_summary_api():
+    return jsonify(admin_queries.fraud_summary(get_db()))
+
+
+@app.route("/admin/api/trend")
+@requires_auth
+def admin_trend_api():
     try:
-        # Start or retrieve session
-        # This connects the web app to the logic core
-        session = atm_logic.start_session(card_id)
-
-        # PIN VALIDATION
-        if pin:
-            atm_logic.verify_pin(session, pin)
-            # If no transaction type is specified, just confirm PIN
-            if not transaction_type:
-                return jsonify({"status": "success", "message": "PIN Accepted"})
-
-        # TRANSACTIONS
-        if transaction_type == "balance":
-            atm_logic.select_transaction(session, "balance")
-            balance = atm_logic.get_balance(session)
-            session.reset_for_next_transaction()
-            return jsonify({"status": "success", "message": f"Balance ₦{balance}"})
-
-        if transaction_type == "withdraw":
-            atm_logic.select_transaction(session, "withdraw")
-            atm_logic.enter_amount(session, amount)
-            
-            # Pass location to logic for fraud checks
-            session.current_location = location
-            
-            atm_logic.complete_transaction(session)
-            # If successful (no exception raised)
-            # We need the new balance to show to user
-            new_balance = atm_logic.get_balance(session)
-            session.reset_for_next_transaction()
-            return jsonify({"status": "success", "message": "Take your cash", "balance": new_balance})
-
-        if transaction_type == "mini":
-            # Mini statement is read-only, we can allow it if PIN verified?
-            # atm_logic doesn't enforce state for this, but ideally we should.
-            # For now, let's assume if they are in the session they are good.
-            statement = get_mini_statement(card_id)
-            return jsonify({"status": "success", "statement": [dict(row) for row in statement]})
+        trend = admin_queries.fraud_trend(
+            get_db(),
+            request.args.get("granularity", "day"),
+            since=request.args.get("since"),
+            fraud_type=request.args.get("fraud_type"),
+        )
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(trend)
+
 
+@app.route("/admin/api/top_cards")
+@requires_auth
+def admin_top_cards_api():
+    try:
+        cards = admin_queries.top_fraud_cards(get_db(), request.args.get("limit", 10))
     except Exception as e:
-        # Handle logic errors (fraud blocked, invalid pin, etc)
-        msg = str(e)
-        status = "blocked" if "blocked" in msg.lower() else "error"
-        return jsonify({"status": status, "message": msg})
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"items": cards})
 
-    return jsonify({"status": "error", "message": "Invalid transaction"}), 400
+@app.route("/admin/api/audit")
+@requires_auth
+def admin_audit_api():
+    return jsonify(audit_writer.writer.stats())
 
+@app.route("/admin/api/ledger")
+@requires_auth
+def admin_ledger_api():
+    return jsonify(ledger.reconciler.stats())
 
-# ---------------- ADMIN DASHBOARD ----------------
-@app.route("/admin")
+@app.route("/admin/export/<table>")
 @requires_auth
-def admin_dashboard():
-    db = get_db()
-    cursor = db.cursor()
-
-    # Get Logs
-    cursor.execute("SELECT * FROM fraud_log ORDER BY timestamp DESC")
-    fraud_logs = cursor.fetchall()
-
-    # Get Cards
-    cursor.execute("SELECT card_id, status, pin_attempts, balance FROM card")
-    cards = cursor.fetchall()
-
-    # Get Count
-    cursor.execute("SELECT COUNT(*) as total FROM fraud_log")
-    fraud_count = cursor.fetchone()["total"]
-
-    # Get Chart Data
-    cursor.execute("""
-        SELECT fraud_type, COUNT(*) as total
-        FROM fraud_log
-        GROUP BY fraud_type
-    """)
-    chart_rows = cursor.fetchall()
-    
-    db.close()
-
-    chart_labels = [row["fraud_type"] for row in chart_rows]
-    chart_values = [row["total"] for row in chart_rows]
+def admin_export(table):
+    fmt = request.args.get("format", "csv")
+    compress = request.args.get("gzip") in ("1", "true")
+    try:
+        parts = exporter.export(
+            table, fmt, request.args.get("since"), request.args.get("until"), compress
+        )
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-    return render_template("admin.html", 
-                           fraud_logs=fraud_logs, 
-                           cards=cards, 
-                           fraud_count=fraud_count,
-                           chart_labels=chart_labels,
-                           chart_values=chart_values)
+    return Response(
+        stream_with_context(parts),
+        mimetype="application/gzip" if compress else exporter.FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={exporter.filename(table, fmt, compress)}"},
+    )
+
+
+@app.route("/metrics")
+@requires_auth
+def metrics_endpoint():
+    audit = audit_writer.writer.stats()
+    sessions = session_store.stats()
+    gauges = {
+        "audit_queue_depth": audit.pop("queue_depth"),
+        "audit_queue_size": audit.pop("queue_size"),
+        "sessions_live": sessions.pop("live"),
+        "card_cache_cached": card_cache.store.stats()["cached"],
+        **{f"card_index_{name}": value for name, value in card_index.index.stats().items()
+           if name in ("cards", "filter_bits", "negative_cached")},
+    }
+    limiters = rate_limiter.stats()
+    gauges["rate_limiter_keys"] = {(("dimension", name),): value["keys"] for name, value in limiters.items()}
+    counters = {
+        **{f"db_{name}_total": value for name, value in db.total_stats().items()},
+        **{f"audit_{name}_total": value for name, value in audit.items()},
+        **{f"sessions_{name}_total": value for name, value in sessions.items()},
+        **{f"card_index_{name}_total": value for name, value in card_index.index.stats().items()
+           if name not in ("cards", "filter_bits", "negative_cached")},
+        **{f"card_cache_{name}_total": value for name, value in card_cache.store.stats().items() if name != "cached"},
+        **{f"ledger_reconcile_{name}_total": value for name, value in ledger.reconciler.stats().items()
+           if name != "recent_mismatches"},
+    }
+    return Response(metrics.render(gauges, counters), mimetype="text/plain; version=0.0.4")
 
 # ---------------- ADMIN ACTIONS ----------------
 
 @app.route("/admin/unblock/<card_id>", methods=["POST"])
 @requires_auth
 def unblock_card_route(card_id):
-    db = get_db()
-    db.execute("UPDATE card SET status='active', pin_attempts=0 WHERE card_id=?", (card_id,))
-    db.commit()
-    db.close()
+    card_cache.store.update(None, card_id, "status = 'active', pin_attempts = 0")
     return jsonify({"status": "success", "message": f"Card {card_id} unblocked"})
 
 
+@app.route("/admin/cards/bulk", methods=["POST"])
+@requires_auth
+def bulk_card_action_route():
+    # {"action": "block" | "unblock" | "reset_attempts",
+    #  "card_ids": [...] and/or "filter": {"status": ..., "min_attempts": ...}}
+    data = request.get_json(silent=True) or {}
+    filters = data.get("filter") or {}
+    try:
+        updated = provision.bulk_update(
+            data.get("action"), data.get("card_ids"), filters.get("status"), filters.get("min_attempts")
+        )
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "action": data["action"], "updated": updated})
+
+
+@app.route("/admin/cards/import", methods=["POST"])
+@requires_auth
+def import_cards_route():
+    # CSV as the "file" form field or as the raw request body
+    upload = request.files.get("file")
+    job_id = provision.save_upload(upload.stream if upload else request.stream)
+    provision.start_job(job_id)
+    return jsonify({"status": "accepted", "job": provision.get_job(job_id)}), 202
+
+
+@app.route("/admin/cards/import/<int:job_id>")
+@requires_auth
+def import_status_route(job_id):
+    job = provision.get_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"No provisioning job {job_id}"}), 404
+    return jsonify(job)
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,212 @@
+"""
+asyncio (ASGI) entry point with the same HTTP contract as app.py:
+
+    ATMGUARD_SESSION_BACKEND=sqlite ATMGUARD_VELOCITY_CACHE=0 \
+        uvicorn asgi_app:application --workers 4
+
+Each worker is a separate process: ATM sessions must live in SQLite for a
+card's next request to find its session on another worker, and the
+per-process fraud counters must be off. A single worker can keep the
+defaults.
+
+POST /atm is served natively: the body is read on the event loop, so slow or
+idle ATM connections cost a coroutine rather than a thread, and only the
+handler itself (SQLite work) runs on the DB_THREADS executor. PIN checks
+inside it are already sent to pin_hasher's process pool. Every other path
+(admin pages, JSON APIs, exports, /metrics) is bridged to the Flask app on
+the same executor, streaming responses chunk by chunk.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import app as flask_app
+import atm_service
+import audit_writer
+import db
+import metrics
+
+DB_THREADS = int(os.environ.get("ATMGUARD_ASGI_DB_THREADS", 32))
+MAX_BODY_BYTES = 64 * 1024
+
+_executor = ThreadPoolExecutor(DB_THREADS, thread_name_prefix="atm-db")
+
+
+# ---------------- HTTP HELPERS ----------------
+async def read_body(receive, limit=MAX_BODY_BYTES):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            raise ValueError("Request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *[(name.lower().encode(), value.encode()) for name, value in headers],
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _client_ip(scope):
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+# ---------------- /atm ----------------
+def _run_atm(data, remote_addr):
+    # On an executor thread: per-request DB counters and metrics are thread-local
+    flask_app.startup()
+    db.reset_request_stats()
+    metrics.begin_request()
+    payload, status, headers = atm_service.handle_atm(data, remote_addr)
+    stats = db.request_stats()
+    metrics.end_request("/atm", status)
+    return payload, status, {
+        **headers,
+        "X-DB-Connects": str(stats["connects"]),
+        "X-DB-Queries": str(stats["queries"]),
+    }
+
+
+async def atm_endpoint(scope, receive, send):
+    try:
+        body = await read_body(receive)
+    except ValueError as e:
+        await send_json(send, 413, {"status": "error", "message": str(e)})
+        return
+    if body is None:
+        return
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        await send_json(send, 400, {"status": "error", "message": "Invalid JSON body"})
+        return
+
+    loop = asyncio.get_running_loop()
+    payload, status, headers = await loop.run_in_executor(_executor, _run_atm, data, _client_ip(scope))
+    await send_json(send, status, payload, headers.items())
+
+
+# ---------------- WSGI BRIDGE ----------------
+def _environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": _client_ip(scope) or "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _run_wsgi(environ, loop, queue):
+    # The whole response runs on one executor thread, as under a WSGI server:
+    # streamed exports hold a SQLite connection that must stay on its thread
+    def put(item):
+        # Blocks while the client is slow to read (bounded queue)
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def start_response(status, headers, exc_info=None):
+        put((int(status.split(" ", 1)[0]), [(name.lower().encode(), value.encode()) for name, value in headers]))
+
+    try:
+        result = flask_app.app.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    put(chunk)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+    finally:
+        put(None)
+
+
+async def wsgi_bridge(scope, receive, send):
+    body = await read_body(receive, limit=sys.maxsize)
+    if body is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=8)
+    done = loop.run_in_executor(_executor, _run_wsgi, _environ(scope, body), loop, queue)
+    started = await queue.get()
+    if started is None:
+        await done  # re-raises whatever stopped the app before start_response
+        return
+    status, headers = started
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    while (chunk := await queue.get()) is not None:
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+    await done
+
+
+# ---------------- APPLICATION ----------------
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Before the first request rather than during it
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, flask_app.startup)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, audit_writer.writer.close)
+            _executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/atm" and scope["method"] == "POST":
+        await atm_endpoint(scope, receive, send)
+    else:
+        await wsgi_bridge(scope, receive, send)
@@ -17,16 +17,8 @@ from fraud_logger import (
 
 from security_checks import is_card_blocked
 from fraud_rules import check_withdrawal_fraud
-import sqlite3
-import os
-
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_NAME = os.path.join(BASE_DIR, "atmguard.db")
-
-
-def get_connection():
-    return sqlite3.connect(DB_NAME, isolation_level=None)
+from db import card_connection
+import velocity
 
 
 # ---------------- STEP 1: PIN ----------------
@@ -79,20 +71,20 @@ def enter_amount(card_id, amount):
     # -------- FRAUD ANALYSIS --------
     fraud_reasons = check_withdrawal_fraud(card_id, amount)
 
-    conn = get_connection()
+    conn = card_connection(card_id)
     cursor = conn.cursor()
 
     cursor.execute("""
-        INSERT INTO transactions (card_id, amount)
-        VALUES (?, ?)
+        INSERT INTO transactions (card_id, type, amount)
+        VALUES (?, 'withdraw', ?)
     """, (card_id, amount))
+    velocity.store.record_transaction(card_id, amount, "withdraw")
 
     if fraud_reasons:
         for reason in fraud_reasons:
             log_fraud(card_id, reason)
 
     update_state(card_id, AMOUNT_ENTERED)
-    conn.close()
 
     if fraud_reasons:
         return f"Transaction flagged: {', '.join(fraud_reasons)}"
@@ -2,18 +2,36 @@ from atm_session import ATMSession, get_session
 from atm_states import ATMState
 from fraud_engine import check_fraud
 from datetime import datetime
-from werkzeug.security import check_password_hash
-import sqlite3
+import logging
+import card_cache
+import card_index
+import card_profile
+import geo
+import ledger
+import metrics
+import pin_hasher
+from db import card_connection, transaction
+import velocity
 
 MAX_PIN_ATTEMPTS = 3
 
+logger = logging.getLogger(__name__)
+
 def start_session(card_id: str):
+    # Unknown cards get neither an atm_session row nor a session
+    if not card_index.index.might_exist(card_id):
+        card_index.index.reject(card_id)
+        raise Exception("Card not found")
+
     # Log session start for fraud detection
-    conn = sqlite3.connect("atmguard.db")
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO atm_session (card_id, state) VALUES (?, ?)", (card_id, "STARTED"))
-    conn.commit()
-    conn.close()
+    # Local time, like every other timestamp the fraud windows compare against
+    now = datetime.now()
+    conn = card_connection(card_id)
+    conn.execute(
+        "INSERT INTO atm_session (card_id, state, created_at) VALUES (?, ?, ?)",
+        (card_id, "STARTED", now.strftime("%Y-%m-%d %H:%M:%S"))
+    )
+    velocity.store.record_session(card_id, now)
     
     # Return in-memory session
     session = get_session(card_id)
@@ -31,79 +49,97 @@ def start_session(card_id: str):
     return session
 
 def get_balance(session: ATMSession):
-    conn = session.get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT balance FROM card WHERE card_id=?", (session.card_id,))
-    row = cursor.fetchone()
-    conn.close()
-    if row:
-        return row[0]
+    # Snapshot + ledger tail, the balance of record
+    balance = ledger.balance(session.get_db(), session.card_id)
+    if balance is not None:
+        return balance
+    card_index.index.mark_missing(session.card_id)
     raise Exception("Card not found")
 
 def update_balance(session: ATMSession, new_balance):
-    conn = session.get_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE card SET balance=? WHERE card_id=?", (new_balance, session.card_id))
-    conn.commit()
-    conn.close()
-
-def block_card(card_id, reason):
-    conn = sqlite3.connect("atmguard.db")
-    cursor = conn.cursor()
-    cursor.execute("UPDATE card SET status='blocked' WHERE card_id=?", (card_id,))
-    cursor.execute("""
-        INSERT INTO fraud_log (card_id, fraud_type, action_taken, timestamp)
-        VALUES (?, ?, ?, ?)
-    """, (card_id, reason, "Card blocked", datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
-    conn.close()
-
+    with transaction(session.get_db()) as conn:
+        row = conn.execute("SELECT balance FROM card WHERE card_id = ?", (session.card_id,)).fetchone()
+        if row is None:
+            raise Exception("Card not found")
+        card_cache.store.update(conn, session.card_id, "balance = ?", (new_balance,))
+        ledger.append(conn, session.card_id, new_balance - (row[0] or 0), "adjustment")
+
+def debit_balance(conn, card_id, amount, txn_id=None):
+    # Conditional update against the row itself, never the cache: concurrent
+    # withdrawals can not overdraw the card, nor debit one blocked elsewhere
+    card = card_cache.store.update(
+        conn, card_id, "balance = balance - ?", (amount,),
+        where=" AND balance >= ? AND status != 'blocked'", where_params=(amount,)
+    )
+    if card is None:
+        status = conn.execute("SELECT status FROM card WHERE card_id = ?", (card_id,)).fetchone()
+        if status and status[0] == "blocked":
+            raise Exception("Card is blocked")
+        raise Exception("Insufficient balance")
+    # Same transaction as the guard update, so card.balance and the ledger move together
+    ledger.append(conn, card_id, -amount, "withdraw", txn_id)
+
+def block_card(card_id, reason, conn=None):
+    with transaction(conn or card_connection(card_id)) as conn:
+        card_cache.store.update(conn, card_id, "status = 'blocked'")
+        conn.execute("""
+            INSERT INTO fraud_log (card_id, fraud_type, action_taken, timestamp)
+            VALUES (?, ?, ?, ?)
+        """, (card_id, reason, "Card blocked", datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+@metrics.timed("verify_pin_seconds")
 def verify_pin(session: ATMSession, pin: str):
     # Allow re-verification if already verified
     if session.state != ATMState.PIN_VERIFIED:
         session.require_state(ATMState.CARD_INSERTED)
     
     conn = session.get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT pin, pin_attempts, status FROM card WHERE card_id=?", (session.card_id,))
-    row = cursor.fetchone()
-    if not row:
+    card = card_cache.store.get(session.card_id, conn)
+    if not card:
+        card_index.index.mark_missing(session.card_id)
         raise Exception("Card not found")
-    db_pin, attempts, status = row
+    db_pin, attempts, status = card["pin"], card["pin_attempts"], card["status"]
     if status == "blocked":
         raise Exception("Card is blocked")
     
-    # Try verifying as hash first, fallback to plaintext (for migration safety)
-    is_valid = False
-    if db_pin.startswith("scrypt:") or db_pin.startswith("pbkdf2:"):
-        is_valid = check_password_hash(db_pin, pin)
-    else:
-        is_valid = (db_pin == pin)
+    # Hashes are checked in the hashing pool; plaintext rows still compare (migration safety)
+    is_valid = pin_hasher.check_pin(db_pin, pin)
 
     if is_valid:
         session.state = ATMState.PIN_VERIFIED
         session.touch()
         # Reset attempts on success
         if attempts > 0:
-            cursor.execute("UPDATE card SET pin_attempts=0 WHERE card_id=?", (session.card_id,))
-            conn.commit()
-        conn.close()
+            card_cache.store.update(conn, session.card_id, "pin_attempts = 0")
+        # Upgrade plaintext or outdated hash parameters while we know the PIN.
+        # Best effort: the PIN is already verified, so a busy pool or a failed
+        # rehash only leaves the upgrade to the next login
+        if pin_hasher.needs_rehash(db_pin):
+            try:
+                new_pin = pin_hasher.try_hash_pin(pin)
+                if new_pin is not None:
+                    card_cache.store.update(
+                        conn, session.card_id, "pin = ?", (new_pin,),
+                        where=" AND pin = ?", where_params=(db_pin,)
+                    )
+            except Exception:
+                logger.exception("PIN rehash failed for card %s, retrying at next login", session.card_id)
         return
 
-    # If invalid, increment attempts but KEEP session alive
-    attempts += 1
+    # If invalid, increment attempts but KEEP session alive. Counted in the
+    # row itself, as the cached count may lag another worker's attempts.
+    card = card_cache.store.update(
+        conn, session.card_id,
+        "pin_attempts = pin_attempts + 1, status = CASE WHEN pin_attempts + 1 >= ? THEN 'blocked' ELSE status END",
+        (MAX_PIN_ATTEMPTS,)
+    )
+    attempts = card["pin_attempts"]
     
     # Refresh session activity immediately to prevent timeout race condition
     session.touch()
 
     if attempts >= MAX_PIN_ATTEMPTS:
-        cursor.execute("UPDATE card SET status='blocked', pin_attempts=? WHERE card_id=?", (attempts, session.card_id))
-        conn.commit()
-        conn.close()
         raise Exception("Card blocked due to multiple wrong PIN attempts")
-    cursor.execute("UPDATE card SET pin_attempts=? WHERE card_id=?", (attempts, session.card_id))
-    conn.commit()
-    conn.close()
     
     raise Exception(f"Invalid PIN ({attempts}/{MAX_PIN_ATTEMPTS})")
 
@@ -126,50 +162,64 @@ def enter_amount(session: ATMSession, amount: float):
     session.state = ATMState.AMOUNT_ENTERED
     session.touch()
 
+@metrics.timed("complete_transaction_seconds")
 def complete_transaction(session: ATMSession):
     session.check_timeout()
-    fraud = check_fraud(
-        card_id=session.card_id,
-        amount=session.amount or 0,
-        transaction_type=session.selected_transaction,
-        location=session.current_location
-    )
+    blocked = False
 
     try:
-        if fraud.action == "BLOCK":
-            block_card(session.card_id, ", ".join(fraud.reasons))
+        # Fraud reads, debit and all log inserts share one write transaction
+        with transaction(session.get_db()) as conn:
+            fraud = check_fraud(
+                card_id=session.card_id,
+                amount=session.amount or 0,
+                transaction_type=session.selected_transaction,
+                location=session.current_location,
+                conn=conn
+            )
+
+            if fraud.action == "BLOCK":
+                block_card(session.card_id, ", ".join(fraud.reasons), conn=conn)
+                blocked = True
+            else:
+                completed_at = datetime.now()
+                now = completed_at.strftime("%Y-%m-%d %H:%M:%S")
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO transactions (card_id, type, amount, status, timestamp, location)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (
+                    session.card_id,
+                    session.selected_transaction,
+                    session.amount or 0,
+                    "FLAGGED" if fraud.reasons else "COMPLETED",
+                    now,
+                    session.current_location
+                ))
+                if session.selected_transaction == "withdraw" and session.amount:
+                    # Rolls the transaction row back too if the debit is refused
+                    debit_balance(conn, session.card_id, session.amount, txn_id=cursor.lastrowid)
+                    card_profile.record(
+                        conn, session.card_id, session.amount, completed_at, session.current_location
+                    )
+                cursor.executemany("""
+                    INSERT INTO fraud_log (card_id, fraud_type, action_taken, timestamp)
+                    VALUES (?, ?, ?, ?)
+                """, [
+                    (session.card_id, reason, "Transaction flagged", now)
+                    for reason in fraud.reasons
+                ])
+                # Recorded while the write lock is held so the next withdrawal
+                # on this card already sees it
+                velocity.store.record_transaction(
+                    session.card_id, session.amount or 0, session.selected_transaction, completed_at
+                )
+                geo.history.record(session.card_id, session.current_location, completed_at)
+
+        # Committed: the next read reloads the debited / blocked row
+        card_cache.store.invalidate(session.card_id)
+        if blocked:
             raise Exception("Transaction blocked due to suspected fraud")
-
-        if session.selected_transaction == "withdraw" and session.amount:
-            balance = get_balance(session)
-            update_balance(session, balance - session.amount)
-
-        # Log transaction
-        conn = session.get_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO transactions (card_id, type, amount, status, timestamp, location)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            session.card_id,
-            session.selected_transaction,
-            session.amount or 0,
-            "FLAGGED" if fraud.reasons else "COMPLETED",
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            session.current_location
-        ))
-        for reason in fraud.reasons:
-            cursor.execute("""
-                INSERT INTO fraud_log (card_id, fraud_type, action_taken, timestamp)
-                VALUES (?, ?, ?, ?)
-            """, (
-                session.card_id,
-                reason,
-                "Transaction flagged",
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ))
-        conn.commit()
-        conn.close()
         session.state = ATMState.COMPLETED
     except Exception as e:
         # Reset session state to allow recovery even on errors
@@ -1,11 +1,27 @@
+import heapq
+import os
+import threading
 import time
-import sqlite3
+from collections import OrderedDict
 from atm_states import ATMState
+from db import card_connection, get_connection, shard_connections
 
 SESSION_TIMEOUT = 30  # seconds for testing
+# Idle sessions are kept a while past the timeout so the customer still gets
+# "Session expired" rather than a fresh session, then swept
+SESSION_RETENTION = SESSION_TIMEOUT * 10
+MAX_SESSIONS = 10000
+# "memory" (single worker) or "sqlite" (state shared by every worker/process)
+SESSION_BACKEND = os.environ.get("ATMGUARD_SESSION_BACKEND", "memory")
+SWEEP_INTERVAL = 10  # seconds between expiry sweeps of the sqlite backend
 
 class ATMSession:
-    def __init__(self, card_id: str, db_path="atmguard.db"):
+    __slots__ = (
+        "card_id", "state", "pin_attempts", "selected_transaction", "amount",
+        "last_activity", "db_path", "current_location", "version"
+    )
+
+    def __init__(self, card_id: str, db_path=None):
         self.card_id = card_id
         self.state = ATMState.CARD_INSERTED
         self.pin_attempts = 0
@@ -14,6 +30,8 @@ class ATMSession:
         self.last_activity = time.time()
         self.db_path = db_path
         self.current_location = "UNKNOWN"
+        # Row version the session was loaded at (shared backends only)
+        self.version = 0
 
     def touch(self):
         self.last_activity = time.time()
@@ -49,22 +67,195 @@ class ATMSession:
         self.touch()
 
     def get_db(self):
-        return sqlite3.connect(self.db_path)
+        # The card's shard unless a database was given explicitly
+        return get_connection(self.db_path) if self.db_path else card_connection(self.card_id)
+
+class SessionConflict(Exception):
+    pass
+
+class SessionStore:
+    """
+    Bounded in-memory session store. Least recently used sessions are evicted
+    when full; idle ones are swept via an expiry heap on every access.
+    """
+    def __init__(self, max_size=MAX_SESSIONS, retention=SESSION_RETENTION):
+        self.max_size = max_size
+        self.retention = retention
+        self._sessions = OrderedDict()
+        # (deadline, seq, session); entries for replaced sessions are skipped
+        self._expiry = []
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, card_id: str) -> ATMSession:
+        with self._lock:
+            self._sweep(time.time())
+            session = self._sessions.get(card_id)
+            if session is not None:
+                self._sessions.move_to_end(card_id)
+                return session
+
+            session = self._sessions[card_id] = ATMSession(card_id)
+            self.created += 1
+            self._schedule(session)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+            if len(self._expiry) > 2 * self.max_size:
+                self._rebuild_heap()
+            return session
+
+    def save(self, session):
+        # Sessions are shared objects in this process; nothing to persist
+        pass
+
+    def sweep(self):
+        with self._lock:
+            self._sweep(time.time())
+
+    def _schedule(self, session):
+        self._seq += 1
+        heapq.heappush(self._expiry, (session.last_activity + self.retention, self._seq, session))
+
+    def _sweep(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, _, session = heapq.heappop(self._expiry)
+            if self._sessions.get(session.card_id) is not session:
+                continue  # evicted or replaced since it was scheduled
+            if session.last_activity + self.retention > now:
+                self._schedule(session)  # touched since; check again later
+                continue
+            del self._sessions[session.card_id]
+            self.expired += 1
+
+    def _rebuild_heap(self):
+        # Drops entries left behind by evicted sessions (card-ID scanning)
+        self._expiry = []
+        for session in self._sessions.values():
+            self._schedule(session)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "live": len(self._sessions),
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+    def __len__(self):
+        return len(self._sessions)
 
-# Global storage for active sessions (in-memory for simplicity)
-_sessions = {}
+
+class SQLiteSessionStore:
+    """
+    Session state in the session_state table, so any worker can serve any
+    request. Each request works on its own copy; save() writes it back only if
+    nobody else saved the same session in between (optimistic versioning).
+    """
+    def __init__(self, retention=SESSION_RETENTION, sweep_interval=SWEEP_INTERVAL):
+        self.retention = retention
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0
+        self.created = 0
+        self.expired = 0
+        self.conflicts = 0
+
+    def get(self, card_id: str) -> ATMSession:
+        now = time.time()
+        if now >= self._next_sweep:
+            self.sweep()
+
+        conn = card_connection(card_id)
+        row = conn.execute("""
+            SELECT state, pin_attempts, selected_transaction, amount,
+                   last_activity, current_location, version
+            FROM session_state WHERE card_id = ?
+        """, (card_id,)).fetchone()
+
+        session = ATMSession(card_id)
+        if row is None:
+            conn.execute("""
+                INSERT OR IGNORE INTO session_state
+                    (card_id, state, pin_attempts, last_activity, current_location, version)
+                VALUES (?, ?, 0, ?, ?, 0)
+            """, (card_id, session.state.name, session.last_activity, session.current_location))
+            self.created += 1
+            return session
+
+        session.state = ATMState[row["state"]]
+        session.pin_attempts = row["pin_attempts"]
+        session.selected_transaction = row["selected_transaction"]
+        session.amount = row["amount"]
+        session.last_activity = row["last_activity"]
+        session.current_location = row["current_location"]
+        session.version = row["version"]
+        return session
+
+    def save(self, session):
+        cursor = card_connection(session.card_id).execute("""
+            UPDATE session_state
+            SET state = ?, pin_attempts = ?, selected_transaction = ?, amount = ?,
+                last_activity = ?, current_location = ?, version = version + 1
+            WHERE card_id = ? AND version = ?
+        """, (
+            session.state.name, session.pin_attempts, session.selected_transaction,
+            session.amount, session.last_activity, session.current_location,
+            session.card_id, session.version
+        ))
+        if cursor.rowcount == 0:
+            self.conflicts += 1
+            raise SessionConflict("Session is busy on another terminal request, please retry")
+        session.version += 1
+
+    def sweep(self):
+        now = time.time()
+        for conn in shard_connections():
+            cursor = conn.execute(
+                "DELETE FROM session_state WHERE last_activity < ?", (now - self.retention,)
+            )
+            self.expired += cursor.rowcount
+        self._next_sweep = now + self.sweep_interval
+
+    def stats(self):
+        live = sum(
+            conn.execute("SELECT COUNT(*) FROM session_state").fetchone()[0] for conn in shard_connections()
+        )
+        return {
+            "live": live,
+            "created": self.created,
+            "expired": self.expired,
+            "conflicts": self.conflicts,
+        }
+
+
+SESSION_BACKENDS = {
+    "memory": SessionStore,
+    "sqlite": SQLiteSessionStore,
+}
+
+# Global storage for active sessions
+store = SESSION_BACKENDS[SESSION_BACKEND]()
 
 def get_session(card_id: str) -> ATMSession:
-    if card_id not in _sessions:
-        _sessions[card_id] = ATMSession(card_id)
-    return _sessions[card_id]
+    return store.get(card_id)
+
+def save_session(session: ATMSession):
+    store.save(session)
 
 def get_current_state(card_id: str):
     session = get_session(card_id)
-    session.check_timeout()
+    try:
+        session.check_timeout()
+    finally:
+        save_session(session)
     return session.state
 
 def update_state(card_id: str, new_state: ATMState):
     session = get_session(card_id)
     session.state = new_state
     session.touch()
+    save_session(session)
@@ -0,0 +1,173 @@
+"""
+Background writer for fraud_log audit events.
+
+log_fraud() only enqueues; one thread per process drains the queue and
+inserts events in batched transactions, flushing every BATCH_SIZE events or
+FLUSH_INTERVAL seconds and once more at exit. The queue is bounded: when the
+database cannot keep up, new events are dropped and counted rather than
+stalling requests. An event identical to one accepted for the same card in
+the last DEDUP_WINDOW seconds is skipped, so hammering a blocked card costs
+one row per window instead of one fsync per request.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from db import get_connection, shard_path, transaction
+
+ENABLED = os.environ.get("ATMGUARD_AUDIT_ASYNC", "1") != "0"
+QUEUE_SIZE = 10000
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5
+DEDUP_WINDOW = 60
+MAX_DEDUP_KEYS = 50000
+
+INSERT_SQL = """
+    INSERT INTO fraud_log (card_id, fraud_type, action_taken, timestamp)
+    VALUES (?, ?, ?, ?)
+"""
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AuditWriter:
+    def __init__(self, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, dedup_window=DEDUP_WINDOW):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dedup_window = dedup_window
+        self.queue = queue.Queue(queue_size)
+
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # (card_id, fraud_type, action_taken) -> monotonic time last accepted
+        self._recent = OrderedDict()
+
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.deduplicated = 0
+        self.failed = 0
+
+    # ---------------- PRODUCER ----------------
+    def _ensure_thread(self):
+        # A forked worker inherits the queue but not the thread
+        if self._thread is None or self._pid != os.getpid():
+            self.queue = queue.Queue(self.queue.maxsize)
+            self._recent.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _is_duplicate(self, key, now):
+        seen = self._recent.get(key)
+        if seen is not None and now - seen < self.dedup_window:
+            return True
+        self._recent[key] = now
+        self._recent.move_to_end(key)
+        # Oldest first, so stop at the first entry still inside the window
+        while self._recent:
+            oldest_key, oldest = next(iter(self._recent.items()))
+            if now - oldest < self.dedup_window and len(self._recent) <= MAX_DEDUP_KEYS:
+                break
+            del self._recent[oldest_key]
+        return False
+
+    def submit(self, card_id, fraud_type, action_taken="Logged", timestamp=None):
+        """
+        Queues one fraud_log row. Returns False if it was deduplicated or dropped.
+        """
+        timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._ensure_thread()
+            if self._is_duplicate((card_id, fraud_type, action_taken), time.monotonic()):
+                self.deduplicated += 1
+                return False
+            try:
+                self.queue.put_nowait((card_id, fraud_type, action_taken, timestamp))
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self.enqueued += 1
+        return True
+
+    # ---------------- CONSUMER ----------------
+    def _run(self):
+        work = self.queue
+        while True:
+            batch = [work.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(work.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is _STOP
+            rows = [row for row in batch if row is not _STOP]
+            if rows:
+                self._write(rows)
+            for _ in batch:
+                work.task_done()
+            if stop:
+                return
+
+    def _write(self, rows):
+        # One transaction per shard the batch touches
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(shard_path(row[0]), []).append(row)
+        for path, shard_rows in by_shard.items():
+            try:
+                with transaction(get_connection(path)) as conn:
+                    conn.executemany(INSERT_SQL, shard_rows)
+            except Exception:
+                self.failed += len(shard_rows)
+                logger.exception("Failed to write %d audit events", len(shard_rows))
+                continue
+            self.written += len(shard_rows)
+        self.batches += 1
+
+    # ---------------- CONTROL ----------------
+    def flush(self):
+        """
+        Blocks until everything queued so far has been written.
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            thread, self._thread = self._thread, None
+        self.queue.put(_STOP)
+        thread.join()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+        }
+
+
+writer = AuditWriter()
+atexit.register(writer.close)
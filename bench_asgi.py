@@ -0,0 +1,170 @@
+"""
+Compares the Flask (WSGI) and asyncio (ASGI) front ends under many slow ATMs.
+
+Each simulated ATM takes --upload-delay seconds to send every request body,
+as ATMs on poor links do. A sync WSGI server holds one of its --threads
+threads for that whole time; the ASGI app waits on the event loop and only
+uses a DB thread once the body has arrived. Both apps are driven in process
+against the same seeded database, one flow (PIN, balance, withdraw, mini
+statement) per card:
+
+    python bench_asgi.py --atms 400 --threads 16 --upload-delay 0.2 --json asgi.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_atm import flow_steps, percentile, seed_database
+
+
+def _latency_stats(values):
+    values = sorted(values)
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+    }
+
+
+def _report(name, requests, flows, seconds, ok):
+    return {
+        "front_end": name,
+        "requests": len(requests),
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(requests) / seconds, 1),
+        "flow_success_rate": round(sum(ok) / len(ok), 4),
+        "request": _latency_stats(requests),
+        "flow": _latency_stats(flows),
+    }
+
+
+# ---------------- FLASK ----------------
+def run_flask(card_ids, threads, upload_delay):
+    from app import app, startup
+
+    startup()
+    clients = threading.local()
+    requests, flows, ok = [], [], []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def flow(index):
+        client = getattr(clients, "client", None)
+        if client is None:
+            client = clients.client = app.test_client()
+        success = True
+        for _, payload in flow_steps(card_ids[index], f"BENCH_ATM_{index % 8}"):
+            # A sync worker thread is busy while the body trickles in
+            time.sleep(upload_delay)
+            request_started = time.perf_counter()
+            response = client.post("/atm", json=payload)
+            with lock:
+                requests.append(time.perf_counter() - request_started + upload_delay)
+            success = success and response.get_json().get("status") == "success"
+        with lock:
+            flows.append(time.perf_counter() - started)
+            ok.append(success)
+
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(flow, range(len(card_ids))))
+    return _report("flask", requests, flows, time.perf_counter() - started, ok)
+
+
+# ---------------- ASGI ----------------
+async def _asgi_post(application, payload, upload_delay):
+    body = json.dumps(payload).encode()
+    delivered = False
+    response = {}
+
+    async def receive():
+        nonlocal delivered
+        if delivered:
+            await asyncio.Event().wait()
+        await asyncio.sleep(upload_delay)
+        delivered = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["body"] = response.get("body", b"") + message.get("body", b"")
+
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/atm", "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    await application(scope, receive, send)
+    return response["status"], json.loads(response["body"])
+
+
+async def _run_asgi(card_ids, upload_delay):
+    from app import startup
+    from asgi_app import application
+
+    startup()
+    requests, flows, ok = [], [], []
+    started = time.perf_counter()
+
+    async def flow(index):
+        success = True
+        for _, payload in flow_steps(card_ids[index], f"BENCH_ATM_{index % 8}"):
+            request_started = time.perf_counter()
+            _, body = await _asgi_post(application, payload, upload_delay)
+            requests.append(time.perf_counter() - request_started)
+            success = success and body.get("status") == "success"
+        flows.append(time.perf_counter() - started)
+        ok.append(success)
+
+    await asyncio.gather(*(flow(index) for index in range(len(card_ids))))
+    return _report("asgi", requests, flows, time.perf_counter() - started, ok)
+
+
+def run_asgi(card_ids, upload_delay):
+    return asyncio.run(_run_asgi(card_ids, upload_delay))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the Flask and ASGI front ends under slow clients")
+    parser.add_argument("--atms", type=int, default=400, help="concurrent ATMs, one flow (card) each")
+    parser.add_argument("--threads", type=int, default=16, help="WSGI worker threads (gunicorn --threads)")
+    parser.add_argument("--upload-delay", type=float, default=0.2, help="seconds each request body takes to arrive")
+    parser.add_argument("--front-ends", nargs="+", default=["flask", "asgi"], choices=["flask", "asgi"])
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    # Both front ends share the process: one database, a separate card range each
+    path = os.path.join(tempfile.mkdtemp(prefix="atmguard-bench-"), "bench.db")
+    card_ids = seed_database(path, args.atms * len(args.front_ends))
+    os.environ["ATMGUARD_RATE_LIMITS"] = "0"
+    os.environ["ATMGUARD_PIN_MAX_CONCURRENT"] = str(args.atms)
+
+    results = []
+    for offset, front_end in enumerate(args.front_ends):
+        cards = card_ids[offset * args.atms:(offset + 1) * args.atms]
+        if front_end == "flask":
+            result = run_flask(cards, args.threads, args.upload_delay)
+        else:
+            result = run_asgi(cards, args.upload_delay)
+        result["config"] = {"atms": args.atms, "threads": args.threads, "upload_delay": args.upload_delay}
+        results.append(result)
+        print(
+            f"{front_end:<6} {result['requests_per_second']:>8} req/s  "
+            f"request p50/p95/p99 {result['request']['p50_ms']}/{result['request']['p95_ms']}/{result['request']['p99_ms']} ms  "
+            f"flow p95 {result['flow']['p95_ms']} ms  {result['flow_success_rate']:.1%} ok"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
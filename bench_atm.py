@@ -0,0 +1,265 @@
+"""
+Load test for the /atm endpoint, in process through the Flask test client.
+
+Seeds a throwaway database with synthetic cards and transaction history, then
+runs PIN -> balance -> withdraw -> mini-statement flows from many simulated
+ATMs at once and reports latency percentiles, throughput and DB queries per
+request (from the X-DB-Queries header), overall and per step:
+
+    python bench_atm.py --cards 2000 --history 50 --concurrency 16 --json after.json
+    python bench_atm.py --json after.json --compare before.json
+
+Every flow's login runs a full scrypt check: pin_hasher only caches failed
+checks. Cards share one PIN hash to keep seeding fast; --distinct-pins
+hashes every card's PIN separately, which only changes the seeding cost.
+--shards N seeds N shard files and runs the app against them
+(ATMGUARD_SHARDS).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BENCH_PIN = "1234"
+HISTORY_DAYS = 30
+SEED_CHUNK = 10000
+
+STEPS = ("pin", "balance", "withdraw", "mini")
+
+
+# ---------------- SEEDING ----------------
+def seed_database(path, cards, history=0, distinct_pins=False, shards=1):
+    """
+    Creates cards BENCH000000.. with BENCH_PIN and `history` past withdrawals
+    each, spread over the last HISTORY_DAYS days (never today, so the daily
+    limit and velocity rules start from zero). With shards > 1 each card is
+    seeded into its shard's file next to path.
+    """
+    os.environ["ATMGUARD_DB"] = path
+    os.environ["ATMGUARD_SHARDS"] = str(shards)
+    import db
+    import pin_hasher
+    from migrations import migrate
+
+    conns = [db.connect(shard) for shard in db.shard_paths(path, shards)]
+    for index, conn in enumerate(conns):
+        migrate(conn)
+        with db.transaction(conn):
+            db.reserve_ids(conn, index * db.ID_RANGE)
+
+    card_ids = [f"BENCH{i:06d}" for i in range(cards)]
+    if distinct_pins:
+        pin_hashes = pin_hasher.hash_pins([BENCH_PIN] * cards)
+    else:
+        pin_hashes = [pin_hasher.hash_pins([BENCH_PIN])[0]] * cards
+    for index, conn in enumerate(conns):
+        with db.transaction(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO card (card_id, pin, status, pin_attempts, balance) VALUES (?, ?, 'active', 0, 1000000)",
+                [card for card in zip(card_ids, pin_hashes) if db.shard_of(card[0], shards) == index]
+            )
+
+    rng = random.Random(cards)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = (
+        (
+            card_id,
+            rng.randrange(100, 20000, 100),
+            "COMPLETED",
+            (today - timedelta(seconds=rng.randrange(1, HISTORY_DAYS * 86400))).strftime("%Y-%m-%d %H:%M:%S"),
+            "withdraw",
+            f"ATM_{rng.randrange(50):02d}",
+        )
+        for card_id in card_ids
+        for _ in range(history)
+    )
+    while True:
+        chunk = [row for _, row in zip(range(SEED_CHUNK), rows)]
+        if not chunk:
+            break
+        for index, conn in enumerate(conns):
+            with db.transaction(conn):
+                conn.executemany(
+                    "INSERT INTO transactions (card_id, amount, status, timestamp, type, location) VALUES (?, ?, ?, ?, ?, ?)",
+                    [row for row in chunk if db.shard_of(row[0], shards) == index]
+                )
+    for conn in conns:
+        conn.close()
+    return card_ids
+
+
+# ---------------- LOAD ----------------
+def flow_steps(card_id, location):
+    return [
+        ("pin", {"card_id": card_id, "pin": BENCH_PIN}),
+        ("balance", {"card_id": card_id, "transaction_type": "balance"}),
+        ("withdraw", {"card_id": card_id, "transaction_type": "withdraw", "amount": 100, "location": location}),
+        ("mini", {"card_id": card_id, "transaction_type": "mini"}),
+    ]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest rank
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarise(samples, seconds):
+    latencies = sorted(latency for latency, _, _ in samples)
+    queries = [count for _, count, _ in samples]
+    errors = sum(1 for _, _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "requests_per_second": round(len(samples) / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "queries_per_request": round(sum(queries) / len(queries), 2),
+    }
+
+
+def run_load(app, card_ids, concurrency, locations=8):
+    """
+    One flow per card, `concurrency` flows at a time. Returns the report dict.
+    """
+    samples = {step: [] for step in STEPS}
+    samples_lock = threading.Lock()
+    clients = threading.local()
+
+    def flow(index):
+        client = getattr(clients, "client", None)
+        if client is None:
+            client = clients.client = app.test_client()
+        card_id = card_ids[index]
+        ok_flow = True
+        for step, payload in flow_steps(card_id, f"BENCH_ATM_{index % locations}"):
+            started = time.perf_counter()
+            response = client.post("/atm", json=payload)
+            latency = time.perf_counter() - started
+            ok = response.status_code == 200 and response.get_json().get("status") == "success"
+            queries = int(response.headers.get("X-DB-Queries", 0))
+            with samples_lock:
+                samples[step].append((latency, queries, ok))
+            ok_flow = ok_flow and ok
+        return ok_flow
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(flow, range(len(card_ids))))
+    seconds = time.perf_counter() - started
+
+    all_samples = [sample for step in STEPS for sample in samples[step]]
+    return {
+        "flows": len(results),
+        "flow_success_rate": round(sum(results) / len(results), 4),
+        "seconds": round(seconds, 3),
+        "overall": summarise(all_samples, seconds),
+        "steps": {step: summarise(samples[step], seconds) for step in STEPS},
+    }
+
+
+# ---------------- REPORTING ----------------
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    print(f"{report['flows']} flows, {report['flow_success_rate']:.1%} succeeded in {report['seconds']}s")
+    print(f"{'step':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}{'errors':>8}")
+    rows = [("overall", report["overall"])] + list(report["steps"].items())
+    for name, stats in rows:
+        print(
+            f"{name:<10}{stats['requests_per_second']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+            f"{stats['p99_ms']:>10}{stats['queries_per_request']:>10}{stats['errors']:>8}"
+        )
+        if baseline:
+            old = baseline["overall"] if name == "overall" else baseline["steps"].get(name)
+            if old:
+                print(
+                    f"{'  vs base':<10}{_delta(stats, old, 'requests_per_second'):>10}{_delta(stats, old, 'p50_ms'):>10}"
+                    f"{_delta(stats, old, 'p95_ms'):>10}{_delta(stats, old, 'p99_ms'):>10}"
+                    f"{_delta(stats, old, 'queries_per_request'):>10}"
+                )
+
+
+def _delta(new, old, key):
+    if not old.get(key):
+        return "-"
+    return f"{(new[key] - old[key]) / old[key]:+.0%}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the /atm endpoint")
+    parser.add_argument("--cards", type=int, default=1000, help="cards seeded, one flow each")
+    parser.add_argument("--history", type=int, default=20, help="past transactions seeded per card")
+    parser.add_argument("--concurrency", type=int, default=16, help="simulated ATMs")
+    parser.add_argument("--distinct-pins", action="store_true", help="hash every card's PIN separately (slower seeding; logins cost the same)")
+    parser.add_argument("--db", help="seed this path instead of a temporary file")
+    parser.add_argument("--shards", type=int, default=1, help="spread the cards over this many database files")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="earlier --json results to compare against")
+    args = parser.parse_args(argv)
+
+    # A busy PIN pool is a capacity limit, not what this benchmark measures
+    os.environ.setdefault("ATMGUARD_PIN_MAX_CONCURRENT", str(args.concurrency))
+    # Every simulated ATM shares the test client's IP
+    os.environ.setdefault("ATMGUARD_RATE_LIMITS", "0")
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="atmguard-bench-"), "bench.db")
+    started = time.perf_counter()
+    card_ids = seed_database(path, args.cards, args.history, args.distinct_pins, args.shards)
+    print(f"Seeded {len(card_ids)} cards x {args.history} transactions in {time.perf_counter() - started:.1f}s")
+
+    from app import app, startup
+    import pin_hasher
+
+    startup()
+
+    # Start the hashing pool outside the timed window
+    pin_hasher.submit(len, "").result()
+
+    report = {
+        "benchmark": "atm_flows",
+        "revision": _git_revision(),
+        "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "cards": args.cards,
+            "history": args.history,
+            "concurrency": args.concurrency,
+            "distinct_pins": args.distinct_pins,
+            "shards": args.shards,
+        },
+        **run_load(app, card_ids, args.concurrency),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
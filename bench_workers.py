@@ -0,0 +1,145 @@
+"""
+Measures /atm throughput as the number of worker processes grows.
+
+Each worker is a separate process serving the Flask app over HTTP, like a
+gunicorn worker, and all of them share one seeded database. Every request of
+a customer flow goes to the next worker in turn, so a flow only succeeds if
+session state is shared between processes:
+
+    python bench_workers.py --workers 1 2 4 --flows 400
+    python bench_workers.py --backend memory   # shows flows breaking
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_atm import BENCH_PIN, seed_database
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(port, env, ready):
+    os.environ.update(env)
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    app.startup()
+    server = make_server("127.0.0.1", port, app.app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def start_workers(count, env):
+    ctx = multiprocessing.get_context("spawn")
+    workers = []
+    for _ in range(count):
+        port = _free_port()
+        ready = ctx.Event()
+        process = ctx.Process(target=_serve, args=(port, env, ready), daemon=True)
+        process.start()
+        ready.wait(30)
+        workers.append((process, f"http://127.0.0.1:{port}/atm"))
+    return workers
+
+
+def _post(url, payload):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+
+
+def run_flows(urls, card_ids, concurrency):
+    # Round-robin across workers, as a load balancer in front of gunicorn would
+    next_url = itertools.cycle(urls).__next__
+    url_lock = threading.Lock()
+
+    def send(payload):
+        with url_lock:
+            url = next_url()
+        return _post(url, payload)
+
+    def flow(card_id):
+        steps = [
+            {"card_id": card_id, "pin": BENCH_PIN},
+            {"card_id": card_id, "transaction_type": "balance"},
+            {"card_id": card_id, "transaction_type": "withdraw", "amount": 100, "location": "BENCH_ATM"},
+            {"card_id": card_id, "transaction_type": "mini"},
+        ]
+        return all(send(step).get("status") == "success" for step in steps)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(flow, card_ids))
+    elapsed = time.perf_counter() - started
+    return {
+        "flows": len(results),
+        "requests": len(results) * 4,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(results) * 4 / elapsed, 1),
+        "flow_success_rate": round(sum(results) / len(results), 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark /atm throughput against worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--flows", type=int, default=400, help="customer flows per run (one card each)")
+    parser.add_argument("--concurrency", type=int, default=32, help="simulated ATMs")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "memory"])
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    for count in args.workers:
+        path = os.path.join(tempfile.mkdtemp(prefix="atmguard-bench-"), "bench.db")
+        seed_database(path, args.flows)
+        env = {
+            "ATMGUARD_DB": path,
+            "ATMGUARD_SESSION_BACKEND": args.backend,
+            # Workers are the unit of parallelism here, so hash inline
+            "ATMGUARD_PIN_WORKERS": "0",
+            "ATMGUARD_PIN_MAX_CONCURRENT": str(args.concurrency),
+            # Per-process velocity windows would undercount across workers
+            "ATMGUARD_VELOCITY_CACHE": "0",
+            # All simulated ATMs connect from 127.0.0.1
+            "ATMGUARD_RATE_LIMITS": "0",
+        }
+        workers = start_workers(count, env)
+        try:
+            card_ids = [f"BENCH{i:06d}" for i in range(args.flows)]
+            result = {"workers": count, "backend": args.backend, **run_flows([url for _, url in workers], card_ids, args.concurrency)}
+        finally:
+            for process, _ in workers:
+                process.terminate()
+        results.append(result)
+        print(
+            f"{count} worker(s): {result['requests_per_second']} req/s, "
+            f"{result['flow_success_rate']:.1%} flows succeeded"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
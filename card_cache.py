@@ -0,0 +1,115 @@
+"""
+Per-process cache of card rows (status, balance, PIN attempts, PIN hash).
+
+A withdraw flow reads the same card row up to five times; with the cache it
+is read once and every write goes through update(), which bumps
+card.version and stores the row returned by the UPDATE (write-through).
+
+Other workers' writes are only seen when an entry expires, so entries live
+for CARD_CACHE_TTL seconds and are reloaded after that; a reload that finds
+a newer version is counted as stale. Nothing that moves money trusts the
+cache: debit_balance re-checks balance and status in its UPDATE.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import card_connection
+
+ENABLED = os.environ.get("ATMGUARD_CARD_CACHE", "1") != "0"
+CARD_CACHE_TTL = float(os.environ.get("ATMGUARD_CARD_CACHE_TTL", 2))
+MAX_CARDS = 100000
+
+CARD_COLUMNS = "card_id, pin, status, pin_attempts, balance, version"
+
+
+class CardCache:
+    def __init__(self, max_cards=MAX_CARDS, ttl=CARD_CACHE_TTL, enabled=True):
+        self.max_cards = max_cards
+        self.ttl = ttl
+        self.enabled = enabled
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.writes = 0
+
+    def _store(self, row):
+        card = dict(row)
+        with self._lock:
+            cached = self._cards.get(card["card_id"])
+            if cached is not None:
+                if cached[0]["version"] > card["version"]:
+                    # A write-through beat this read; keep the newer row
+                    return cached[0]
+                if cached[0]["version"] < card["version"]:
+                    self.stale += 1
+            self._cards[card["card_id"]] = (card, time.monotonic() + self.ttl)
+            self._cards.move_to_end(card["card_id"])
+            while len(self._cards) > self.max_cards:
+                self._cards.popitem(last=False)
+        return card
+
+    def get(self, card_id, conn=None):
+        """
+        The card row as a dict, or None if there is no such card.
+        """
+        if self.enabled:
+            with self._lock:
+                entry = self._cards.get(card_id)
+                if entry is not None and entry[1] > time.monotonic():
+                    self.hits += 1
+                    self._cards.move_to_end(card_id)
+                    return entry[0]
+                self.misses += 1
+
+        row = (conn or card_connection(card_id)).execute(
+            f"SELECT {CARD_COLUMNS} FROM card WHERE card_id = ?", (card_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._store(row) if self.enabled else dict(row)
+
+    def update(self, conn, card_id, assignments, params=(), where="", where_params=()):
+        """
+        UPDATE card SET <assignments> for one card, bumping its version.
+        Returns the updated row, or None if no row matched.
+        """
+        conn = conn or card_connection(card_id)
+        row = conn.execute(
+            f"UPDATE card SET {assignments}, version = version + 1 WHERE card_id = ?{where} RETURNING {CARD_COLUMNS}",
+            (*params, card_id, *where_params)
+        ).fetchone()
+        self.writes += 1
+        if not self.enabled or row is None:
+            return dict(row) if row else None
+        if conn.in_transaction:
+            # Not committed yet and may roll back: drop it, the caller
+            # invalidates again after commit
+            self.invalidate(card_id)
+            return dict(row)
+        return self._store(row)
+
+    def invalidate(self, card_id):
+        with self._lock:
+            self._cards.pop(card_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cards.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": len(self._cards),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "writes": self.writes,
+            }
+
+
+store = CardCache(enabled=ENABLED)
@@ -0,0 +1,209 @@
+"""
+In-memory existence check for card IDs, consulted before a session is created.
+
+A Bloom filter of every card_id is built from the card table on first use.
+A "no" is certain: the probe is rejected without touching the database and
+is only counted, with at most one fraud_log row per REJECT_LOG_INTERVAL. A
+"maybe" continues as before. IDs that pass the filter but turn out not to
+exist (false positives) are remembered in a small negative cache.
+
+Cards created by another process are picked up by checking each shard's
+MAX(rowid) at most every REFRESH_INTERVAL seconds, when the filter says no
+or the negative cache does; new cards drop out of the negative cache.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import shard_connections
+from fraud_logger import log_fraud
+
+ENABLED = os.environ.get("ATMGUARD_CARD_INDEX", "1") != "0"
+FALSE_POSITIVE_RATE = 0.001
+MIN_CAPACITY = 10000
+REFRESH_INTERVAL = 5
+NEGATIVE_TTL = 300
+MAX_NEGATIVE = 100000
+REJECT_LOG_INTERVAL = 60
+FETCH_SIZE = 10000
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        # Double hashing: k positions from two 64-bit halves
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class CardIndex:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._filter = None
+        # Highest card rowid loaded, per shard
+        self._max_rowids = []
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        # card_id -> monotonic expiry, for IDs that passed the filter but do not exist
+        self._missing = OrderedDict()
+
+        self._logged_at = None
+
+        self.rejected = 0
+        self.false_positives = 0
+        self.refreshes = 0
+
+    # ---------------- LOADING ----------------
+    def load(self):
+        """
+        (Re)builds the filter from every card on every shard, sized for twice
+        the current count.
+        """
+        conns = shard_connections()
+        counts = [conn.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM card").fetchone() for conn in conns]
+        bloom = BloomFilter(max(MIN_CAPACITY, sum(total for total, _ in counts) * 2))
+        for conn, (_, max_rowid) in zip(conns, counts):
+            cursor = conn.execute("SELECT card_id FROM card WHERE rowid <= ?", (max_rowid,))
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    bloom.add(row[0])
+        with self._lock:
+            self._filter = bloom
+            self._max_rowids = [max_rowid for _, max_rowid in counts]
+            self._checked_at = time.monotonic()
+            self._missing.clear()
+
+    def _refresh(self):
+        # New cards get higher rowids (INSERT OR REPLACE included)
+        conns = shard_connections()
+        max_rowids = [conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM card").fetchone()[0] for conn in conns]
+        if all(new <= old for new, old in zip(max_rowids, self._max_rowids)):
+            return
+        self.refreshes += 1
+        if self._filter.count >= self._filter.capacity:
+            self.load()
+            return
+        rows = []
+        for conn, old, new in zip(conns, self._max_rowids, max_rowids):
+            if new > old:
+                rows += conn.execute(
+                    "SELECT card_id FROM card WHERE rowid > ? AND rowid <= ?", (old, new)
+                ).fetchall()
+        with self._lock:
+            for row in rows:
+                self._filter.add(row[0])
+                self._missing.pop(row[0], None)
+            self._max_rowids = max_rowids
+
+    def add(self, card_id):
+        """
+        Call when creating a card in this process.
+        """
+        if self._filter is None:
+            return
+        with self._lock:
+            self._filter.add(card_id)
+            self._missing.pop(str(card_id), None)
+
+    # ---------------- CHECKS ----------------
+    def _is_missing(self, card_id):
+        with self._lock:
+            expires = self._missing.get(card_id)
+            if expires is None:
+                return False
+            if expires > time.monotonic():
+                return True
+            del self._missing[card_id]
+            return False
+
+    def _refresh_due(self):
+        now = time.monotonic()
+        if now - self._checked_at < REFRESH_INTERVAL:
+            return False
+        self._checked_at = now
+        return True
+
+    def might_exist(self, card_id):
+        if not self.enabled:
+            return True
+        if self._filter is None:
+            self.load()
+        card_id = str(card_id)
+
+        if card_id in self._filter:
+            if not self._is_missing(card_id):
+                return True
+            # Another worker may have created it since: a refresh that finds
+            # it drops the negative entry
+            if self._refresh_due():
+                self._refresh()
+                return not self._is_missing(card_id)
+            return False
+
+        if self._refresh_due():
+            self._refresh()
+            return card_id in self._filter
+        return False
+
+    def mark_missing(self, card_id):
+        """
+        Call when a card that passed might_exist() was not found.
+        """
+        if not self.enabled:
+            return
+        card_id = str(card_id)
+        with self._lock:
+            self.false_positives += 1
+            self._missing[card_id] = time.monotonic() + NEGATIVE_TTL
+            self._missing.move_to_end(card_id)
+            while len(self._missing) > MAX_NEGATIVE:
+                self._missing.popitem(last=False)
+
+    def reject(self, card_id):
+        """
+        Counts a probe for an unknown card. The audit trail gets at most one
+        row per REJECT_LOG_INTERVAL, not one per probe; /metrics has the count.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.rejected += 1
+            if self._logged_at is not None and now - self._logged_at < REJECT_LOG_INTERVAL:
+                return
+            self._logged_at = now
+        log_fraud(None, "Unknown card probes")
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            "cards": bloom.count if bloom else 0,
+            "filter_bits": bloom.bits if bloom else 0,
+            "negative_cached": len(self._missing),
+            "rejected": self.rejected,
+            "false_positives": self.false_positives,
+            "refreshes": self.refreshes,
+        }
+
+
+index = CardIndex(enabled=ENABLED)
@@ -0,0 +1,193 @@
+"""
+Per-card spending profile for the profile_deviation fraud rule.
+
+Each card keeps one card_profile row: the count, mean and sum of squared
+deviations of its withdrawal amounts (Welford's online algorithm), a 24-slot
+histogram of withdrawal hours, and its TOP_LOCATIONS most frequent ATMs
+(space-saving counts). A withdrawal updates the row in O(1) inside
+complete_transaction's transaction, and the rule reads that one row instead
+of the card's history. The row stays a few hundred bytes however long
+the history.
+
+    python card_profile.py show CARD_ID
+    python card_profile.py rebuild      # recompute every profile from transactions
+"""
+import argparse
+import json
+import math
+from array import array
+from datetime import datetime
+
+from db import card_connection, shard_connections, transaction
+
+TOP_LOCATIONS = 5
+FETCH_SIZE = 10000
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+PROFILE_SQL = """
+    SELECT txn_count, mean, m2, hours, locations FROM card_profile WHERE card_id = ?
+"""
+
+SAVE_SQL = """
+    INSERT INTO card_profile (card_id, txn_count, mean, m2, hours, locations, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (card_id) DO UPDATE SET
+        txn_count = excluded.txn_count,
+        mean = excluded.mean,
+        m2 = excluded.m2,
+        hours = excluded.hours,
+        locations = excluded.locations,
+        updated_at = excluded.updated_at
+"""
+
+
+# ---------------- SCHEMA ----------------
+def create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS card_profile (
+            card_id TEXT PRIMARY KEY,
+            txn_count INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            m2 REAL NOT NULL,
+            hours BLOB NOT NULL,
+            locations TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+# ---------------- PROFILE ----------------
+class Profile:
+    __slots__ = ("count", "mean", "m2", "hours", "locations")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, hours=None, locations=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        # Withdrawals per hour of day
+        self.hours = hours or array("I", [0] * 24)
+        # location -> approximate count, at most TOP_LOCATIONS entries
+        self.locations = locations or {}
+
+    @classmethod
+    def from_row(cls, row):
+        hours = array("I")
+        hours.frombytes(row[3])
+        return cls(row[0], row[1], row[2], hours, json.loads(row[4]))
+
+    def add(self, amount, when, location=None):
+        # Welford: exact running mean and variance, no history needed
+        self.count += 1
+        delta = amount - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amount - self.mean)
+        self.hours[when.hour] += 1
+        if location:
+            self._add_location(location)
+
+    def _add_location(self, location):
+        # Space-saving: a new location replaces the least seen one and
+        # inherits its count, so frequent locations are never lost
+        if location in self.locations or len(self.locations) < TOP_LOCATIONS:
+            self.locations[location] = self.locations.get(location, 0) + 1
+            return
+        rarest = min(self.locations, key=self.locations.get)
+        self.locations[location] = self.locations.pop(rarest) + 1
+
+    def stddev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def hour_share(self, hour):
+        """
+        Share of the card's withdrawals within an hour either side of hour.
+        """
+        return sum(self.hours[(hour + offset) % 24] for offset in (-1, 0, 1)) / max(self.count, 1)
+
+    def knows_location(self, location):
+        return location in self.locations
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 2),
+            "stddev": round(self.stddev(), 2),
+            "hours": list(self.hours),
+            "locations": dict(sorted(self.locations.items(), key=lambda item: -item[1])),
+        }
+
+
+# ---------------- READS / WRITES ----------------
+def load(conn, card_id):
+    """
+    The card's Profile, or None before its first withdrawal.
+    """
+    row = (conn or card_connection(card_id)).execute(PROFILE_SQL, (card_id,)).fetchone()
+    return Profile.from_row(row) if row else None
+
+
+def save(conn, card_id, profile):
+    conn.execute(SAVE_SQL, (
+        card_id, profile.count, profile.mean, profile.m2, profile.hours.tobytes(),
+        json.dumps(profile.locations), datetime.now().strftime(TIME_FORMAT),
+    ))
+
+
+def record(conn, card_id, amount, when, location=None):
+    """
+    Adds one withdrawal to the card's profile. Call it in the transaction
+    that records the withdrawal.
+    """
+    profile = load(conn, card_id) or Profile()
+    profile.add(amount, when, location)
+    save(conn, card_id, profile)
+
+
+def rebuild(conn=None):
+    """
+    Recomputes every profile (of conn, else of every shard) from the
+    withdrawals in transactions; returns the number of cards profiled.
+    """
+    cards = 0
+    for conn in [conn] if conn is not None else shard_connections():
+        with transaction(conn):
+            conn.execute("DELETE FROM card_profile")
+            rows = conn.execute("""
+                SELECT card_id, amount, timestamp, location FROM transactions
+                WHERE type = 'withdraw' AND amount > 0 AND timestamp IS NOT NULL
+                ORDER BY card_id, timestamp
+            """)
+            current, profile = None, None
+            while batch := rows.fetchmany(FETCH_SIZE):
+                for card_id, amount, timestamp, location in batch:
+                    if card_id != current:
+                        if profile is not None:
+                            save(conn, current, profile)
+                            cards += 1
+                        current, profile = card_id, Profile()
+                    profile.add(amount, datetime.strptime(timestamp[:19], TIME_FORMAT), location)
+            if profile is not None:
+                save(conn, current, profile)
+                cards += 1
+    return cards
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and rebuild card spending profiles")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print a card's profile")
+    show.add_argument("card_id")
+    commands.add_parser("rebuild", help="recompute every profile from transactions")
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    migrate()
+    if args.command == "show":
+        profile = load(None, args.card_id)
+        print(json.dumps(profile.as_dict() if profile else None, indent=2))
+    else:
+        print(f"Rebuilt {rebuild()} card profiles")
+
+
+if __name__ == "__main__":
+    main()
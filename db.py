@@ -0,0 +1,211 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_NAME = os.environ.get("ATMGUARD_DB", os.path.join(BASE_DIR, "atmguard.db"))
+# Cards are spread over this many database files by hash of card_id; shard 0
+# is DB_NAME itself, so a single shard is the plain unsharded database
+SHARDS = max(1, int(os.environ.get("ATMGUARD_SHARDS", 1)))
+# Shard N allocates AUTOINCREMENT ids from N * ID_RANGE up, so ids stay
+# unique across shards (admin pages merge on them, resharding keeps them)
+ID_RANGE = 1 << 40
+
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+# One connection per (process, thread, db file). Gunicorn forks workers after
+# import, so the pid is part of the key and inherited connections are dropped.
+_local = threading.local()
+
+_totals_lock = threading.Lock()
+_totals = {"connects": 0, "queries": 0}
+
+
+# ---------------- STATS ----------------
+def _request_counters():
+    counters = getattr(_local, "counters", None)
+    if counters is None:
+        counters = _local.counters = {"connects": 0, "queries": 0}
+    return counters
+
+
+def _count(key):
+    _request_counters()[key] += 1
+    with _totals_lock:
+        _totals[key] += 1
+
+
+def _on_statement(sql):
+    _count("queries")
+
+
+def reset_request_stats():
+    _local.counters = {"connects": 0, "queries": 0}
+
+
+def request_stats():
+    return dict(_request_counters())
+
+
+def total_stats():
+    with _totals_lock:
+        return dict(_totals)
+
+
+# ---------------- TIMING ----------------
+def _statement_kind(sql):
+    return sql.lstrip()[:8].split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+
+
+def _timed(method, sql, *args):
+    started = time.perf_counter()
+    try:
+        return method(sql, *args)
+    finally:
+        metrics.observe("sql_seconds", time.perf_counter() - started, statement=_statement_kind(sql))
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Covers execution only; fetches of large results are not included
+    def execute(self, sql, parameters=()):
+        return _timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _timed(super().executemany, sql, seq_of_parameters)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ---------------- CONNECTIONS ----------------
+def connect(path=None):
+    """
+    Opens a new tuned connection. Hot paths should use get_connection().
+    """
+    conn = sqlite3.connect(
+        path or DB_NAME,
+        isolation_level=None,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=TimedConnection if metrics.ENABLED else sqlite3.Connection,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.set_trace_callback(_on_statement)
+    _count("connects")
+    return conn
+
+
+def get_connection(path=None):
+    """
+    Returns the calling thread's pooled connection. Do not close it.
+    """
+    path = path or DB_NAME
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        _local.pid = pid
+        _local.conns = {}
+
+    conn = _local.conns.get(path)
+    if conn is None:
+        conn = _local.conns[path] = connect(path)
+    return conn
+
+
+def close_connections():
+    conns = getattr(_local, "conns", None) or {}
+    for conn in conns.values():
+        conn.close()
+    _local.conns = {}
+
+
+# ---------------- SHARDS ----------------
+def sharded_path(base, index):
+    if index == 0:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}.shard{index}{ext}"
+
+
+def shard_paths(base=None, count=None):
+    return [sharded_path(base or DB_NAME, index) for index in range(count or SHARDS)]
+
+
+def shard_of(card_id, count=None):
+    """
+    The shard holding card_id. Stable across processes and restarts (not
+    hash()); rows with no card (e.g. unknown card probes) live on shard 0.
+    """
+    count = count or SHARDS
+    if count == 1 or card_id is None:
+        return 0
+    digest = hashlib.blake2b(str(card_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_path(card_id):
+    return sharded_path(DB_NAME, shard_of(card_id))
+
+
+def card_connection(card_id):
+    """
+    The calling thread's pooled connection to card_id's shard.
+    """
+    return get_connection(shard_path(card_id))
+
+
+def shard_connections():
+    """
+    Pooled connections to every shard, shard 0 first, for scatter-gather reads.
+    """
+    return [get_connection(path) for path in shard_paths()]
+
+
+def reserve_ids(conn, start):
+    # Moves every AUTOINCREMENT sequence up to at least `start`
+    if not start:
+        return
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%'"
+    )]
+    for table in tables:
+        updated = conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (start, table)
+        ).rowcount
+        if not updated:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, start))
+
+
+@contextmanager
+def transaction(conn=None, mode="IMMEDIATE"):
+    """
+    Runs the block in one transaction. Nested use joins the outer transaction.
+    """
+    conn = conn or get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute(f"BEGIN {mode}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
@@ -0,0 +1,150 @@
+"""
+Streams transactions, fraud_log and atm_session as CSV or JSONL.
+
+Rows are read through one cursor per shard in FETCH_SIZE chunks, merged
+into time order, and encoded (and optionally gzipped) chunk by chunk, so
+memory stays flat however many rows match. Used by the /admin/export
+endpoints and from the command line:
+
+    python exporter.py transactions --since 2026-01-01 --until 2026-02-01 -o jan.csv
+    python exporter.py fraud_log --format jsonl --gzip -o fraud.jsonl.gz
+"""
+import argparse
+import csv
+import heapq
+import io
+import json
+import sys
+import zlib
+from itertools import islice
+
+import db
+
+FETCH_SIZE = 5000
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+# table -> (columns, timestamp column used for --since / --until)
+TABLES = {
+    "transactions": (("id", "card_id", "type", "amount", "status", "timestamp", "location"), "timestamp"),
+    "fraud_log": (("id", "card_id", "fraud_type", "action_taken", "timestamp"), "timestamp"),
+    "atm_session": (("id", "card_id", "state", "created_at"), "created_at"),
+}
+
+
+def _query(table, since, until):
+    columns, time_column = TABLES[table]
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{time_column} >= ?")
+        params.append(since)
+    if until:
+        clauses.append(f"{time_column} < ?")
+        params.append(until)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    # Every table has an index on its time column, which also orders ties
+    # by id (the rowid): the range is read in index order with no sort
+    return f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY {time_column}, id", params
+
+
+def _rows(conn, table, since, until):
+    cursor = conn.execute(*_query(table, since, until))
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+
+def _chunks(table, since, until, path):
+    # One dedicated connection per shard, held for the whole download so the
+    # pooled ones stay free. Each shard is already in (time, id) order, and
+    # ids are unique across shards, so merging the streams keeps that order
+    columns, time_column = TABLES[table]
+    time_index, id_index = columns.index(time_column), columns.index("id")
+    conns = []
+    try:
+        for shard_path in [path] if path else db.shard_paths():
+            conns.append(db.connect(shard_path))
+        rows = heapq.merge(
+            *(_rows(conn, table, since, until) for conn in conns),
+            key=lambda row: (row[time_index] or "", row[id_index])
+        )
+        while True:
+            chunk = list(islice(rows, FETCH_SIZE))
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def _encode_csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _encode_jsonl(columns, chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows).encode()
+
+
+def _gzip(parts):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for part in parts:
+        compressed = compressor.compress(part)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export(table, fmt="csv", since=None, until=None, compress=False, path=None):
+    """
+    Returns an iterator of bytes for the export. Arguments are validated
+    here, before the first row is read.
+    """
+    if table not in TABLES:
+        raise Exception(f"Unknown export table: {table}")
+    if fmt not in FORMATS:
+        raise Exception(f"Unknown export format: {fmt}")
+
+    columns = TABLES[table][0]
+    encode = _encode_csv if fmt == "csv" else _encode_jsonl
+    parts = encode(columns, _chunks(table, since, until, path))
+    return _gzip(parts) if compress else parts
+
+
+def filename(table, fmt, compress=False):
+    return f"{table}.{fmt}" + (".gz" if compress else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export ATMGuard tables as CSV or JSONL")
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("--format", default="csv", choices=sorted(FORMATS))
+    parser.add_argument("--since", help="start of the time range (inclusive)")
+    parser.add_argument("--until", help="end of the time range (exclusive)")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output")
+    parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    parts = export(args.table, args.format, args.since, args.until, args.gzip)
+    handle = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for part in parts:
+            handle.write(part)
+    finally:
+        if args.output:
+            handle.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,62 @@
-import sqlite3
 from datetime import datetime, timedelta
-
-DB_NAME = "atmguard.db"
+from db import card_connection
+import card_profile
+import geo
+import metrics
+import velocity
 
 HIGH_AMOUNT_THRESHOLD = 100000
+MAX_DAILY_WITHDRAWAL = 300000
 MAX_TXN_IN_WINDOW = 3
 TXN_WINDOW_MINUTES = 10
 MAX_SESSIONS_WINDOW = 5
 SESSION_WINDOW_MINUTES = 15
+# Faster than an airliner between two registered ATMs is impossible travel
+MAX_TRAVEL_SPEED_KMH = 900
+# ATMs closer than this (same mall or branch) count as one place
+SAME_SITE_KM = 1.0
+# Profile deviation: judged only once the card has this many withdrawals.
+# The score is the amount's z-score against the card's own amounts, plus a
+# point each for a rarely used hour and an ATM outside its usual ones.
+PROFILE_MIN_TXNS = 10
+PROFILE_SCORE_THRESHOLD = 4.0
+# Spread never taken below this share of the mean (cards with flat amounts)
+PROFILE_MIN_SPREAD = 0.25
+# Hours (+-1) holding less than this share of the card's withdrawals are unusual
+PROFILE_RARE_HOUR_SHARE = 0.05
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Kept as constants so query_plans.py can EXPLAIN exactly what runs here
+TXN_VELOCITY_SQL = """
+    SELECT COUNT(*) FROM transactions
+    WHERE card_id=? AND type='withdraw' AND timestamp>=?
+"""
 
+SESSION_COUNT_SQL = """
+    SELECT COUNT(*) FROM atm_session
+    WHERE card_id=? AND created_at>=?
+"""
+
+# Range predicate on the raw column so idx_transactions_card_ts_id is usable
+DAILY_TOTAL_SQL = """
+    SELECT COALESCE(SUM(amount), 0)
+    FROM transactions
+    WHERE card_id = ?
+    AND timestamp >= ?
+    AND timestamp < ?
+"""
 
 class FraudResult:
     def __init__(self):
         self.reasons = []
+        self.hits = []
         self.severity = "LOW"
         self.action = "ALLOW"
 
-    def add(self, reason, severity="LOW", action="ALLOW"):
+    def add(self, reason, severity="LOW", action="ALLOW", rule=None):
         self.reasons.append(reason)
+        self.hits.append(rule)
         if severity == "HIGH":
             self.severity = "HIGH"
             self.action = action
@@ -26,65 +65,199 @@ class FraudResult:
             self.action = action
 
 
-def check_fraud(card_id: str, amount: float, transaction_type: str, location: str = "UNKNOWN"):
+# ---------------- DATA ----------------
+class FraudContext:
+    """
+    One evaluation: the transaction being checked plus the data rules asked for.
+    """
+    def __init__(self, card_id, amount, transaction_type, location="UNKNOWN", conn=None, now=None, loader=None):
+        self.card_id = card_id
+        self.amount = amount
+        self.transaction_type = transaction_type
+        self.location = location
+        self.conn = conn
+        self.now = now or datetime.now()
+        # Replaces load_needs, e.g. to answer from simulated state in a replay
+        self.loader = loader or load_needs
+        self.data = {}
+
+    def since(self, minutes):
+        return (self.now - timedelta(minutes=minutes)).strftime(TIME_FORMAT)
+
+    def day_bounds(self):
+        day_start = self.now.replace(hour=0, minute=0, second=0, microsecond=0)
+        day_end = day_start + timedelta(days=1)
+        return day_start.strftime(TIME_FORMAT), day_end.strftime(TIME_FORMAT)
+
+
+# Needs answered from the in-memory velocity windows when they are enabled
+MEMORY_NEEDS = {
+    "withdrawal_count": lambda ctx: velocity.store.count_transactions(
+        ctx.card_id, TXN_WINDOW_MINUTES, "withdraw", now=ctx.now, conn=ctx.conn),
+    "session_count": lambda ctx: velocity.store.count_sessions(
+        ctx.card_id, SESSION_WINDOW_MINUTES, now=ctx.now, conn=ctx.conn),
+    "daily_total": lambda ctx: velocity.store.daily_total(
+        ctx.card_id, now=ctx.now, conn=ctx.conn),
+}
+
+# Needs answered by a scalar subquery; all of them run as one SELECT
+SCALAR_NEEDS = {
+    "withdrawal_count": (TXN_VELOCITY_SQL, lambda ctx: (ctx.card_id, ctx.since(TXN_WINDOW_MINUTES))),
+    "session_count": (SESSION_COUNT_SQL, lambda ctx: (ctx.card_id, ctx.since(SESSION_WINDOW_MINUTES))),
+    "daily_total": (DAILY_TOTAL_SQL, lambda ctx: (ctx.card_id, *ctx.day_bounds())),
+}
+
+# Needs answered by geo.history (memory, or its own query when disabled)
+# and by the card's profile row
+HISTORY_NEEDS = {
+    "recent_locations": lambda ctx: geo.history.recent(ctx.card_id, ctx.now, ctx.conn),
+    "profile": lambda ctx: card_profile.load(ctx.conn, ctx.card_id),
+}
+
+
+def load_needs(ctx, needs):
+    """
+    Fetches every missing need in as few round trips as possible.
+    """
+    missing = [need for need in needs if need not in ctx.data]
+    if not missing:
+        return
+
+    scalar = []
+    for need in missing:
+        if velocity.ENABLED and need in MEMORY_NEEDS:
+            ctx.data[need] = MEMORY_NEEDS[need](ctx)
+        elif need in HISTORY_NEEDS:
+            ctx.data[need] = HISTORY_NEEDS[need](ctx)
+        elif need in SCALAR_NEEDS:
+            scalar.append(need)
+        else:
+            raise Exception(f"Unknown fraud rule need: {need}")
+
+    if not scalar:
+        return
+
+    cursor = (ctx.conn or card_connection(ctx.card_id)).cursor()
+    sql = "SELECT " + ", ".join(f"({SCALAR_NEEDS[need][0]})" for need in scalar)
+    params = [value for need in scalar for value in SCALAR_NEEDS[need][1](ctx)]
+    ctx.data.update(zip(scalar, cursor.execute(sql, params).fetchone()))
+
+
+# ---------------- RULES ----------------
+class Rule:
+    def __init__(self, name, check, needs=(), applies=None, severity="HIGH", action="BLOCK"):
+        self.name = name
+        self.check = check
+        self.needs = tuple(needs)
+        self.applies = applies
+        self.severity = severity
+        self.action = action
+
+
+RULES = []
+
+
+def rule(name, needs=(), applies=None, severity="HIGH", action="BLOCK"):
+    """
+    Registers a rule. The decorated function gets the FraudContext (with its
+    declared needs loaded into ctx.data) and returns a reason or None.
+    """
+    def register(check):
+        RULES.append(Rule(name, check, needs, applies, severity, action))
+        return check
+    return register
+
+
+def _is_withdraw(ctx):
+    return ctx.transaction_type == "withdraw"
+
+
+@rule("high_amount", applies=_is_withdraw)
+def _high_amount(ctx):
+    if ctx.amount >= HIGH_AMOUNT_THRESHOLD:
+        return "Unusually high withdrawal amount"
+
+
+@rule("withdrawal_velocity", needs=("withdrawal_count",))
+def _withdrawal_velocity(ctx):
+    if ctx.data["withdrawal_count"] >= MAX_TXN_IN_WINDOW:
+        return "Multiple withdrawals in short time"
+
+
+@rule("session_abuse", needs=("session_count",))
+def _session_abuse(ctx):
+    if ctx.data["session_count"] >= MAX_SESSIONS_WINDOW:
+        return "Excessive ATM sessions detected"
+
+
+@rule("impossible_travel", needs=("recent_locations",), applies=lambda ctx: ctx.location != "UNKNOWN")
+def _impossible_travel(ctx):
+    here = geo.registry.coordinates(ctx.location)
+    # Newest first, against each of the card's last few locations
+    for last_loc, last_time in reversed(ctx.data["recent_locations"]):
+        if not last_loc or last_loc == ctx.location:
+            continue
+        minutes = max((ctx.now - last_time).total_seconds() / 60, 1)
+        there = geo.registry.coordinates(last_loc)
+        if here is None or there is None:
+            # Unregistered ATM: no distance, so any other location within the window
+            if minutes <= TXN_WINDOW_MINUTES:
+                return f"Impossible travel detected: {last_loc} -> {ctx.location}"
+            continue
+        distance = geo.haversine_km(*there, *here)
+        if distance > SAME_SITE_KM and distance / (minutes / 60) > MAX_TRAVEL_SPEED_KMH:
+            return f"Impossible travel detected: {last_loc} -> {ctx.location}"
+
+
+def profile_score(profile, amount, hour, location):
+    spread = max(profile.stddev(), PROFILE_MIN_SPREAD * profile.mean, 1)
+    # Only spending above the usual amount counts
+    score = max(amount - profile.mean, 0) / spread
+    if profile.hour_share(hour) < PROFILE_RARE_HOUR_SHARE:
+        score += 1
+    if location != "UNKNOWN" and not profile.knows_location(location):
+        score += 1
+    return score
+
+
+@rule("profile_deviation", needs=("profile",), applies=_is_withdraw, severity="MEDIUM", action="ALLOW")
+def _profile_deviation(ctx):
+    profile = ctx.data["profile"]
+    if profile is None or profile.count < PROFILE_MIN_TXNS:
+        return None
+    score = profile_score(profile, ctx.amount, ctx.now.hour, ctx.location)
+    if score >= PROFILE_SCORE_THRESHOLD:
+        return f"Withdrawal unlike this card's usual spending (score {score:.1f})"
+
+
+@rule("daily_limit", needs=("daily_total",), applies=_is_withdraw, severity="MEDIUM", action="ALLOW")
+def _daily_limit(ctx):
+    if ctx.data["daily_total"] + ctx.amount > MAX_DAILY_WITHDRAWAL:
+        return "Daily withdrawal limit exceeded"
+
+
+# ---------------- ENGINE ----------------
+def evaluate(ctx, rules=None):
     result = FraudResult()
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-
-    # Rule 1: High amount
-    if transaction_type == "withdraw" and amount >= HIGH_AMOUNT_THRESHOLD:
-        result.add(
-            reason="Unusually high withdrawal amount",
-            severity="HIGH",
-            action="BLOCK"
-        )
-
-    # Rule 2: Transaction velocity
-    window_start = datetime.now() - timedelta(minutes=TXN_WINDOW_MINUTES)
-    cursor.execute("""
-        SELECT COUNT(*) FROM transactions
-        WHERE card_id=? AND type='withdraw' AND timestamp>=?
-    """, (card_id, window_start.strftime("%Y-%m-%d %H:%M:%S")))
-    txn_count = cursor.fetchone()[0]
-    if txn_count >= MAX_TXN_IN_WINDOW:
-        result.add(
-            reason="Multiple withdrawals in short time",
-            severity="HIGH",
-            action="BLOCK"
-        )
-
-    # Rule 3: Session abuse
-    session_window = datetime.now() - timedelta(minutes=SESSION_WINDOW_MINUTES)
-    cursor.execute("""
-        SELECT COUNT(*) FROM atm_session
-        WHERE card_id=? AND created_at>=?
-    """, (card_id, session_window.strftime("%Y-%m-%d %H:%M:%S")))
-    session_count = cursor.fetchone()[0]
-    if session_count >= MAX_SESSIONS_WINDOW:
-        result.add(
-            reason="Excessive ATM sessions detected",
-            severity="HIGH",
-            action="BLOCK"
-        )
-        
-    # Rule 4: Impossible Travel (Location Velocity)
-    if location != "UNKNOWN":
-        cursor.execute("""
-            SELECT location, timestamp FROM transactions
-            WHERE card_id=? AND timestamp >= ?
-            ORDER BY timestamp DESC LIMIT 1
-        """, (card_id, window_start.strftime("%Y-%m-%d %H:%M:%S")))
-        last_txn = cursor.fetchone()
-        
-        if last_txn:
-            last_loc, last_time = last_txn
-            if last_loc and last_loc != location:
-                # Simple check: different location within 10 minutes
-                result.add(
-                    reason=f"Impossible travel detected: {last_loc} -> {location}",
-                    severity="HIGH",
-                    action="BLOCK"
-                )
-
-    conn.close()
+    active = [r for r in (RULES if rules is None else rules) if r.applies is None or r.applies(ctx)]
+
+    for index, current in enumerate(active):
+        if any(need not in ctx.data for need in current.needs):
+            # Batch everything the remaining rules need into one fetch
+            with metrics.timer("fraud_load_seconds"):
+                ctx.loader(ctx, {need for r in active[index:] for need in r.needs})
+
+        with metrics.timer("fraud_rule_seconds", rule=current.name):
+            reason = current.check(ctx)
+        if reason:
+            result.add(reason, severity=current.severity, action=current.action, rule=current.name)
+            if current.action == "BLOCK":
+                break
+
     return result
+
+
+@metrics.timed("check_fraud_seconds")
+def check_fraud(card_id: str, amount: float, transaction_type: str, location: str = "UNKNOWN", conn=None):
+    ctx = FraudContext(card_id, amount, transaction_type, location, conn=conn)
+    return evaluate(ctx)
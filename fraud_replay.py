@@ -0,0 +1,280 @@
+"""
+Replays historical transactions and sessions through the fraud rules.
+
+Events are streamed in timestamp order (never loaded all at once) and each
+transaction is evaluated against simulated per-card state as of its own
+timestamp, so thresholds can be tuned against real history:
+
+    python fraud_replay.py --since "2026-01-01" --until "2026-02-01"
+    python fraud_replay.py --transactions txns.jsonl --sessions sessions.csv
+    python fraud_replay.py --set MAX_TXN_IN_WINDOW=4 --blocked-out blocked.jsonl
+"""
+import argparse
+import csv
+import heapq
+import json
+import sys
+from collections import Counter
+from datetime import datetime
+
+import fraud_engine
+from card_profile import Profile
+from db import shard_connections
+from geo import TravelHistory
+from migrations import migrate
+from velocity import VelocityStore
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+FETCH_SIZE = 10000
+
+
+def _parse_time(value):
+    value = value.replace("T", " ")
+    if len(value) == 10:
+        value += " 00:00:00"
+    return datetime.strptime(value[:19], TIME_FORMAT)
+
+
+def _amount(row):
+    return int(float(row.get("amount") or 0))
+
+
+# ---------------- SOURCES ----------------
+def _stream(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def _time_range(column, since, until):
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{column} >= ?")
+        params.append(since)
+    if until:
+        clauses.append(f"{column} < ?")
+        params.append(until)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def iter_db_transactions(conn, since=None, until=None):
+    where, params = _time_range("timestamp", since, until)
+    # (timestamp, id) is the order of idx_transactions_ts, so the range is
+    # read straight off the index with no sort
+    cursor = conn.execute(
+        "SELECT id, card_id, type, amount, status, timestamp, location FROM transactions"
+        + where + " ORDER BY timestamp, id", params
+    )
+    for row in _stream(cursor):
+        yield dict(row)
+
+
+def iter_db_sessions(conn, since=None, until=None):
+    where, params = _time_range("created_at", since, until)
+    cursor = conn.execute(
+        "SELECT id, card_id, created_at FROM atm_session" + where + " ORDER BY created_at, id", params
+    )
+    for row in _stream(cursor):
+        yield dict(row)
+
+
+def iter_shards(iterate, column, since=None, until=None):
+    """
+    One stream over every shard, merged on the time column (each shard
+    stream is already in order).
+    """
+    streams = [iterate(conn, since, until) for conn in shard_connections()]
+    return heapq.merge(*streams, key=lambda row: row[column] or "")
+
+
+def iter_file_rows(path):
+    """
+    Yields dict rows from a .jsonl or .csv export.
+    """
+    with open(path, newline="", encoding="utf-8") as handle:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def merge_events(transactions, sessions):
+    """
+    Merges both streams into ("txn" | "session", when, row) in time order.
+    Each input stream must already be in time order.
+    """
+    txn_events = (("txn", _parse_time(row["timestamp"]), row) for row in transactions)
+    session_events = (("session", _parse_time(row["created_at"]), row) for row in sessions)
+    # Sessions sort first on ties, as start_session always precedes the withdrawal
+    return heapq.merge(session_events, txn_events, key=lambda event: (event[1], event[0] == "txn"))
+
+
+# ---------------- SIMULATION ----------------
+class ReplayState:
+    """
+    Per-card state rebuilt from the replayed events only (no DB access).
+    """
+    def __init__(self):
+        self.windows = VelocityStore(max_cards=sys.maxsize, hydrate=False)
+        self.travel = TravelHistory(max_cards=sys.maxsize, hydrate=False)
+        self.profiles = {}
+
+    def load(self, ctx, needs):
+        for need in needs:
+            if need in ctx.data:
+                continue
+            if need == "withdrawal_count":
+                ctx.data[need] = self.windows.count_transactions(
+                    ctx.card_id, fraud_engine.TXN_WINDOW_MINUTES, "withdraw", now=ctx.now)
+            elif need == "session_count":
+                ctx.data[need] = self.windows.count_sessions(
+                    ctx.card_id, fraud_engine.SESSION_WINDOW_MINUTES, now=ctx.now)
+            elif need == "daily_total":
+                ctx.data[need] = self.windows.daily_total(ctx.card_id, now=ctx.now)
+            elif need == "recent_locations":
+                ctx.data[need] = self.travel.recent(ctx.card_id, now=ctx.now)
+            elif need == "profile":
+                ctx.data[need] = self.profiles.get(ctx.card_id)
+            else:
+                raise Exception(f"Replay cannot simulate fraud rule need: {need}")
+
+    def record_session(self, card_id, when):
+        self.windows.record_session(card_id, when)
+
+    def record_transaction(self, row, when):
+        self.windows.record_transaction(row["card_id"], _amount(row), row.get("type"), when)
+        self.travel.record(row["card_id"], row.get("location"), when)
+        if row.get("type") == "withdraw" and _amount(row) > 0:
+            self.profiles.setdefault(row["card_id"], Profile()).add(_amount(row), when, row.get("location"))
+
+
+class ReplayReport:
+    def __init__(self):
+        self.transactions = 0
+        self.sessions = 0
+        self.flagged = 0
+        self.blocked = 0
+        self.rule_hits = Counter()
+        self.blocked_cards = set()
+        self.first_event = None
+        self.last_event = None
+
+    def as_dict(self):
+        return {
+            "transactions": self.transactions,
+            "sessions": self.sessions,
+            "flagged": self.flagged,
+            "blocked": self.blocked,
+            "rule_hits": dict(self.rule_hits),
+            "blocked_cards": sorted(self.blocked_cards),
+            "first_event": self.first_event and self.first_event.strftime(TIME_FORMAT),
+            "last_event": self.last_event and self.last_event.strftime(TIME_FORMAT),
+        }
+
+
+def replay(events, rules=None, on_blocked=None):
+    """
+    Runs every transaction event through the rules as of its own timestamp.
+    on_blocked(row, result) is called for each would-have-been-blocked row.
+    """
+    state = ReplayState()
+    report = ReplayReport()
+
+    for kind, when, row in events:
+        report.first_event = report.first_event or when
+        report.last_event = when
+
+        if kind == "session":
+            report.sessions += 1
+            state.record_session(row["card_id"], when)
+            continue
+
+        report.transactions += 1
+        ctx = fraud_engine.FraudContext(
+            row["card_id"],
+            _amount(row),
+            row.get("type"),
+            row.get("location") or "UNKNOWN",
+            now=when,
+            loader=state.load,
+        )
+        result = fraud_engine.evaluate(ctx, rules)
+        report.rule_hits.update(result.hits)
+        if result.action == "BLOCK":
+            report.blocked += 1
+            report.blocked_cards.add(row["card_id"])
+            if on_blocked:
+                on_blocked(row, result)
+        elif result.reasons:
+            report.flagged += 1
+
+        # History is replayed as it happened, blocked or not
+        state.record_transaction(row, when)
+
+    return report
+
+
+# ---------------- CLI ----------------
+def _apply_overrides(assignments):
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        if not hasattr(fraud_engine, name):
+            raise SystemExit(f"Unknown fraud_engine setting: {name}")
+        setattr(fraud_engine, name, type(getattr(fraud_engine, name))(value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay history through the fraud rules")
+    parser.add_argument("--since", help="start of the time range (inclusive)")
+    parser.add_argument("--until", help="end of the time range (exclusive)")
+    parser.add_argument("--transactions", help="transactions export (.jsonl or .csv) instead of the DB")
+    parser.add_argument("--sessions", help="atm_session export (.jsonl or .csv) instead of the DB")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a fraud_engine threshold, e.g. MAX_TXN_IN_WINDOW=4")
+    parser.add_argument("--blocked-out", help="write would-have-been-blocked rows here as JSONL")
+    args = parser.parse_args(argv)
+
+    _apply_overrides(args.set)
+    # The impossible-travel rule reads ATM coordinates from the live registry
+    migrate()
+    since = args.since and _parse_time(args.since).strftime(TIME_FORMAT)
+    until = args.until and _parse_time(args.until).strftime(TIME_FORMAT)
+
+    if args.transactions:
+        transactions = iter_file_rows(args.transactions)
+    else:
+        transactions = iter_shards(iter_db_transactions, "timestamp", since, until)
+    if args.sessions:
+        sessions = iter_file_rows(args.sessions)
+    else:
+        sessions = iter_shards(iter_db_sessions, "created_at", since, until)
+
+    blocked_out = open(args.blocked_out, "w", encoding="utf-8") if args.blocked_out else None
+
+    def on_blocked(row, result):
+        if blocked_out:
+            blocked_out.write(json.dumps({**row, "rules": result.hits, "reasons": result.reasons}) + "\n")
+
+    events = merge_events(transactions, sessions)
+    if args.transactions or args.sessions:
+        # Exports are not pre-filtered like the DB queries are
+        events = (
+            event for event in events
+            if (not since or event[1] >= _parse_time(since)) and (not until or event[1] < _parse_time(until))
+        )
+
+    try:
+        report = replay(events, on_blocked=on_blocked)
+    finally:
+        if blocked_out:
+            blocked_out.close()
+
+    print(json.dumps(report.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Rollups of fraud_log: totals per fraud type, per card and per hour/day bucket.
+
+SQLite triggers keep them in step with fraud_log inside the writing
+transaction, so every writer (block_card, complete_transaction, log_fraud,
+anything added later) is covered and the dashboard reads O(buckets) rows
+instead of scanning the log. After a bulk load or a manual edit of fraud_log:
+
+    python fraud_stats.py --rebuild
+"""
+import argparse
+from collections import Counter
+
+from db import shard_connections, transaction
+
+GRANULARITIES = {
+    # bucket label taken from the "YYYY-MM-DD HH:MM:SS" timestamp
+    "hour": "substr({ts}, 1, 13) || ':00'",
+    "day": "substr({ts}, 1, 10)",
+}
+
+
+# ---------------- SCHEMA ----------------
+def _bump(row, delta):
+    """
+    Trigger body statements adding delta to every rollup for one fraud_log row.
+    """
+    fraud_type = f"COALESCE({row}.fraud_type, 'UNKNOWN')"
+    statements = [f"""
+        INSERT INTO fraud_stats_type (fraud_type, total) VALUES ({fraud_type}, {delta})
+        ON CONFLICT (fraud_type) DO UPDATE SET total = total + excluded.total;
+    """, f"""
+        INSERT INTO fraud_stats_card (card_id, total, last_seen)
+        SELECT {row}.card_id, {delta}, {row}.timestamp WHERE {row}.card_id IS NOT NULL
+        ON CONFLICT (card_id) DO UPDATE SET
+            total = total + excluded.total,
+            last_seen = MAX(COALESCE(last_seen, ''), COALESCE(excluded.last_seen, ''));
+    """]
+    for granularity, bucket in GRANULARITIES.items():
+        statements.append(f"""
+        INSERT INTO fraud_stats_bucket (granularity, bucket, fraud_type, total)
+        SELECT '{granularity}', {bucket.format(ts=row + ".timestamp")}, {fraud_type}, {delta}
+        WHERE {row}.timestamp IS NOT NULL
+        ON CONFLICT (granularity, bucket, fraud_type) DO UPDATE SET total = total + excluded.total;
+        """)
+    return "".join(statements)
+
+
+def _drop_empty_buckets(row):
+    return "".join(
+        f"""
+            DELETE FROM fraud_stats_bucket
+            WHERE granularity = '{granularity}' AND bucket = {bucket.format(ts=row + ".timestamp")} AND total <= 0;
+        """
+        for granularity, bucket in GRANULARITIES.items()
+    )
+
+
+def create_rollups(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fraud_stats_type (
+            fraud_type TEXT PRIMARY KEY,
+            total INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fraud_stats_card (
+            card_id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL,
+            last_seen TEXT
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fraud_stats_card_total
+        ON fraud_stats_card (total)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fraud_stats_bucket (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            fraud_type TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (granularity, bucket, fraud_type)
+        ) WITHOUT ROWID
+    """)
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fraud_log_insert AFTER INSERT ON fraud_log
+        BEGIN {_bump("NEW", 1)} END
+    """)
+    # Deletes take rows back out, archiving by retention.py included: the
+    # rollups always equal fraud_log, so the admin charts cover the retained
+    # period only (noted on the dashboard). Emptied rollup rows are dropped;
+    # last_seen is not wound back until the next rebuild.
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fraud_log_delete AFTER DELETE ON fraud_log
+        BEGIN
+            {_bump("OLD", -1)}
+            DELETE FROM fraud_stats_type WHERE total <= 0;
+            DELETE FROM fraud_stats_card WHERE card_id = OLD.card_id AND total <= 0;
+            {_drop_empty_buckets("OLD")}
+        END
+    """)
+
+
+def rebuild(conn=None):
+    """
+    Recomputes every rollup from fraud_log in one transaction, on conn or
+    else on every shard (each shard rolls up its own fraud_log).
+    """
+    if conn is None:
+        return sum(rebuild(shard) for shard in shard_connections())
+    with transaction(conn):
+        conn.execute("DELETE FROM fraud_stats_type")
+        conn.execute("DELETE FROM fraud_stats_card")
+        conn.execute("DELETE FROM fraud_stats_bucket")
+        conn.execute("""
+            INSERT INTO fraud_stats_type (fraud_type, total)
+            SELECT COALESCE(fraud_type, 'UNKNOWN'), COUNT(*) FROM fraud_log
+            GROUP BY 1
+        """)
+        conn.execute("""
+            INSERT INTO fraud_stats_card (card_id, total, last_seen)
+            SELECT card_id, COUNT(*), MAX(timestamp) FROM fraud_log
+            WHERE card_id IS NOT NULL
+            GROUP BY card_id
+        """)
+        for granularity, bucket in GRANULARITIES.items():
+            conn.execute(f"""
+                INSERT INTO fraud_stats_bucket (granularity, bucket, fraud_type, total)
+                SELECT ?, {bucket.format(ts="timestamp")}, COALESCE(fraud_type, 'UNKNOWN'), COUNT(*)
+                FROM fraud_log
+                WHERE timestamp IS NOT NULL
+                GROUP BY 2, 3
+            """, (granularity,))
+    return conn.execute("SELECT COALESCE(SUM(total), 0) FROM fraud_stats_type").fetchone()[0]
+
+
+# ---------------- READS ----------------
+def totals_by_type(conn):
+    return conn.execute(
+        "SELECT fraud_type, total FROM fraud_stats_type ORDER BY fraud_type"
+    ).fetchall()
+
+
+def trend(conn, granularity="day", since=None, fraud_type=None):
+    """
+    [(bucket, total)] in bucket order, for all types or one.
+    """
+    if granularity not in GRANULARITIES:
+        raise Exception(f"Unknown granularity: {granularity}")
+    sql = "SELECT bucket, SUM(total) AS total FROM fraud_stats_bucket WHERE granularity = ?"
+    params = [granularity]
+    if since:
+        sql += " AND bucket >= ?"
+        params.append(since)
+    if fraud_type:
+        sql += " AND fraud_type = ?"
+        params.append(fraud_type)
+    return conn.execute(sql + " GROUP BY bucket ORDER BY bucket", params).fetchall()
+
+
+def top_cards(conn, limit=10):
+    return conn.execute(
+        "SELECT card_id, total, last_seen FROM fraud_stats_card ORDER BY total DESC LIMIT ?",
+        (limit,)
+    ).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fraud statistics rollups")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups from fraud_log")
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"Rebuilt fraud rollups from {rebuild()} fraud_log rows")
+    else:
+        totals = Counter()
+        for conn in shard_connections():
+            totals.update({row["fraud_type"]: row["total"] for row in totals_by_type(conn)})
+        for fraud_type, total in sorted(totals.items()):
+            print(f"{fraud_type}: {total}")
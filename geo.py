@@ -0,0 +1,300 @@
+"""
+ATM location registry and per-card travel history for the impossible-travel rule.
+
+Each ATM location string can be registered with coordinates in the
+atm_location table, which also stores a geohash of the point; the geohash
+index answers "which ATMs are near here" with prefix range scans. The
+registry is small and kept in memory (reloaded every REGISTRY_REFRESH
+seconds), and every card's last HISTORY_SIZE locations are kept in an LRU
+store like velocity.py's, so the rule costs no query per withdrawal.
+
+    python geo.py add LAGOS_IKEJA_01 6.6018 3.3515
+    python geo.py import atms.csv          # location,latitude,longitude
+    python geo.py nearby 6.60 3.35 --km 2
+
+Set ATMGUARD_GEO_CACHE=0 (defaults to ATMGUARD_VELOCITY_CACHE) to read the
+history from SQLite instead, e.g. with several workers per database.
+"""
+import argparse
+import csv
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+from db import card_connection, get_connection, shard_connections, transaction
+
+ENABLED = os.environ.get("ATMGUARD_GEO_CACHE", os.environ.get("ATMGUARD_VELOCITY_CACHE", "1")) != "0"
+
+HISTORY_SIZE = 5
+# Beyond this even an airliner gets anywhere, so older locations are not kept
+HISTORY_HOURS = 12
+MAX_CARDS = 100000
+REGISTRY_REFRESH = 60
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+HISTORY_SQL = """
+    SELECT location, timestamp FROM transactions
+    WHERE card_id = ? AND timestamp >= ? AND location IS NOT NULL
+    ORDER BY timestamp DESC LIMIT ?
+"""
+
+NEARBY_SQL = """
+    SELECT location, latitude, longitude FROM atm_location
+    WHERE geohash >= ? AND geohash < ?
+"""
+
+
+def _parse(value):
+    return datetime.strptime(value[:19], TIME_FORMAT)
+
+
+# ---------------- GEOMETRY ----------------
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def geohash(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate longitude, latitude
+        span, point = (lon_range, lon) if even else (lat_range, lat)
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if point >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def _cell_size(precision):
+    # (lat degrees, lon degrees) covered by one cell
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def _cover(lat, lon, radius_km):
+    """
+    Geohash cells (the centre one and its 8 neighbours) at the finest
+    precision whose cells are at least radius_km across.
+    """
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        lat_deg, lon_deg = _cell_size(candidate)
+        if min(lat_deg * 111.2, lon_deg * 111.2 * math.cos(math.radians(lat))) >= radius_km:
+            precision = candidate
+            break
+    lat_deg, lon_deg = _cell_size(precision)
+    cells = set()
+    for dlat in (-lat_deg, 0, lat_deg):
+        for dlon in (-lon_deg, 0, lon_deg):
+            cell_lon = (lon + dlon + 180) % 360 - 180
+            cells.add(geohash(max(-90.0, min(90.0, lat + dlat)), cell_lon, precision))
+    return cells
+
+
+# ---------------- REGISTRY ----------------
+class LocationRegistry:
+    """
+    Fleet-wide, not per card: atm_location lives in the home database (shard 0).
+    """
+    def __init__(self, refresh=REGISTRY_REFRESH):
+        self.refresh = refresh
+        self._points = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self, conn=None):
+        conn = conn or get_connection()
+        points = {
+            row[0]: (row[1], row[2])
+            for row in conn.execute("SELECT location, latitude, longitude FROM atm_location")
+        }
+        with self._lock:
+            self._points = points
+            self._loaded_at = time.monotonic()
+
+    def coordinates(self, location, conn=None):
+        """
+        (latitude, longitude) of a registered location, else None.
+        """
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh:
+            self.load(conn)
+        return self._points.get(location)
+
+    def register(self, location, latitude, longitude, conn=None):
+        conn = conn or get_connection()
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise Exception(f"Invalid coordinates for {location}: {latitude}, {longitude}")
+        conn.execute(
+            """
+            INSERT INTO atm_location (location, latitude, longitude, geohash)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (location) DO UPDATE SET
+                latitude = excluded.latitude,
+                longitude = excluded.longitude,
+                geohash = excluded.geohash
+            """, (location, latitude, longitude, geohash(latitude, longitude))
+        )
+        with self._lock:
+            self._points[location] = (latitude, longitude)
+
+    def nearby(self, latitude, longitude, radius_km, conn=None):
+        """
+        [(distance_km, location)] of registered ATMs within radius_km, nearest first.
+        """
+        conn = conn or get_connection()
+        found = []
+        for cell in _cover(latitude, longitude, radius_km):
+            # Every hash with this prefix sorts between cell and cell + "~"
+            for location, lat, lon in conn.execute(NEARBY_SQL, (cell, cell + "~")):
+                distance = haversine_km(latitude, longitude, lat, lon)
+                if distance <= radius_km:
+                    found.append((round(distance, 3), location))
+        return sorted(found)
+
+    def __len__(self):
+        return len(self._points)
+
+
+# ---------------- TRAVEL HISTORY ----------------
+class TravelHistory:
+    """
+    The last HISTORY_SIZE (location, when) of each card, newest last.
+    """
+    def __init__(self, max_cards=MAX_CARDS, enabled=True, hydrate=True):
+        self.max_cards = max_cards
+        self.enabled = enabled
+        # False for histories fed purely from events (e.g. fraud_replay)
+        self.hydrate = hydrate
+        self._cards = OrderedDict()
+        self._lock = threading.RLock()
+        # True once warm() loaded every recent card and nothing was evicted since
+        self._complete = False
+
+    def _since(self, now):
+        return (now - timedelta(hours=HISTORY_HOURS)).strftime(TIME_FORMAT)
+
+    def _query(self, card_id, now, conn):
+        rows = (conn or card_connection(card_id)).execute(HISTORY_SQL, (card_id, self._since(now), HISTORY_SIZE))
+        return [(location, _parse(timestamp)) for location, timestamp in reversed(rows.fetchall())]
+
+    def warm(self, conn=None):
+        # Every shard unless one database is given
+        conns = [conn] if conn is not None else shard_connections()
+        now = datetime.now()
+        with self._lock:
+            self._cards.clear()
+            for conn in conns:
+                for card_id, location, timestamp in conn.execute(
+                    """
+                    SELECT card_id, location, timestamp FROM transactions
+                    WHERE timestamp >= ? AND location IS NOT NULL ORDER BY timestamp
+                    """, (self._since(now),)
+                ):
+                    self._entry(card_id).append((location, _parse(timestamp)))
+            self._complete = True
+
+    def _entry(self, card_id):
+        entry = self._cards.get(card_id)
+        if entry is None:
+            entry = self._cards[card_id] = deque(maxlen=HISTORY_SIZE)
+            while len(self._cards) > self.max_cards:
+                self._cards.popitem(last=False)
+                self._complete = False
+        else:
+            self._cards.move_to_end(card_id)
+        return entry
+
+    def _get(self, card_id, now, conn):
+        if card_id not in self._cards and self.hydrate and not self._complete:
+            self._entry(card_id).extend(self._query(card_id, now, conn))
+        return self._entry(card_id)
+
+    def record(self, card_id, location, when=None):
+        if not self.enabled or not location:
+            return
+        when = when or datetime.now()
+        with self._lock:
+            if card_id not in self._cards and self.hydrate and not self._complete:
+                # Recorded after the transaction INSERT: the load includes it
+                self._get(card_id, when, None)
+                return
+            self._get(card_id, when, None).append((location, when))
+
+    def recent(self, card_id, now=None, conn=None):
+        """
+        [(location, when)] within HISTORY_HOURS of now, newest last.
+        """
+        now = now or datetime.now()
+        if not self.enabled:
+            return self._query(card_id, now, conn)
+        horizon = now - timedelta(hours=HISTORY_HOURS)
+        with self._lock:
+            return [(location, when) for location, when in self._get(card_id, now, conn) if when >= horizon]
+
+    def __len__(self):
+        return len(self._cards)
+
+
+registry = LocationRegistry()
+history = TravelHistory(enabled=ENABLED)
+
+
+# ---------------- CLI ----------------
+def import_csv(path, conn=None):
+    conn = conn or get_connection()
+    count = 0
+    with open(path, newline="", encoding="utf-8") as handle, transaction(conn):
+        for row in csv.DictReader(handle):
+            registry.register(row["location"], float(row["latitude"]), float(row["longitude"]), conn)
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the ATM location registry")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="register or move one ATM location")
+    add.add_argument("location")
+    add.add_argument("latitude", type=float)
+    add.add_argument("longitude", type=float)
+    bulk = commands.add_parser("import", help="register locations from a location,latitude,longitude CSV")
+    bulk.add_argument("path")
+    near = commands.add_parser("nearby", help="list registered ATMs around a point")
+    near.add_argument("latitude", type=float)
+    near.add_argument("longitude", type=float)
+    near.add_argument("--km", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    migrate()
+    if args.command == "add":
+        registry.register(args.location, args.latitude, args.longitude)
+        print(f"Registered {args.location}")
+    elif args.command == "import":
+        print(f"Registered {import_csv(args.path)} locations")
+    else:
+        for distance, location in registry.nearby(args.latitude, args.longitude, args.km):
+            print(f"{distance:>10.3f} km  {location}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,7 @@
-import sqlite3
+from migrations import migrate
 
-conn = sqlite3.connect("atmguard.db")
-cursor = conn.cursor()
+# Creates the schema from scratch or upgrades an existing database.
+# Safe to rerun: only pending migrations are applied.
+version = migrate(verbose=True)
 
-cursor.execute("ALTER TABLE card ADD COLUMN balance INTEGER DEFAULT 50000")
-
-conn.commit()
-conn.close()
-
-print("Balance column added successfully")
+print(f"Database ready (schema version {version})")
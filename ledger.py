@@ -0,0 +1,358 @@
+"""
+Append-only ledger of balance changes, with periodic per-card snapshots.
+
+Every balance change is a ledger row (seq, card_id, amount, kind, txn_id):
+negative for debits, positive for credits. Triggers reject UPDATE and
+DELETE on the ledger, and a new card (or one re-inserted with another
+balance) gets an "opening" entry. A card's balance is its latest
+balance_snapshot plus the sum of the entries after it.
+
+card.balance is kept in step inside the same transaction. It is the
+overdraft guard (debit_balance's conditional UPDATE) and what the card
+cache and admin pages show. The reconciler walks the cards CHUNK_SIZE at a
+time. It checks each card's newest snapshot against the one before it plus
+the entries between them, and checks card.balance against snapshot plus
+tail. Once the checks pass, it snapshots any card whose tail has reached
+SNAPSHOT_TAIL entries. It runs in a background thread of the app every
+ATMGUARD_RECONCILE_INTERVAL seconds (0 turns it off), or from cron. Every
+app process starts the thread, but only the one holding an exclusive lock
+on ATMGUARD_RECONCILE_LOCK (next to the database) reconciles; the others
+take over if it exits:
+
+    python ledger.py reconcile        # one full pass, prints mismatches
+    python ledger.py balance CARD_ID
+"""
+import argparse
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import db
+from db import card_connection, shard_connections, transaction
+
+RECONCILE_INTERVAL = float(os.environ.get("ATMGUARD_RECONCILE_INTERVAL", 30))
+# Default: <ATMGUARD_DB>.reconcile.lock
+RECONCILE_LOCK = os.environ.get("ATMGUARD_RECONCILE_LOCK")
+CHUNK_SIZE = 200
+# Entries after the latest snapshot before the reconciler takes a new one
+SNAPSHOT_TAIL = 20
+MAX_MISMATCHES = 100
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+logger = logging.getLogger(__name__)
+
+BALANCE_SQL = """
+    SELECT balance + COALESCE(
+        (SELECT SUM(amount) FROM ledger WHERE card_id = snap.card_id AND seq > snap.seq), 0
+    )
+    FROM balance_snapshot AS snap
+    WHERE card_id = ?
+    ORDER BY seq DESC LIMIT 1
+"""
+
+TAIL_SQL = """
+    SELECT COALESCE(SUM(amount), 0), COUNT(*), MAX(seq) FROM ledger
+    WHERE card_id = ? AND seq > ? AND seq <= ?
+"""
+
+
+# ---------------- SCHEMA ----------------
+def create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ledger (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            card_id TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            txn_id INTEGER,
+            created_at TEXT NOT NULL
+        )
+    """)
+    # Covers the snapshot + tail sum
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_ledger_card_seq
+        ON ledger (card_id, seq, amount)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS balance_snapshot (
+            card_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            taken_at TEXT NOT NULL,
+            PRIMARY KEY (card_id, seq)
+        ) WITHOUT ROWID
+    """)
+    for action in ("UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS ledger_no_{action.lower()}
+            BEFORE {action} ON ledger
+            BEGIN
+                SELECT RAISE(ABORT, 'ledger is append-only');
+            END
+        """)
+    # Cards created anywhere (init scripts, bulk imports, benchmarks) open
+    # their account with whatever balance they were inserted with, and start
+    # with a snapshot, so every card's balance is one snapshot + tail read
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS card_ledger_opening
+        AFTER INSERT ON card
+        WHEN NOT EXISTS (SELECT 1 FROM balance_snapshot WHERE card_id = NEW.card_id)
+          OR COALESCE(NEW.balance, 0) != (SELECT COALESCE(SUM(amount), 0) FROM ledger WHERE card_id = NEW.card_id)
+        BEGIN
+            INSERT INTO ledger (card_id, amount, kind, created_at)
+            VALUES (
+                NEW.card_id,
+                COALESCE(NEW.balance, 0) - (SELECT COALESCE(SUM(amount), 0) FROM ledger WHERE card_id = NEW.card_id),
+                'opening',
+                strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')
+            );
+            INSERT INTO balance_snapshot (card_id, seq, balance, taken_at)
+            VALUES (
+                NEW.card_id, last_insert_rowid(), COALESCE(NEW.balance, 0),
+                strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')
+            );
+        END
+    """)
+
+
+def open_existing_cards(conn):
+    # Existing balances become opening entries, snapshotted straight away
+    now = datetime.now().strftime(TIME_FORMAT)
+    conn.execute("""
+        INSERT INTO ledger (card_id, amount, kind, created_at)
+        SELECT card_id, COALESCE(balance, 0), 'opening', ? FROM card
+        WHERE card_id NOT IN (SELECT card_id FROM ledger)
+    """, (now,))
+    conn.execute("""
+        INSERT OR IGNORE INTO balance_snapshot (card_id, seq, balance, taken_at)
+        SELECT card_id, MAX(seq), SUM(amount), ? FROM ledger GROUP BY card_id
+    """, (now,))
+
+
+# ---------------- WRITES ----------------
+def append(conn, card_id, amount, kind, txn_id=None):
+    """
+    Records one balance change and returns its seq. Call it in the same
+    transaction that changes card.balance.
+    """
+    return conn.execute(
+        "INSERT INTO ledger (card_id, amount, kind, txn_id, created_at) VALUES (?, ?, ?, ?, ?)",
+        (card_id, amount, kind, txn_id, datetime.now().strftime(TIME_FORMAT))
+    ).lastrowid
+
+
+# ---------------- READS ----------------
+def balance(conn, card_id):
+    """
+    Latest snapshot plus the entries after it; None for an unknown card.
+    """
+    row = (conn or card_connection(card_id)).execute(BALANCE_SQL, (card_id,)).fetchone()
+    return row[0] if row else None
+
+
+# ---------------- RECONCILER ----------------
+def check_card(conn, card_id, card_balance, snapshot_tail=SNAPSHOT_TAIL):
+    """
+    Verifies one card. Returns a list of mismatch descriptions; snapshots
+    the card when it checks out and its tail is long enough.
+    """
+    problems = []
+    snaps = conn.execute(
+        "SELECT seq, balance FROM balance_snapshot WHERE card_id = ? ORDER BY seq DESC LIMIT 2",
+        (card_id,)
+    ).fetchall()
+    latest_seq, latest_balance = snaps[0] if snaps else (0, 0)
+    if snaps:
+        # Older snapshots were checked when they were the newest
+        prev_seq, prev_balance = snaps[1] if len(snaps) > 1 else (0, 0)
+        segment = conn.execute(TAIL_SQL, (card_id, prev_seq, latest_seq)).fetchone()[0]
+        if prev_balance + segment != latest_balance:
+            problems.append(
+                f"snapshot at seq {latest_seq} is {latest_balance}, ledger says {prev_balance + segment}"
+            )
+
+    tail, count, last_seq = conn.execute(TAIL_SQL, (card_id, latest_seq, 2 ** 63 - 1)).fetchone()
+    ledger_balance = latest_balance + tail
+    if card_balance != ledger_balance:
+        problems.append(f"card.balance is {card_balance}, ledger says {ledger_balance}")
+
+    if not problems and count >= snapshot_tail:
+        conn.execute(
+            "INSERT OR IGNORE INTO balance_snapshot (card_id, seq, balance, taken_at) VALUES (?, ?, ?, ?)",
+            (card_id, last_seq, ledger_balance, datetime.now().strftime(TIME_FORMAT))
+        )
+    return problems
+
+
+class Reconciler:
+    def __init__(self, interval=RECONCILE_INTERVAL, chunk_size=CHUNK_SIZE):
+        self.interval = interval
+        self.chunk_size = chunk_size
+        # Shard being walked and the card_id its next chunk starts after;
+        # a cursor of None starts the shard from the beginning
+        self.shard = 0
+        self.cursor = None
+
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self.mismatches = deque(maxlen=MAX_MISMATCHES)
+
+        self.cards_checked = 0
+        self.chunks = 0
+        self.passes = 0
+        self.mismatched = 0
+        self.failed = 0
+
+    def run_chunk(self, conn):
+        """
+        Checks the next CHUNK_SIZE cards of conn's database in one write
+        transaction (so card, ledger and snapshot reads agree). Returns the
+        mismatches found; cursor is None again once the database is done.
+        """
+        found = []
+        with transaction(conn):
+            cards = conn.execute(
+                "SELECT card_id, balance FROM card WHERE card_id > ? ORDER BY card_id LIMIT ?",
+                (self.cursor or "", self.chunk_size)
+            ).fetchall()
+            for card_id, card_balance in cards:
+                for problem in check_card(conn, card_id, card_balance or 0):
+                    found.append({"card_id": card_id, "problem": problem,
+                                  "found_at": datetime.now().strftime(TIME_FORMAT)})
+
+        with self._lock:
+            self.cards_checked += len(cards)
+            self.chunks += 1
+            self.mismatched += len(found)
+            self.mismatches.extend(found)
+            self.cursor = cards[-1][0] if len(cards) == self.chunk_size else None
+        for mismatch in found:
+            logger.error("Ledger mismatch for %s: %s", mismatch["card_id"], mismatch["problem"])
+        return found
+
+    def run_pass(self, conn=None):
+        """
+        Checks every card (of conn, else of every shard) from the start;
+        returns the mismatches found.
+        """
+        found = []
+        for conn in [conn] if conn is not None else shard_connections():
+            self.cursor = None
+            found += self.run_chunk(conn)
+            while self.cursor is not None:
+                found += self.run_chunk(conn)
+        self.passes += 1
+        return found
+
+    def claim(self):
+        """
+        True while this reconciler holds the process-wide reconcile lock.
+        Without fcntl (not POSIX) there is no lock and every claim succeeds.
+        """
+        if fcntl is None:
+            return True
+        if self._lock_file is not None:
+            return True
+        handle = open(RECONCILE_LOCK or f"{db.DB_NAME}.reconcile.lock", "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_file = handle
+        return True
+
+    def release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()  # closing drops the flock
+            self._lock_file = None
+
+    def _run(self):
+        # Dedicated connections: chunks hold a write lock, keep them off the pools
+        conns = [db.connect(path) for path in db.shard_paths()]
+        try:
+            while not self._stop.wait(self.interval):
+                # One reconciling process per database; the rest keep trying
+                if not self.claim():
+                    continue
+                try:
+                    self.run_chunk(conns[self.shard])
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Ledger reconcile chunk failed")
+                    continue
+                if self.cursor is None:
+                    self.shard = (self.shard + 1) % len(conns)
+                    self.passes += self.shard == 0
+        finally:
+            self.release()
+            for conn in conns:
+                conn.close()
+
+    def start(self):
+        # Once per process: a forked worker does not inherit the thread
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # A lock inherited through fork is the parent's
+            self._lock_file = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ledger-reconciler", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        return {
+            "cards_checked": self.cards_checked,
+            "chunks": self.chunks,
+            "passes": self.passes,
+            "mismatched": self.mismatched,
+            "failed": self.failed,
+            "recent_mismatches": list(self.mismatches),
+        }
+
+
+reconciler = Reconciler()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and reconcile the balance ledger")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("reconcile", help="check every card once and take due snapshots")
+    show = commands.add_parser("balance", help="print a card's ledger balance")
+    show.add_argument("card_id")
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    migrate()
+    if args.command == "balance":
+        print(balance(None, args.card_id))
+        return
+
+    mismatches = reconciler.run_pass()
+    for mismatch in mismatches:
+        print(f"{mismatch['card_id']}: {mismatch['problem']}")
+    print(f"Checked {reconciler.cards_checked} cards, {len(mismatches)} mismatches")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Timings and counters for the /atm hot path, served at /metrics in the
+Prometheus text exposition format.
+
+Instrumented: every HTTP request, verify_pin, check_fraud and each fraud rule,
+complete_transaction and every SQL statement (by statement kind). Values are
+per process, so with several gunicorn workers each one reports its own.
+
+ATMGUARD_METRICS=0 turns instrumentation off at import time: timed() returns
+the function unchanged, timer() a shared no-op and db connections are not
+wrapped. ATMGUARD_SLOW_TRACE_MS=<n> logs the span breakdown of any request
+slower than n ms to the "atmguard.slow" logger.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+ENABLED = os.environ.get("ATMGUARD_METRICS", "1") != "0"
+SLOW_TRACE_MS = float(os.environ.get("ATMGUARD_SLOW_TRACE_MS", 0))
+PREFIX = "atmguard_"
+
+# Seconds; scrypt sits around 50-100 ms, indexed queries well under 1 ms
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+slow_log = logging.getLogger("atmguard.slow")
+
+_lock = threading.Lock()
+# (name, labels) -> [bucket counts..., count, sum]
+_histograms = {}
+_counters = {}
+_help = {}
+
+_local = threading.local()
+_NULL = nullcontext()
+
+
+# ---------------- RECORDING ----------------
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                values[index] += 1
+                break
+        values[-2] += 1
+        values[-1] += seconds
+
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans.append((name, labels, seconds))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def timer(name, **labels):
+    """
+    with timer("fraud_rule_seconds", rule="daily_limit"): ...
+    """
+    if not ENABLED:
+        return _NULL
+    return _Timer(name, labels)
+
+
+def timed(name, **labels):
+    """
+    Decorator recording each call's duration into histogram `name`.
+    """
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorate
+
+
+# ---------------- SLOW TRACES ----------------
+def begin_request():
+    if ENABLED and SLOW_TRACE_MS:
+        _local.spans = []
+    _local.started = time.perf_counter()
+
+
+def end_request(endpoint, status):
+    started = getattr(_local, "started", None)
+    spans = getattr(_local, "spans", None)
+    _local.started = _local.spans = None
+    if started is None or not ENABLED:
+        return
+
+    elapsed = time.perf_counter() - started
+    observe("request_seconds", elapsed, endpoint=endpoint)
+    inc("requests_total", endpoint=endpoint, status=str(status))
+
+    if spans is not None and elapsed * 1000 >= SLOW_TRACE_MS:
+        breakdown = ", ".join(
+            f"{name}{_format_labels(labels)}={seconds * 1000:.1f}ms" for name, labels, seconds in spans
+        )
+        slow_log.warning("slow request %s %.1fms: %s", endpoint, elapsed * 1000, breakdown)
+
+
+# ---------------- EXPOSITION ----------------
+def _format_labels(labels, extra=()):
+    pairs = list(labels.items() if isinstance(labels, dict) else labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render(gauges=None, counters=None):
+    """
+    Text exposition of every metric, plus point-in-time values collected by
+    the caller: gauges / counters as {name: value or {labels: value}}.
+    """
+    with _lock:
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        recorded = dict(_counters)
+
+    lines = []
+
+    def header(name, kind):
+        if name in _help:
+            lines.append(f"# HELP {PREFIX}{name} {_help[name]}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    typed = set()
+    for (name, labels), values in sorted(histograms.items()):
+        if name not in typed:
+            header(name, "histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values):
+            cumulative += count
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-2]}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {values[-1]:.6f}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {values[-2]}")
+
+    for (name, labels), value in sorted(recorded.items()):
+        if name not in typed:
+            header(name, "counter")
+            typed.add(name)
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+
+    for kind, collected in (("gauge", gauges), ("counter", counters)):
+        for name, value in (collected or {}).items():
+            header(name, kind)
+            for labels, number in (value.items() if isinstance(value, dict) else [((), value)]):
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {number}")
+
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+describe("request_seconds", "HTTP request duration by endpoint")
+describe("requests_total", "HTTP requests by endpoint and status code")
+describe("verify_pin_seconds", "atm_logic.verify_pin duration, including scrypt")
+describe("check_fraud_seconds", "Whole fraud evaluation per transaction")
+describe("fraud_rule_seconds", "Per fraud rule check duration")
+describe("fraud_load_seconds", "Batched fraud rule data loads")
+describe("complete_transaction_seconds", "atm_logic.complete_transaction duration")
+describe("sql_seconds", "SQLite statement execution by statement kind")
+describe("rate_limited_total", "/atm requests refused with 429, by limit that refused them")
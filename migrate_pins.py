@@ -1,31 +1,58 @@
-import sqlite3
-from werkzeug.security import generate_password_hash
+import argparse
+from db import shard_connections, transaction
+import pin_hasher
 
-DB_NAME = "atmguard.db"
+CHUNK_SIZE = 500
 
-def migrate_pins():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+def migrate_pins(chunk_size=CHUNK_SIZE):
+    updated_count = 0
+    for conn in shard_connections():
+        updated_count += _migrate_shard(conn, chunk_size)
+    print(f"Migration complete. Hashed {updated_count} PINs.")
 
-    cursor.execute("SELECT card_id, pin FROM card")
-    cards = cursor.fetchall()
+def _migrate_shard(conn, chunk_size):
+    cursor = conn.cursor()
 
-    print(f"Found {len(cards)} cards. checking PINs...")
+    total = cursor.execute("SELECT COUNT(*) FROM card").fetchone()[0]
+    print(f"Found {total} cards. checking PINs...")
 
+    # Walk the table in card_id order so each chunk commits on its own and an
+    # interrupted run simply resumes (hashed rows are skipped)
     updated_count = 0
-    for card in cards:
-        pin = card["pin"]
-        if not pin.startswith("scrypt:") and not pin.startswith("pbkdf2:"):
-            # Needs hashing
-            hashed_pin = generate_password_hash(pin)
-            cursor.execute("UPDATE card SET pin = ? WHERE card_id = ?", (hashed_pin, card["card_id"]))
-            updated_count += 1
-            print(f"Hashed PIN for {card['card_id']}")
-    
-    conn.commit()
-    conn.close()
-    print(f"Migration complete. Hashed {updated_count} PINs.")
+    last_card_id = ""
+    while True:
+        cursor.execute("""
+            SELECT card_id, pin FROM card
+            WHERE card_id > ?
+            ORDER BY card_id
+            LIMIT ?
+        """, (last_card_id, chunk_size))
+        cards = cursor.fetchall()
+        if not cards:
+            break
+        last_card_id = cards[-1]["card_id"]
+
+        pending = [card for card in cards if card["pin"] and not pin_hasher.is_hashed(card["pin"])]
+        if not pending:
+            continue
+
+        # Needs hashing: done in parallel by the hashing pool
+        hashed_pins = pin_hasher.hash_pins([card["pin"] for card in pending])
+        with transaction(conn):
+            cursor.executemany(
+                "UPDATE card SET pin = ?, version = version + 1 WHERE card_id = ? AND pin = ?",
+                [(hashed, card["card_id"], card["pin"]) for hashed, card in zip(hashed_pins, pending)]
+            )
+        updated_count += len(pending)
+        print(f"Hashed {updated_count} PINs so far (up to {last_card_id})")
+
+    return updated_count
 
 if __name__ == "__main__":
-    migrate_pins()
+    parser = argparse.ArgumentParser(description="Hash any plaintext PINs left in the card table")
+    parser.add_argument("--workers", type=int, help="hashing processes (default: ATMGUARD_PIN_WORKERS)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="cards hashed and committed per batch")
+    args = parser.parse_args()
+    if args.workers is not None:
+        pin_hasher.PIN_WORKERS = args.workers
+    migrate_pins(args.chunk_size)
@@ -0,0 +1,242 @@
+import db
+from db import get_connection, transaction
+import fraud_stats
+import card_profile
+import ledger
+import provision
+
+
+# ---------------- HELPERS ----------------
+def _columns(conn, table):
+    return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn, table, column, definition):
+    # Older databases were patched by hand, so columns may already exist
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# ---------------- MIGRATIONS ----------------
+def _base_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS card (
+            card_id TEXT PRIMARY KEY,
+            pin TEXT,
+            status TEXT
+        )
+    """)
+    _add_column(conn, "card", "pin_attempts", "INTEGER DEFAULT 0")
+    _add_column(conn, "card", "state_violations", "INTEGER DEFAULT 0")
+    _add_column(conn, "card", "balance", "INTEGER DEFAULT 50000")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fraud_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            card_id TEXT,
+            fraud_type TEXT,
+            action_taken TEXT,
+            timestamp TEXT
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            card_id TEXT,
+            amount INTEGER,
+            status TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    _add_column(conn, "transactions", "type", "TEXT")
+    _add_column(conn, "transactions", "location", "TEXT")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS atm_session (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            card_id TEXT NOT NULL,
+            state TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _fraud_window_indexes(conn):
+    # fraud_engine rule 2: COUNT(*) by card, type and time window (covering)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_card_type_ts
+        ON transactions (card_id, type, timestamp)
+    """)
+    # fraud_rules daily total / rapid count, rule 4 and the mini statement
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_card_ts
+        ON transactions (card_id, timestamp, amount)
+    """)
+    # fraud_engine rule 3: sessions per card in the last N minutes (covering)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_atm_session_card_created
+        ON atm_session (card_id, created_at)
+    """)
+    # /admin fraud log ordering
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fraud_log_ts
+        ON fraud_log (timestamp)
+    """)
+
+
+def _session_state(conn):
+    # Shared ATM session state for multi-worker deployments (atm_session.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS session_state (
+            card_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            pin_attempts INTEGER DEFAULT 0,
+            selected_transaction TEXT,
+            amount INTEGER,
+            last_activity REAL NOT NULL,
+            current_location TEXT,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_session_state_activity
+        ON session_state (last_activity)
+    """)
+
+
+def _admin_page_indexes(conn):
+    # Keyset pages of fraud_log filtered by card or by type, newest first
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fraud_log_card_ts
+        ON fraud_log (card_id, timestamp)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fraud_log_type_ts
+        ON fraud_log (fraud_type, timestamp)
+    """)
+    # Unfiltered transaction pages
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_ts
+        ON transactions (timestamp)
+    """)
+
+
+def _fraud_rollups(conn):
+    # Fraud counts kept up to date by triggers (see fraud_stats.py)
+    fraud_stats.create_rollups(conn)
+    fraud_stats.rebuild(conn)
+
+
+def _card_version(conn):
+    # Bumped by every card write so cached rows can tell they are stale (card_cache.py)
+    _add_column(conn, "card", "version", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _retention_indexes(conn):
+    # retention.py walks atm_session oldest first (fraud_log has idx_fraud_log_ts)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_atm_session_created
+        ON atm_session (created_at)
+    """)
+
+
+def _atm_locations(conn):
+    # Registered ATM coordinates for the impossible-travel rule (geo.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS atm_location (
+            location TEXT PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            geohash TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_atm_location_geohash
+        ON atm_location (geohash)
+    """)
+
+
+def _ledger(conn):
+    # Append-only balance ledger and snapshots (ledger.py)
+    ledger.create_tables(conn)
+    ledger.open_existing_cards(conn)
+
+
+def _provision_jobs(conn):
+    # Bulk card import progress (provision.py)
+    provision.create_tables(conn)
+
+
+def _card_profiles(conn):
+    # Per-card spending profiles for the profile_deviation rule (card_profile.py)
+    card_profile.create_tables(conn)
+    card_profile.rebuild(conn)
+
+
+def _card_page_index(conn):
+    # idx_transactions_card_ts with id ahead of amount: keyset pages of one
+    # card's transactions (timestamp DESC, id DESC) need no sort, and the
+    # daily total stays covering
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_card_ts_id
+        ON transactions (card_id, timestamp, id, amount)
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_transactions_card_ts")
+
+
+# (version, description, function). Append only; never renumber.
+MIGRATIONS = [
+    (1, "base schema", _base_schema),
+    (2, "fraud window indexes", _fraud_window_indexes),
+    (3, "shared session state", _session_state),
+    (4, "admin page indexes", _admin_page_indexes),
+    (5, "fraud rollup tables", _fraud_rollups),
+    (6, "card row version", _card_version),
+    (7, "retention indexes", _retention_indexes),
+    (8, "ATM location registry", _atm_locations),
+    (9, "balance ledger", _ledger),
+    (10, "card provisioning jobs", _provision_jobs),
+    (11, "card spending profiles", _card_profiles),
+    (12, "card transaction page index", _card_page_index),
+]
+
+
+# ---------------- RUNNER ----------------
+def current_version(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn=None, verbose=False):
+    """
+    Applies every pending migration, each in its own transaction, to conn or
+    else to every shard. Safe to rerun and to run from several workers at once.
+    """
+    if conn is None:
+        versions = []
+        for index, path in enumerate(db.shard_paths()):
+            conn = db.get_connection(path)
+            versions.append(migrate(conn, verbose))
+            with transaction(conn):
+                db.reserve_ids(conn, index * db.ID_RANGE)
+        return min(versions)
+
+    for version, description, apply in MIGRATIONS:
+        if current_version(conn) >= version:
+            continue
+        with transaction(conn):
+            # Another worker may have applied it while we waited for the lock
+            if current_version(conn) >= version:
+                continue
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+        if verbose:
+            print(f"Applied migration {version}: {description}")
+
+    return current_version(conn)
+
+
+if __name__ == "__main__":
+    version = migrate(verbose=True)
+    print(f"Database schema at version {version}")
@@ -0,0 +1,157 @@
+"""
+PIN hashing off the request thread.
+
+scrypt checks run in a small process pool so they do not hold the GIL of the
+web worker, and at most MAX_CONCURRENT_CHECKS requests may wait on the pool at
+once: a PIN-guessing burst gets "busy" errors instead of queueing up behind
+everyone else. Failed checks are memoised per (stored hash, PIN) for a short
+time, so a repeated wrong PIN costs no hash; a correct PIN is never cached.
+"""
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PIN_HASH_METHOD = os.environ.get("ATMGUARD_PIN_HASH_METHOD", "scrypt:32768:8:1")
+# 0 hashes inline on the calling thread
+PIN_WORKERS = int(os.environ.get("ATMGUARD_PIN_WORKERS", min(4, os.cpu_count() or 1)))
+MAX_CONCURRENT_CHECKS = int(os.environ.get("ATMGUARD_PIN_MAX_CONCURRENT", max(PIN_WORKERS, 1) * 2))
+SLOT_TIMEOUT = 2.0
+
+CACHE_SIZE = 10000
+CACHE_TTL = 300
+
+HASH_PREFIXES = ("scrypt:", "pbkdf2:")
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_CHECKS)
+
+# Cache keys are keyed HMACs, so the PIN itself is never kept in memory
+_cache_secret = secrets.token_bytes(32)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# ---------------- POOL ----------------
+def _get_pool():
+    global _pool, _pool_pid
+    if PIN_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn: forking a threaded web worker can deadlock the child
+            _pool = ProcessPoolExecutor(PIN_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def submit(fn, *args):
+    """
+    Returns a future for fn(*args) run in the hashing pool (or inline).
+    """
+    pool = _get_pool()
+    if pool is None:
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+    return pool.submit(fn, *args)
+
+
+def _run(fn, *args):
+    if not _slots.acquire(timeout=SLOT_TIMEOUT):
+        raise Exception("PIN service busy, please try again")
+    try:
+        return submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+# ---------------- CACHE ----------------
+def _cache_key(stored, pin):
+    return hmac.new(_cache_secret, f"{stored}\0{pin}".encode(), hashlib.sha256).digest()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        result, expires = entry
+        if expires < time.monotonic():
+            del _cache[key]
+            return None
+        return result
+
+
+def _cache_put(key, result):
+    with _cache_lock:
+        _cache[key] = (result, time.monotonic() + CACHE_TTL)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+# ---------------- API ----------------
+def is_hashed(stored):
+    return stored.startswith(HASH_PREFIXES)
+
+
+def needs_rehash(stored):
+    # werkzeug format: "<method>$<salt>$<hash>"
+    return not is_hashed(stored) or stored.split("$", 1)[0] != PIN_HASH_METHOD
+
+
+def _hash(pin):
+    return generate_password_hash(pin, method=PIN_HASH_METHOD)
+
+
+def hash_pin(pin):
+    return _run(_hash, pin)
+
+
+def try_hash_pin(pin):
+    """
+    hash_pin if a slot is free right now, else None. For optional work
+    (rehashing) that must not wait behind PIN checks.
+    """
+    if not _slots.acquire(blocking=False):
+        return None
+    try:
+        return submit(_hash, pin).result()
+    finally:
+        _slots.release()
+
+
+def hash_pins(pins, chunksize=64):
+    """
+    Hashes many PINs in parallel, preserving order. For batch jobs.
+    """
+    pool = _get_pool()
+    if pool is None:
+        return [_hash(pin) for pin in pins]
+    return list(pool.map(_hash, pins, chunksize=chunksize))
+
+
+def check_pin(stored, pin):
+    if not is_hashed(stored):
+        # Legacy plaintext rows (see migrate_pins.py)
+        return hmac.compare_digest(stored.encode(), pin.encode())
+
+    key = _cache_key(stored, pin)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    result = _run(check_password_hash, stored, pin)
+    if not result:
+        _cache_put(key, result)
+    return result
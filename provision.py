@@ -0,0 +1,329 @@
+"""
+Bulk card provisioning from CSV, and bulk block / unblock / reset-attempts.
+
+An import reads a CSV with a card_id,pin header (balance and status columns
+are optional) BATCH_SIZE rows at a time. Cards that already exist are
+skipped before their PINs are hashed; the rest are hashed in pin_hasher's
+process pool and inserted with one transaction per shard per batch. Every
+import is a provision_job row in the home database (shard 0) holding the
+lines done and the counts so far, so any worker can report progress and an
+interrupted import (including an admin upload cut short by a restart)
+resumes after its last recorded batch:
+
+    python provision.py import cards.csv
+    python provision.py resume 7
+    python provision.py block --cards CARD1 CARD2
+    python provision.py unblock --file card_ids.txt
+    python provision.py reset-attempts --status active --min-attempts 1
+
+A bulk action is one UPDATE per shard, over a list of card_ids or a filter
+(status, minimum pin_attempts).
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+import card_cache
+import card_index
+import pin_hasher
+from db import get_connection, shard_connections, shard_of, transaction
+
+BATCH_SIZE = 5000
+IMPORT_DIR = os.environ.get("ATMGUARD_IMPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "imports"))
+
+PIN_PATTERN = re.compile(r"\d{4,12}")
+MAX_CARD_ID = 64
+STATUSES = ("active", "blocked")
+
+ACTIONS = {
+    "block": "status = 'blocked'",
+    "unblock": "status = 'active', pin_attempts = 0",
+    "reset_attempts": "pin_attempts = 0",
+}
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+EXISTING_SQL = "SELECT card_id FROM card WHERE card_id IN (SELECT value FROM json_each(?))"
+INSERT_SQL = "INSERT OR IGNORE INTO card (card_id, pin, status, pin_attempts, balance) VALUES (?, ?, ?, 0, ?)"
+
+
+# ---------------- SCHEMA ----------------
+def create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS provision_job (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            status TEXT NOT NULL,
+            lines_done INTEGER NOT NULL DEFAULT 0,
+            imported INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            invalid INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+
+# ---------------- ROWS ----------------
+def parse_row(row):
+    """
+    (card_id, pin, status, balance) from one CSV row; raises on bad values.
+    """
+    card_id = (row.get("card_id") or "").strip()
+    pin = (row.get("pin") or "").strip()
+    status = (row.get("status") or "active").strip().lower()
+    balance = (row.get("balance") or "0").strip()
+    if not card_id or len(card_id) > MAX_CARD_ID:
+        raise Exception(f"card_id must be 1-{MAX_CARD_ID} characters")
+    if not PIN_PATTERN.fullmatch(pin):
+        raise Exception("PIN must be 4-12 digits")
+    if status not in STATUSES:
+        raise Exception(f"status must be one of {', '.join(STATUSES)}")
+    if not balance.isdigit():
+        raise Exception("balance must be a whole number of naira, 0 or more")
+    return card_id, pin, status, int(balance)
+
+
+def _insert_batch(cards):
+    """
+    Inserts the cards that do not exist yet; returns (imported, skipped).
+    """
+    by_shard = {}
+    for card in cards:
+        by_shard.setdefault(shard_of(card[0]), []).append(card)
+    conns = shard_connections()
+
+    # Drop existing cards first: hashing is the expensive part, and a
+    # resumed batch is mostly cards that made it in last time
+    new = []
+    for shard, shard_cards in by_shard.items():
+        existing = {row[0] for row in conns[shard].execute(EXISTING_SQL, (json.dumps([c[0] for c in shard_cards]),))}
+        new += [card for card in shard_cards if card[0] not in existing]
+    hashed = dict(zip([card[0] for card in new], pin_hasher.hash_pins([card[1] for card in new])))
+
+    imported = 0
+    for shard, shard_cards in by_shard.items():
+        rows = [(card_id, hashed[card_id], status, balance)
+                for card_id, _, status, balance in shard_cards if card_id in hashed]
+        if not rows:
+            continue
+        with transaction(conns[shard]) as conn:
+            imported += conn.executemany(INSERT_SQL, rows).rowcount
+        for row in rows:
+            card_index.index.add(row[0])
+    return imported, len(cards) - imported
+
+
+# ---------------- JOBS ----------------
+def create_job(source, conn=None):
+    conn = conn or get_connection()
+    now = datetime.now().strftime(TIME_FORMAT)
+    return conn.execute(
+        "INSERT INTO provision_job (source, status, created_at, updated_at) VALUES (?, 'running', ?, ?)",
+        (source, now, now)
+    ).lastrowid
+
+
+def get_job(job_id, conn=None):
+    row = (conn or get_connection()).execute("SELECT * FROM provision_job WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def _save_job(conn, job):
+    job["updated_at"] = datetime.now().strftime(TIME_FORMAT)
+    conn.execute("""
+        UPDATE provision_job
+        SET status = ?, lines_done = ?, imported = ?, skipped = ?, invalid = ?,
+            last_error = ?, updated_at = ?
+        WHERE id = ?
+    """, (job["status"], job["lines_done"], job["imported"], job["skipped"], job["invalid"],
+          job["last_error"], job["updated_at"], job["id"]))
+
+
+def run_job(job_id, batch_size=BATCH_SIZE, progress=None):
+    """
+    Imports the job's CSV from its first unrecorded line. Calls
+    progress(job) after every batch; returns the finished job.
+    """
+    conn = get_connection()
+    job = get_job(job_id, conn)
+    if job is None:
+        raise Exception(f"No provisioning job {job_id}")
+    if job["status"] == "done":
+        return job
+    job["status"] = "running"
+
+    try:
+        with open(job["source"], newline="", encoding="utf-8") as handle:
+            reader = csv.DictReader(handle)
+            missing = {"card_id", "pin"} - set(reader.fieldnames or ())
+            if missing:
+                raise Exception(f"CSV header lacks {', '.join(sorted(missing))}")
+            # Lines already recorded were imported, skipped or rejected before
+            for _ in zip(range(job["lines_done"]), reader):
+                pass
+
+            while rows := list(itertools.islice(reader, batch_size)):
+                cards, invalid = {}, 0
+                for number, row in enumerate(rows, job["lines_done"] + 1):
+                    try:
+                        card = parse_row(row)
+                    except Exception as e:
+                        invalid += 1
+                        job["last_error"] = f"row {number}: {e}"
+                        continue
+                    # A card listed twice keeps its first row
+                    cards.setdefault(card[0], card)
+                imported, skipped = _insert_batch(list(cards.values()))
+                job["imported"] += imported
+                job["skipped"] += skipped + len(rows) - invalid - len(cards)
+                job["invalid"] += invalid
+                job["lines_done"] += len(rows)
+                _save_job(conn, job)
+                if progress:
+                    progress(job)
+        job["status"] = "done"
+    except Exception as e:
+        job["status"] = "failed"
+        job["last_error"] = str(e)
+        raise
+    finally:
+        _save_job(conn, job)
+    return job
+
+
+def import_csv(path, batch_size=BATCH_SIZE, progress=None):
+    return run_job(create_job(os.path.abspath(path)), batch_size, progress)
+
+
+def start_job(job_id, batch_size=BATCH_SIZE):
+    """
+    Runs the job in a background thread of this process (admin uploads).
+    """
+    def run():
+        try:
+            run_job(job_id, batch_size)
+        except Exception:
+            pass  # recorded on the job row
+
+    threading.Thread(target=run, name=f"provision-{job_id}", daemon=True).start()
+
+
+def save_upload(stream):
+    """
+    Copies an uploaded CSV into IMPORT_DIR and returns a new job id for it.
+    The file stays there so the job can be resumed.
+    """
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    conn = get_connection()
+    with transaction(conn):
+        job_id = create_job("", conn)
+        path = os.path.join(IMPORT_DIR, f"job_{job_id}.csv")
+        conn.execute("UPDATE provision_job SET source = ? WHERE id = ?", (path, job_id))
+    with open(path, "wb") as handle:
+        while chunk := stream.read(64 * 1024):
+            handle.write(chunk)
+    return job_id
+
+
+# ---------------- BULK ACTIONS ----------------
+def bulk_update(action, card_ids=None, status=None, min_attempts=None):
+    """
+    Applies ACTIONS[action] to the listed cards and/or those matching the
+    filter, one statement per shard. Returns the number of cards updated.
+    """
+    if action not in ACTIONS:
+        raise Exception(f"Unknown action: {action}")
+    if card_ids is None and status is None and min_attempts is None:
+        raise Exception("Give card_ids or a filter (status, min_attempts)")
+    if card_ids is not None and not isinstance(card_ids, (list, tuple)):
+        raise Exception("card_ids must be a list")
+
+    clauses, params = [], []
+    if status is not None:
+        clauses.append("status = ?")
+        params.append(status)
+    if min_attempts is not None:
+        clauses.append("pin_attempts >= ?")
+        params.append(int(min_attempts))
+
+    conns = shard_connections()
+    by_shard = {shard: None for shard in range(len(conns))}
+    if card_ids is not None:
+        by_shard = {}
+        for card_id in card_ids:
+            by_shard.setdefault(shard_of(card_id, len(conns)), []).append(card_id)
+
+    updated = 0
+    for shard, shard_ids in by_shard.items():
+        where, where_params = list(clauses), list(params)
+        if shard_ids is not None:
+            where.append("card_id IN (SELECT value FROM json_each(?))")
+            where_params.append(json.dumps(shard_ids))
+        with transaction(conns[shard]) as conn:
+            changed = [row[0] for row in conn.execute(
+                f"UPDATE card SET {ACTIONS[action]}, version = version + 1 WHERE {' AND '.join(where)} RETURNING card_id",
+                where_params
+            )]
+        for card_id in changed:
+            card_cache.store.invalidate(card_id)
+        updated += len(changed)
+    return updated
+
+
+# ---------------- CLI ----------------
+def _print_progress(job):
+    print(
+        f"job {job['id']}: {job['lines_done']} lines, {job['imported']} imported, "
+        f"{job['skipped']} skipped, {job['invalid']} invalid"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provision cards in bulk and apply bulk card actions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("import", help="import cards from a card_id,pin[,balance][,status] CSV")
+    load.add_argument("path")
+    resume = commands.add_parser("resume", help="continue an interrupted import")
+    resume.add_argument("job_id", type=int)
+    for command in (load, resume):
+        command.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows hashed and committed per batch")
+        command.add_argument("--workers", type=int, help="hashing processes (default: ATMGUARD_PIN_WORKERS)")
+    for action in ACTIONS:
+        command = commands.add_parser(action.replace("_", "-"), help=f"{action.replace('_', ' ')} cards in bulk")
+        command.add_argument("--cards", nargs="+", help="card IDs")
+        command.add_argument("--file", help="file of card IDs, one per line")
+        command.add_argument("--status", choices=STATUSES, help="only cards with this status")
+        command.add_argument("--min-attempts", type=int, help="only cards with at least this many failed PINs")
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    migrate()
+    if args.command in ("import", "resume"):
+        if args.workers is not None:
+            pin_hasher.PIN_WORKERS = args.workers
+        if args.command == "import":
+            job = import_csv(args.path, args.batch_size, _print_progress)
+        else:
+            job = run_job(args.job_id, args.batch_size, _print_progress)
+        _print_progress(job)
+        if job["last_error"]:
+            print(f"last error: {job['last_error']}")
+        return
+
+    card_ids = args.cards
+    if args.file:
+        with open(args.file, encoding="utf-8") as handle:
+            card_ids = (card_ids or []) + [line.strip() for line in handle if line.strip()]
+    action = args.command.replace("-", "_")
+    print(f"Updated {bulk_update(action, card_ids, args.status, args.min_attempts)} cards ({action})")
+
+
+if __name__ == "__main__":
+    main()
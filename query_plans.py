@@ -0,0 +1,77 @@
+import sqlite3
+import sys
+from datetime import datetime
+
+import admin_queries
+import atm_service
+import card_profile
+import fraud_engine
+import geo
+import ledger
+import provision
+from migrations import migrate
+
+NOW = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+PAGE = admin_queries.encode_cursor([NOW, 1000])
+
+# (name, sql, params) for every query on the fraud / admin hot paths
+QUERIES = [
+    ("fraud_engine.txn_velocity", fraud_engine.TXN_VELOCITY_SQL, ("CARD", NOW)),
+    ("fraud_engine.session_count", fraud_engine.SESSION_COUNT_SQL, ("CARD", NOW)),
+    ("geo.history", geo.HISTORY_SQL, ("CARD", NOW, 5)),
+    ("geo.nearby", geo.NEARBY_SQL, ("s0", "s0~")),
+    ("fraud_engine.daily_total", fraud_engine.DAILY_TOTAL_SQL, ("CARD", NOW, NOW)),
+    ("atm_service.mini_statement", atm_service.MINI_STATEMENT_SQL, ("CARD", 5)),
+    ("admin.fraud_logs", *admin_queries.fraud_log_query(cursor=PAGE)),
+    ("admin.fraud_logs_by_card", *admin_queries.fraud_log_query(cursor=PAGE, card_id="CARD")),
+    ("admin.fraud_logs_by_type", *admin_queries.fraud_log_query(cursor=PAGE, fraud_type="TYPE")),
+    ("admin.transactions", *admin_queries.transactions_query(cursor=PAGE)),
+    ("admin.transactions_by_card", *admin_queries.transactions_query(cursor=PAGE, card_id="CARD")),
+    ("retention.atm_session", "SELECT id FROM atm_session WHERE created_at < ? ORDER BY created_at LIMIT ?", (NOW, 5000)),
+    ("retention.fraud_log", "SELECT id FROM fraud_log WHERE timestamp < ? ORDER BY timestamp LIMIT ?", (NOW, 5000)),
+    ("ledger.balance", ledger.BALANCE_SQL, ("CARD",)),
+    ("ledger.tail", ledger.TAIL_SQL, ("CARD", 0, 100)),
+    ("card_profile.load", card_profile.PROFILE_SQL, ("CARD",)),
+    ("provision.existing", provision.EXISTING_SQL, ('["CARD"]',)),
+    ("admin.cards", *admin_queries.cards_query(cursor=admin_queries.encode_cursor(["CARD"]))),
+]
+
+
+def explain(conn, sql, params):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [row[3] for row in rows]
+
+
+def uses_index(plan):
+    for detail in plan:
+        if "TEMP B-TREE" in detail:
+            return False
+        # WITHOUT ROWID tables are searched through their PRIMARY KEY b-tree
+        if detail.startswith(("SCAN", "SEARCH")) and "INDEX" not in detail and "PRIMARY KEY" not in detail:
+            return False
+    return True
+
+
+def check_query_plans(conn=None):
+    """
+    Returns a list of (name, ok, plan) for every fraud/admin query.
+    Defaults to a freshly migrated in-memory schema.
+    """
+    if conn is None:
+        conn = sqlite3.connect(":memory:", isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        migrate(conn)
+
+    results = []
+    for name, sql, params in QUERIES:
+        plan = explain(conn, sql, params)
+        results.append((name, uses_index(plan), plan))
+    return results
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, ok, plan in check_query_plans():
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {' | '.join(plan)}")
+        failed += not ok
+    sys.exit(1 if failed else 0)
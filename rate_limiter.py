@@ -0,0 +1,116 @@
+"""
+In-process token buckets for /atm, checked before any DB or PIN work.
+
+Requests are limited per client IP, per card_id and per ATM location. Each
+active key costs one small list entry; keys untouched for IDLE_SECONDS (or
+beyond MAX_KEYS, oldest first) are evicted. Limits are per process, so with
+N workers the effective limit is up to N times higher.
+
+Each limit is "<tokens per second>,<burst>" and can be set through
+ATMGUARD_RATE_IP / ATMGUARD_RATE_CARD / ATMGUARD_RATE_LOCATION;
+ATMGUARD_RATE_LIMITS=0 disables limiting.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ENABLED = os.environ.get("ATMGUARD_RATE_LIMITS", "1") != "0"
+MAX_KEYS = 100000
+IDLE_SECONDS = 600
+
+
+def _limit_from_env(name, rate, burst):
+    value = os.environ.get(f"ATMGUARD_RATE_{name}")
+    if not value:
+        return rate, burst
+    rate, _, burst = value.partition(",")
+    return float(rate), float(burst or rate)
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate, burst, max_keys=MAX_KEYS, idle_seconds=IDLE_SECONDS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        # key -> [tokens, last refill]; least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if len(buckets) <= self.max_keys and now - bucket[1] < self.idle_seconds:
+                break
+            del buckets[key]
+
+    def take(self, key, cost=1, now=None):
+        """
+        Takes `cost` tokens for key. Returns 0 if allowed, otherwise the
+        seconds until enough tokens will be available.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                self._evict(now)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0
+            self.limited += 1
+            return (cost - bucket[0]) / self.rate
+
+    def refund(self, key, cost=1):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + cost)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Checked in this order; an IP flood is shed before it touches card buckets
+LIMITERS = {
+    "ip": TokenBucketLimiter(*_limit_from_env("IP", 20, 100)),
+    "card": TokenBucketLimiter(*_limit_from_env("CARD", 1, 10)),
+    "location": TokenBucketLimiter(*_limit_from_env("LOCATION", 50, 200)),
+}
+
+
+def check(ip=None, card_id=None, location=None):
+    """
+    Returns None if the request may proceed, else (dimension, retry_after).
+    Tokens taken before a later limit refuses are given back.
+    """
+    if not ENABLED:
+        return None
+    keys = {"ip": ip, "card": card_id, "location": location}
+    taken = []
+    for dimension, limiter in LIMITERS.items():
+        key = keys[dimension]
+        if key is None:
+            continue
+        retry_after = limiter.take(key)
+        if retry_after:
+            for earlier, earlier_key in taken:
+                earlier.refund(earlier_key)
+            return dimension, retry_after
+        taken.append((limiter, key))
+    return None
+
+
+def stats():
+    return {
+        dimension: {"keys": len(limiter), "limited": limiter.limited}
+        for dimension, limiter in LIMITERS.items()
+    }
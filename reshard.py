@@ -0,0 +1,138 @@
+"""
+Copies every shard's rows into a new set of shard files for another shard count.
+
+Run it with the app stopped. The current shards (ATMGUARD_DB and
+ATMGUARD_SHARDS) are only read, apart from the snapshots a ledger reconcile
+pass takes; the new files are written next to --out
+(shard 0 is --out itself, shard N is <out>.shardN). Move them over the old
+files and restart with ATMGUARD_SHARDS set to the new count:
+
+    ATMGUARD_SHARDS=2 python reshard.py 4 --out /data/new/atmguard.db
+
+Rows keep their ids, which are unique across shards, and every row with a
+card_id goes to that card's new shard. Fleet-wide tables (atm_location) go
+to the new shard 0; tables the migrations do not create are skipped. The
+fraud_stats rollups are rebuilt by their triggers as fraud_log is copied.
+Ledger entries and snapshots are copied before the cards, so no opening
+entries are added; for that the ledger must reconcile first, and the copy
+is refused otherwise. Rerunning into the same --out skips rows already
+copied.
+"""
+import argparse
+import os
+
+import db
+import ledger
+from migrations import migrate
+
+BATCH_SIZE = 5000
+
+# Filled by fraud_log's triggers as it is copied
+DERIVED_TABLES = {"fraud_stats_type", "fraud_stats_card", "fraud_stats_bucket"}
+# Before card, so card_ledger_opening finds the balance already accounted for
+FIRST_TABLES = ["ledger", "balance_snapshot"]
+
+
+def _tables(conn):
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+    return [name for name in FIRST_TABLES if name in names] + [
+        name for name in names if name not in FIRST_TABLES and name not in DERIVED_TABLES
+    ]
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _copy_table(source, targets, table, home_only):
+    columns = _columns(source, table)
+    keyed = "card_id" in columns
+    if not keyed and not home_only:
+        return 0
+    insert = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    card_index = columns.index("card_id") if keyed else None
+
+    copied = 0
+    rows = source.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    while True:
+        batch = rows.fetchmany(BATCH_SIZE)
+        if not batch:
+            return copied
+        by_shard = {}
+        for row in batch:
+            shard = db.shard_of(row[card_index], len(targets)) if keyed else 0
+            by_shard.setdefault(shard, []).append(tuple(row))
+        for shard, shard_rows in by_shard.items():
+            with db.transaction(targets[shard]):
+                targets[shard].executemany(insert, shard_rows)
+        copied += len(batch)
+
+
+def _max_id(conns):
+    return max(
+        (row[0] for conn in conns for row in conn.execute("SELECT seq FROM sqlite_sequence")),
+        default=0,
+    )
+
+
+def reshard(count, out):
+    sources = [db.connect(path) for path in db.shard_paths()]
+    target_paths = db.shard_paths(out, count)
+    if set(map(os.path.abspath, target_paths)) & set(map(os.path.abspath, db.shard_paths())):
+        raise Exception("--out must not overlap the current shard files")
+    try:
+        for conn in sources:
+            migrate(conn)
+        reconciler = ledger.Reconciler()
+        mismatches = [mismatch for conn in sources for mismatch in reconciler.run_pass(conn)]
+        if mismatches:
+            raise Exception(f"Ledger does not reconcile ({len(mismatches)} mismatches), run ledger.py reconcile")
+
+        targets = [db.connect(path) for path in target_paths]
+        try:
+            for conn in targets:
+                migrate(conn)
+            # Tables outside the migrated schema (leftovers of older setups) stay behind
+            schema = set(_tables(targets[0]))
+            report = {}
+            for index, source in enumerate(sources):
+                for table in _tables(source):
+                    if table not in schema:
+                        report[table] = None
+                        continue
+                    copied = _copy_table(source, targets, table, home_only=index == 0)
+                    report[table] = report.get(table, 0) + copied
+
+            # New ids start above every id copied, in a separate range per shard
+            base = (_max_id(sources) // db.ID_RANGE) + 1
+            for index, conn in enumerate(targets):
+                with db.transaction(conn):
+                    db.reserve_ids(conn, (base + index) * db.ID_RANGE)
+        finally:
+            for conn in targets:
+                conn.close()
+    finally:
+        for conn in sources:
+            conn.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy the card data into a new set of shards")
+    parser.add_argument("shards", type=int, help="new shard count")
+    parser.add_argument("--out", required=True, help="path of the new shard 0; others go next to it")
+    args = parser.parse_args(argv)
+    if args.shards < 1:
+        parser.error("shards must be at least 1")
+
+    report = reshard(args.shards, args.out)
+    for table, copied in report.items():
+        print(f"{table:<20} {'skipped (not in the schema)' if copied is None else f'{copied:>10}'}")
+    print(f"Wrote {args.shards} shards: {', '.join(db.shard_paths(args.out, args.shards))}")
+    print(f"Move them into place and restart with ATMGUARD_SHARDS={args.shards}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Moves old atm_session and fraud_log rows into an archive database.
+
+Rows older than each table's retention are copied to ARCHIVE_DB and deleted
+from the live database in batches of BATCH_SIZE. A transaction spanning two
+WAL databases is not atomic, so each batch's copy is committed first and
+only rows found in the archive are then deleted. The copy is INSERT OR
+IGNORE on the original id, so an interrupted run just continues where it
+stopped. After the batches, freed pages are returned to
+the filesystem with incremental vacuum. Every shard is archived into the
+same ARCHIVE_DB (ids are unique across shards). Run it from cron:
+
+    python retention.py                 # archive everything past retention
+    python retention.py --dry-run       # only count what would move
+    python retention.py --enable-incremental-vacuum   # once, runs a full VACUUM
+
+Retention never goes below the longest fraud window (one day, for the daily
+withdrawal total). The fraud_stats rollups follow fraud_log, so the admin
+charts cover the retained period; older history is in the archive.
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+
+import db
+import fraud_engine
+
+ARCHIVE_DB = os.environ.get("ATMGUARD_ARCHIVE_DB", os.path.join(db.BASE_DIR, "atmguard_archive.db"))
+BATCH_SIZE = 5000
+VACUUM_PAGES = 2000
+
+# Longest look-back of any fraud rule: daily_limit sums the whole day
+MIN_RETENTION = max(
+    timedelta(days=1),
+    timedelta(minutes=max(fraud_engine.TXN_WINDOW_MINUTES, fraud_engine.SESSION_WINDOW_MINUTES)),
+)
+
+# table -> (timestamp column, days kept in the live database)
+POLICIES = {
+    "atm_session": ("created_at", int(os.environ.get("ATMGUARD_RETAIN_SESSION_DAYS", 2))),
+    "fraud_log": ("timestamp", int(os.environ.get("ATMGUARD_RETAIN_FRAUD_LOG_DAYS", 365))),
+}
+
+
+# ---------------- ARCHIVE SCHEMA ----------------
+def _columns(conn, schema, table):
+    return [row["name"] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _prepare_archive(conn, table):
+    columns = _columns(conn, "main", table)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS archive.{table} (
+            id INTEGER PRIMARY KEY,
+            {", ".join(column for column in columns if column != "id")}
+        )
+    """)
+    # Columns added to the live table since the archive was created
+    archived = set(_columns(conn, "archive", table))
+    for column in columns:
+        if column not in archived:
+            conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column}")
+    return columns
+
+
+def open_archive(path=None, archive_path=None):
+    """
+    A dedicated connection to the live database with the archive attached.
+    """
+    conn = db.connect(path)
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path or ARCHIVE_DB,))
+    conn.execute("PRAGMA archive.journal_mode=WAL")
+    return conn
+
+
+# ---------------- ARCHIVING ----------------
+def cutoff_for(days, now=None):
+    retention = max(timedelta(days=days), MIN_RETENTION)
+    return ((now or datetime.now()) - retention).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _next_batch(conn, table, time_column, cutoff, batch_size):
+    # Oldest first through the timestamp index, whatever order ids are in
+    return [row[0] for row in conn.execute(
+        f"SELECT id FROM {table} WHERE {time_column} < ? ORDER BY {time_column} LIMIT ?",
+        (cutoff, batch_size)
+    )]
+
+
+def archive_table(conn, table, cutoff, batch_size=BATCH_SIZE, max_batches=None, dry_run=False):
+    time_column = POLICIES[table][0]
+    if dry_run:
+        return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {time_column} < ?", (cutoff,)).fetchone()[0]
+
+    columns = ", ".join(_prepare_archive(conn, table))
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = _next_batch(conn, table, time_column, cutoff, batch_size)
+        if not ids:
+            break
+        batch = json.dumps(ids)
+        with db.transaction(conn):
+            conn.execute(
+                f"INSERT OR IGNORE INTO archive.{table} ({columns}) "
+                f"SELECT {columns} FROM main.{table} WHERE id IN (SELECT value FROM json_each(?))",
+                (batch,)
+            )
+        with db.transaction(conn):
+            deleted = conn.execute(
+                f"DELETE FROM main.{table} WHERE id IN (SELECT value FROM json_each(?)) "
+                f"AND id IN (SELECT id FROM archive.{table})",
+                (batch,)
+            ).rowcount
+        if not deleted:
+            # Would select the same batch forever
+            raise Exception(f"Archive copy of {table} failed, nothing deleted")
+        moved += deleted
+        batches += 1
+        if len(ids) < batch_size:
+            break
+    return moved
+
+
+def incremental_vacuum(conn, pages=VACUUM_PAGES):
+    """
+    Frees up to `pages` pages. Returns False if incremental vacuum is not enabled.
+    """
+    if conn.execute("PRAGMA main.auto_vacuum").fetchone()[0] != 2:
+        return False
+    conn.execute(f"PRAGMA main.incremental_vacuum({int(pages)})").fetchall()
+    return True
+
+
+def enable_incremental_vacuum(conn):
+    # auto_vacuum only changes on an empty database or through a full VACUUM
+    conn.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM main")
+
+
+def run(tables=None, batch_size=BATCH_SIZE, max_batches=None, dry_run=False, vacuum_pages=VACUUM_PAGES,
+        path=None, archive_path=None, now=None):
+    report = {}
+    for shard_path in [path] if path else db.shard_paths():
+        conn = open_archive(shard_path, archive_path)
+        try:
+            for table in tables or POLICIES:
+                cutoff = cutoff_for(POLICIES[table][1], now)
+                moved = archive_table(conn, table, cutoff, batch_size, max_batches, dry_run)
+                result = report.setdefault(table, {"cutoff": cutoff, "would_move" if dry_run else "moved": 0})
+                result["would_move" if dry_run else "moved"] += moved
+            if not dry_run and vacuum_pages:
+                vacuumed = incremental_vacuum(conn, vacuum_pages)
+                report["vacuumed"] = report.get("vacuumed", True) and vacuumed
+        finally:
+            conn.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old atm_session and fraud_log rows")
+    parser.add_argument("--tables", nargs="+", choices=sorted(POLICIES), help="default: all")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows moved per transaction")
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches per table")
+    parser.add_argument("--vacuum-pages", type=int, default=VACUUM_PAGES, help="pages freed per run (0: none)")
+    parser.add_argument("--dry-run", action="store_true", help="count rows past retention, change nothing")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="switch the live database to incremental auto_vacuum (full VACUUM, once)")
+    args = parser.parse_args(argv)
+
+    if args.enable_incremental_vacuum:
+        for path in db.shard_paths():
+            conn = db.connect(path)
+            try:
+                enable_incremental_vacuum(conn)
+            finally:
+                conn.close()
+        print("Incremental vacuum enabled")
+
+    report = run(args.tables, args.batch_size, args.max_batches, args.dry_run, args.vacuum_pages)
+    for table, result in report.items():
+        print(f"{table}: {result}")
+
+
+if __name__ == "__main__":
+    main()
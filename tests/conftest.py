@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Before any app module reads its settings: never touch atmguard.db, hash
+# inline and cheaply, write fraud logs synchronously, no background threads
+os.environ["ATMGUARD_DB"] = os.path.join(tempfile.mkdtemp(prefix="atmguard-tests-"), "atm.db")
+os.environ["ATMGUARD_PIN_WORKERS"] = "0"
+os.environ["ATMGUARD_PIN_HASH_METHOD"] = "pbkdf2:sha256:1000"
+os.environ["ATMGUARD_AUDIT_ASYNC"] = "0"
+os.environ["ATMGUARD_RECONCILE_INTERVAL"] = "0"
+os.environ["ATMGUARD_SESSION_BACKEND"] = "memory"
+
+import atm_session  # noqa: E402
+import card_cache  # noqa: E402
+import card_index  # noqa: E402
+import db  # noqa: E402
+import geo  # noqa: E402
+import pin_hasher  # noqa: E402
+import velocity  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+PIN = "1234"
+
+
+@pytest.fixture
+def shards():
+    # Override with @pytest.mark.parametrize("shards", [3])
+    return 1
+
+
+@pytest.fixture
+def atm_db(tmp_path, monkeypatch, shards):
+    """
+    A freshly migrated database (every shard of it) with empty per-process
+    caches; yields the shard 0 connection.
+    """
+    db.close_connections()
+    monkeypatch.setattr(db, "DB_NAME", str(tmp_path / "atm.db"))
+    monkeypatch.setattr(db, "SHARDS", shards)
+    monkeypatch.setattr(velocity, "store", velocity.VelocityStore())
+    monkeypatch.setattr(geo, "history", geo.TravelHistory())
+    monkeypatch.setattr(geo, "registry", geo.LocationRegistry())
+    monkeypatch.setattr(card_cache, "store", card_cache.CardCache())
+    monkeypatch.setattr(card_index, "index", card_index.CardIndex())
+    monkeypatch.setattr(atm_session, "store", atm_session.SessionStore())
+    migrate()
+    yield db.get_connection()
+    db.close_connections()
+
+
+@pytest.fixture
+def add_card(atm_db):
+    def add(card_id, balance=50000, pin=PIN, status="active"):
+        conn = db.card_connection(card_id)
+        conn.execute(
+            "INSERT INTO card (card_id, pin, status, pin_attempts, balance) VALUES (?, ?, ?, 0, ?)",
+            (card_id, pin_hasher.hash_pin(pin), status, balance)
+        )
+        return card_id
+    return add
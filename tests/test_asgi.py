@@ -0,0 +1,36 @@
+import asyncio
+import json
+
+import pytest
+
+import asgi_app
+import atm_service
+
+
+def _post_atm(body):
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/atm", "headers": [], "client": ("10.0.0.1", 5000)}
+    asyncio.run(asgi_app.application(scope, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+@pytest.mark.parametrize("body", [b"[1, 2]", b'"card"', b"42", b"{not json"])
+def test_non_object_body_is_rejected(atm_db, body):
+    status, payload = _post_atm(body)
+
+    assert status == 400
+    assert payload["message"] == "Invalid JSON body"
+
+
+def test_handle_atm_rejects_non_object(atm_db):
+    payload, status, _ = atm_service.handle_atm(["CARD1"])
+
+    assert status == 400
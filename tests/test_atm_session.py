@@ -0,0 +1,116 @@
+import pytest
+
+import atm_service
+import atm_session
+from atm_session import SessionStore
+from conftest import PIN
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(atm_session.time, "time", lambda: now[0])
+    return now
+
+
+# ---------------- MEMORY STORE ----------------
+def test_least_recently_used_session_is_evicted(clock):
+    store = SessionStore(max_size=2)
+    first = store.get("A")
+    store.get("B")
+    assert store.get("A") is first  # A is now the most recent
+
+    store.get("C")
+
+    assert set(store._sessions) == {"A", "C"}
+    assert store.stats()["evicted"] == 1
+
+
+def test_idle_sessions_are_swept(clock):
+    store = SessionStore(retention=10)
+    store.get("A")
+    clock[0] += 11
+
+    store.get("B")
+
+    assert set(store._sessions) == {"B"}
+    assert store.stats()["expired"] == 1
+
+
+def test_touched_session_is_rescheduled_not_swept(clock):
+    store = SessionStore(retention=10)
+    session = store.get("A")
+    clock[0] += 8
+    session.touch()
+    clock[0] += 3
+
+    store.sweep()
+    assert "A" in store._sessions
+
+    clock[0] += 10
+    store.sweep()
+    assert "A" not in store._sessions
+
+
+def test_heap_is_rebuilt_when_evictions_leave_stale_entries(clock):
+    store = SessionStore(max_size=3)
+    # A card-ID scan: every new card evicts an older one
+    for index in range(20):
+        store.get(f"CARD{index}")
+
+    assert len(store) == 3
+    assert len(store._expiry) <= 2 * store.max_size
+    live = {session.card_id for _, _, session in store._expiry}
+    assert {"CARD17", "CARD18", "CARD19"} <= live
+
+
+# ---------------- SQLITE STORE ----------------
+@pytest.fixture
+def shared_store(atm_db, monkeypatch):
+    store = atm_session.SQLiteSessionStore(retention=10)
+    monkeypatch.setattr(atm_session, "store", store)
+    return store
+
+
+def test_stale_save_conflicts(shared_store, clock):
+    mine = shared_store.get("CARD1")
+    theirs = shared_store.get("CARD1")
+    theirs.state = atm_session.ATMState.PIN_VERIFIED
+    shared_store.save(theirs)
+
+    mine.pin_attempts = 1
+    with pytest.raises(atm_session.SessionConflict):
+        shared_store.save(mine)
+
+    assert shared_store.get("CARD1").state == atm_session.ATMState.PIN_VERIFIED
+    assert shared_store.stats()["conflicts"] == 1
+
+
+def test_concurrent_request_gets_409(shared_store, add_card, monkeypatch):
+    add_card("CARD1")
+    get = shared_store.get
+
+    def get_then_race(card_id):
+        session = get(card_id)
+        # Another worker saves the same session while this request runs
+        shared_store.save(get(card_id))
+        return session
+
+    monkeypatch.setattr(shared_store, "get", get_then_race)
+
+    payload, status, _ = atm_service.handle_atm({"card_id": "CARD1", "pin": PIN})
+
+    assert status == 409
+    assert "another terminal" in payload["message"]
+
+
+def test_sweep_deletes_expired_rows(shared_store, atm_db, clock):
+    shared_store.get("OLD")
+    clock[0] += 11
+    shared_store.get("NEW")
+
+    shared_store.sweep()
+
+    rows = [row[0] for row in atm_db.execute("SELECT card_id FROM session_state")]
+    assert rows == ["NEW"]
+    assert shared_store.stats()["expired"] == 1
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from audit_writer import AuditWriter
+
+
+@pytest.fixture
+def writers():
+    started = []
+
+    def make(**options):
+        writer = AuditWriter(**options)
+        started.append(writer)
+        return writer
+
+    yield make
+    for writer in started:
+        writer.close()
+
+
+def _rows(conn):
+    return [tuple(row) for row in conn.execute(
+        "SELECT card_id, fraud_type, action_taken, timestamp FROM fraud_log ORDER BY id"
+    )]
+
+
+def test_duplicates_are_written_once(atm_db, writers):
+    writer = writers(flush_interval=0.05)
+    events = [("CARD1", "Probe"), ("CARD1", "Probe"), ("CARD1", "Velocity"),
+              ("CARD2", "Probe"), ("CARD1", "Probe"), (None, "Unknown card probes")]
+
+    accepted = [writer.submit(card_id, fraud_type, timestamp="2026-01-01 10:00:00") for card_id, fraud_type in events]
+    writer.flush()
+
+    assert accepted == [True, False, True, True, False, True]
+    assert _rows(atm_db) == [
+        ("CARD1", "Probe", "Logged", "2026-01-01 10:00:00"),
+        ("CARD1", "Velocity", "Logged", "2026-01-01 10:00:00"),
+        ("CARD2", "Probe", "Logged", "2026-01-01 10:00:00"),
+        (None, "Unknown card probes", "Logged", "2026-01-01 10:00:00"),
+    ]
+    assert writer.stats()["deduplicated"] == 2
+
+
+def test_events_are_written_in_batches(atm_db, writers):
+    writer = writers(batch_size=2, flush_interval=10)
+
+    for index in range(4):
+        writer.submit(f"CARD{index}", "Probe")
+    writer.flush()
+
+    assert writer.stats()["batches"] == 2
+    assert writer.stats()["written"] == 4
+
+
+def test_full_queue_drops_instead_of_blocking(atm_db, monkeypatch):
+    writer = AuditWriter(queue_size=2)
+    # No consumer: the queue only fills
+    monkeypatch.setattr(writer, "_ensure_thread", lambda: None)
+
+    accepted = [writer.submit(f"CARD{index}", "Probe") for index in range(3)]
+
+    assert accepted == [True, True, False]
+    assert writer.stats()["dropped"] == 1
+
+
+def test_close_writes_what_is_queued(atm_db):
+    writer = AuditWriter(batch_size=100, flush_interval=30)
+    for index in range(3):
+        writer.submit(f"CARD{index}", "Probe")
+
+    started = time.monotonic()
+    writer.close()
+
+    # Flushed on shutdown, not after the flush interval
+    assert time.monotonic() - started < 5
+    assert [row[0] for row in _rows(atm_db)] == ["CARD0", "CARD1", "CARD2"]
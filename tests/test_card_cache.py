@@ -0,0 +1,137 @@
+import card_cache
+import db
+
+
+class CountingConnection:
+    """
+    Wraps a connection and counts the statements run through it.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.queries = 0
+
+    def execute(self, sql, params=()):
+        self.queries += 1
+        return self.conn.execute(sql, params)
+
+    @property
+    def in_transaction(self):
+        return self.conn.in_transaction
+
+
+def test_cached_read_skips_the_database(add_card):
+    add_card("CARD1", balance=700)
+    cache = card_cache.CardCache()
+    conn = CountingConnection(db.card_connection("CARD1"))
+
+    first = cache.get("CARD1", conn)
+    second = cache.get("CARD1", conn)
+
+    assert first["balance"] == second["balance"] == 700
+    assert conn.queries == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_write_through_update_is_seen_without_a_reload(add_card):
+    add_card("CARD1", balance=700)
+    cache = card_cache.CardCache()
+    conn = CountingConnection(db.card_connection("CARD1"))
+    before = cache.get("CARD1", conn)
+
+    row = cache.update(conn, "CARD1", "balance = balance - ?", (200,))
+    after = cache.get("CARD1", conn)
+
+    assert row["version"] == before["version"] + 1
+    assert after["balance"] == 500
+    assert after["version"] == row["version"]
+    # One SELECT, one UPDATE, and the second read came from the cache
+    assert conn.queries == 2
+
+
+def test_update_matching_no_row_returns_none(add_card):
+    add_card("CARD1", balance=100)
+    cache = card_cache.CardCache()
+    conn = db.card_connection("CARD1")
+
+    row = cache.update(conn, "CARD1", "balance = balance - ?", (200,), where=" AND balance >= ?", where_params=(200,))
+
+    assert row is None
+    assert cache.get("CARD1", conn)["balance"] == 100
+
+
+def test_update_inside_transaction_drops_the_entry(add_card):
+    add_card("CARD1", balance=700)
+    cache = card_cache.CardCache()
+    conn = db.card_connection("CARD1")
+    cache.get("CARD1", conn)
+
+    with db.transaction(conn):
+        cache.update(conn, "CARD1", "status = ?", ("blocked",))
+        assert cache.stats()["cached"] == 0
+
+
+def test_invalidate_forces_a_reload(add_card):
+    add_card("CARD1", balance=700)
+    cache = card_cache.CardCache()
+    conn = CountingConnection(db.card_connection("CARD1"))
+    cache.get("CARD1", conn)
+    # Another worker's write, which this cache cannot see
+    conn.conn.execute("UPDATE card SET balance = 50, version = version + 1 WHERE card_id = 'CARD1'")
+
+    assert cache.get("CARD1", conn)["balance"] == 700
+    cache.invalidate("CARD1")
+
+    assert cache.get("CARD1", conn)["balance"] == 50
+
+
+def test_expired_entry_reloads_and_counts_stale(add_card, monkeypatch):
+    add_card("CARD1", balance=700)
+    now = [1000.0]
+    monkeypatch.setattr(card_cache.time, "monotonic", lambda: now[0])
+    cache = card_cache.CardCache(ttl=2)
+    conn = db.card_connection("CARD1")
+    cache.get("CARD1", conn)
+    conn.execute("UPDATE card SET balance = 50, version = version + 1 WHERE card_id = 'CARD1'")
+
+    now[0] += 1
+    assert cache.get("CARD1", conn)["balance"] == 700
+
+    now[0] += 2
+    assert cache.get("CARD1", conn)["balance"] == 50
+    assert cache.stats()["stale"] == 1
+
+
+def test_older_read_does_not_replace_newer_row(add_card):
+    add_card("CARD1", balance=700)
+    cache = card_cache.CardCache()
+    conn = db.card_connection("CARD1")
+    old = conn.execute(f"SELECT {card_cache.CARD_COLUMNS} FROM card WHERE card_id = 'CARD1'").fetchone()
+    cache.update(conn, "CARD1", "balance = ?", (300,))
+
+    assert cache._store(old)["balance"] == 300
+    assert cache.get("CARD1", conn)["balance"] == 300
+
+
+def test_least_recently_used_card_is_evicted(add_card):
+    for card_id in ("CARD1", "CARD2", "CARD3"):
+        add_card(card_id)
+    cache = card_cache.CardCache(max_cards=2)
+    cache.get("CARD1")
+    cache.get("CARD2")
+    cache.get("CARD1")
+    cache.get("CARD3")
+
+    assert set(cache._cards) == {"CARD1", "CARD3"}
+
+
+def test_disabled_cache_always_reads(add_card):
+    add_card("CARD1")
+    cache = card_cache.CardCache(enabled=False)
+    conn = CountingConnection(db.card_connection("CARD1"))
+
+    cache.get("CARD1", conn)
+    cache.get("CARD1", conn)
+
+    assert conn.queries == 2
+    assert cache.stats()["cached"] == 0
@@ -0,0 +1,38 @@
+import card_index
+
+
+def test_numeric_card_id_is_checked_as_text(add_card):
+    add_card("1234")
+    index = card_index.CardIndex()
+    index.load()
+
+    assert index.might_exist(1234)
+    assert not index.might_exist(5678)
+
+
+def test_card_created_elsewhere_clears_negative_entry(add_card):
+    index = card_index.CardIndex()
+    index.load()
+    # A false positive for a card that does not exist yet
+    index._filter.add("CARD2")
+    assert index.might_exist("CARD2")
+    index.mark_missing("CARD2")
+    assert not index.might_exist("CARD2")
+
+    # Provisioned by another worker, then the refresh interval passes
+    add_card("CARD2")
+    index._checked_at = 0.0
+
+    assert index.might_exist("CARD2")
+    assert index.stats()["negative_cached"] == 0
+
+
+def test_reload_clears_negative_entries(add_card):
+    index = card_index.CardIndex()
+    index.load()
+    index.mark_missing("CARD3")
+    add_card("CARD3")
+
+    index.load()
+
+    assert index.might_exist("CARD3")
@@ -0,0 +1,82 @@
+import statistics
+from datetime import datetime
+
+import atm_logic
+import card_profile
+import db
+import fraud_engine
+from conftest import PIN
+
+AMOUNTS = [1000, 1500, 800, 1200, 950, 1100, 1300, 700, 1000, 1250, 900, 1050]
+
+
+def _usual_profile():
+    profile = card_profile.Profile()
+    for day, amount in enumerate(AMOUNTS, 1):
+        profile.add(amount, datetime(2026, 1, day, 10, 0), "ATM_A")
+    return profile
+
+
+def test_running_stats_match_the_full_history():
+    profile = _usual_profile()
+
+    assert profile.count == len(AMOUNTS)
+    assert abs(profile.mean - statistics.mean(AMOUNTS)) < 1e-9
+    assert abs(profile.stddev() - statistics.stdev(AMOUNTS)) < 1e-9
+    assert profile.hours[10] == len(AMOUNTS)
+
+
+def test_frequent_locations_survive_one_off_visits():
+    profile = card_profile.Profile()
+    when = datetime(2026, 1, 1, 10, 0)
+    for _ in range(20):
+        profile.add(1000, when, "HOME_ATM")
+    for index in range(card_profile.TOP_LOCATIONS * 3):
+        profile.add(1000, when, f"ONE_OFF_{index}")
+
+    assert profile.knows_location("HOME_ATM")
+    assert len(profile.locations) == card_profile.TOP_LOCATIONS
+
+
+def test_withdrawal_updates_the_stored_profile(add_card):
+    card_id = add_card("CARD1")
+    session = atm_logic.start_session(card_id)
+    session.current_location = "ATM_A"
+    atm_logic.verify_pin(session, PIN)
+    atm_logic.select_transaction(session, "withdraw")
+    atm_logic.enter_amount(session, 1000)
+
+    atm_logic.complete_transaction(session)
+
+    profile = card_profile.load(None, card_id)
+    assert (profile.count, profile.mean) == (1, 1000)
+    assert profile.knows_location("ATM_A")
+
+
+def test_profile_deviation_flags_an_outlier_but_allows_it(add_card):
+    card_id = add_card("CARD1")
+    conn = db.card_connection(card_id)
+    card_profile.save(conn, card_id, _usual_profile())
+
+    usual = fraud_engine.check_fraud(card_id, 1100, "withdraw", "ATM_A", conn=conn)
+    outlier = fraud_engine.check_fraud(card_id, 20000, "withdraw", "ATM_B", conn=conn)
+
+    assert "profile_deviation" not in usual.hits
+    assert "profile_deviation" in outlier.hits
+    assert outlier.action == "ALLOW"
+
+
+def test_rebuild_matches_incremental_profile(add_card):
+    card_id = add_card("CARD1")
+    conn = db.card_connection(card_id)
+    for day, amount in enumerate(AMOUNTS, 1):
+        conn.execute(
+            "INSERT INTO transactions (card_id, type, amount, status, timestamp, location) "
+            "VALUES (?, 'withdraw', ?, 'COMPLETED', ?, 'ATM_A')",
+            (card_id, amount, f"2026-01-{day:02d} 10:00:00")
+        )
+
+    assert card_profile.rebuild() == 1
+
+    rebuilt, expected = card_profile.load(None, card_id), _usual_profile()
+    assert rebuilt.as_dict() == expected.as_dict()
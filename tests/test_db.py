@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+import db
+
+
+def test_connection_is_pooled_per_thread(atm_db):
+    assert db.get_connection() is atm_db
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db.get_connection()))
+    thread.start()
+    thread.join()
+
+    assert other[0] is not atm_db
+
+
+def test_connection_is_tuned(atm_db):
+    assert atm_db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert atm_db.execute("PRAGMA busy_timeout").fetchone()[0] == db.BUSY_TIMEOUT_MS
+
+
+def test_request_stats_count_statements_not_connects(atm_db):
+    db.reset_request_stats()
+
+    db.get_connection().execute("SELECT 1")
+    db.get_connection().execute("SELECT 2")
+
+    assert db.request_stats() == {"connects": 0, "queries": 2}
+
+
+def test_transaction_rolls_back_and_nests(atm_db):
+    with pytest.raises(RuntimeError):
+        with db.transaction(atm_db):
+            atm_db.execute("INSERT INTO fraud_log (card_id, fraud_type, action_taken) VALUES ('C', 'T', 'A')")
+            raise RuntimeError
+
+    with db.transaction(atm_db):
+        with db.transaction(atm_db):
+            atm_db.execute("INSERT INTO fraud_log (card_id, fraud_type, action_taken) VALUES ('C', 'T', 'A')")
+        # The inner block joined the outer transaction instead of committing
+        assert atm_db.in_transaction
+
+    assert atm_db.execute("SELECT COUNT(*) FROM fraud_log").fetchone()[0] == 1
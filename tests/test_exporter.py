@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+import db
+import exporter
+from query_plans import explain, uses_index
+
+
+@pytest.mark.parametrize("table", sorted(exporter.TABLES))
+def test_time_range_export_needs_no_sort(atm_db, table):
+    plan = explain(atm_db, *exporter._query(table, "2026-01-01", "2026-02-01"))
+
+    assert uses_index(plan), plan
+
+
+def test_export_is_in_time_order(atm_db):
+    # Inserted out of time order, as a backfill would
+    for card_id, timestamp in (("CARD1", "2026-01-03 10:00:00"), ("CARD2", "2026-01-01 10:00:00"),
+                               ("CARD3", "2026-01-02 10:00:00"), ("CARD4", "2026-02-05 10:00:00")):
+        atm_db.execute(
+            "INSERT INTO transactions (card_id, type, amount, status, timestamp) VALUES (?, 'withdraw', 100, 'SUCCESS', ?)",
+            (card_id, timestamp)
+        )
+
+    body = b"".join(exporter.export("transactions", "jsonl", since="2026-01-01", until="2026-02-01"))
+    rows = [json.loads(line) for line in body.decode().splitlines()]
+
+    assert [row["card_id"] for row in rows] == ["CARD2", "CARD3", "CARD1"]
+
+
+@pytest.mark.parametrize("shards", [3])
+@pytest.mark.parametrize("fetch_size", [2, exporter.FETCH_SIZE])
+def test_sharded_export_is_merged_in_time_order(atm_db, monkeypatch, fetch_size):
+    monkeypatch.setattr(exporter, "FETCH_SIZE", fetch_size)
+    timestamps = [f"2026-01-{day:02d} 10:00:00" for day in range(1, 13)]
+    # Spread over the shards by card, so each shard holds an interleaved slice
+    for index, timestamp in enumerate(reversed(timestamps)):
+        card_id = f"CARD{index}"
+        db.card_connection(card_id).execute(
+            "INSERT INTO transactions (card_id, type, amount, status, timestamp) VALUES (?, 'withdraw', 100, 'SUCCESS', ?)",
+            (card_id, timestamp)
+        )
+    # A tie on the timestamp is ordered by id
+    for card_id in ("CARD0", "CARD1", "CARD2"):
+        db.card_connection(card_id).execute(
+            "INSERT INTO transactions (card_id, type, amount, status, timestamp) VALUES (?, 'withdraw', 100, 'SUCCESS', ?)",
+            (card_id, "2026-01-05 10:00:00")
+        )
+    assert len({db.shard_of(f"CARD{index}") for index in range(12)}) == 3
+
+    body = b"".join(exporter.export("transactions", "jsonl"))
+    rows = [json.loads(line) for line in body.decode().splitlines()]
+
+    assert len(rows) == 15
+    assert [(row["timestamp"], row["id"]) for row in rows] == sorted((row["timestamp"], row["id"]) for row in rows)
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import fraud_engine
+import velocity
+from fraud_engine import FraudContext, Rule, evaluate
+from fraud_rules import check_withdrawal_fraud
+
+
+class RecordingLoader:
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+
+    def __call__(self, ctx, needs):
+        self.calls.append(set(needs))
+        ctx.data.update({need: self.values[need] for need in needs})
+
+
+def _context(loader, amount=100):
+    return FraudContext("CARD1", amount, "withdraw", loader=loader)
+
+
+def test_first_block_hit_stops_before_later_needs_load():
+    loader = RecordingLoader({"daily_total": 0})
+    rules = [
+        Rule("always", lambda ctx: "hit"),
+        Rule("later", lambda ctx: None, needs=("daily_total",)),
+    ]
+
+    result = evaluate(_context(loader), rules)
+
+    assert result.hits == ["always"]
+    assert result.action == "BLOCK"
+    assert loader.calls == []
+
+
+def test_needs_of_remaining_rules_load_in_one_batch():
+    loader = RecordingLoader({"withdrawal_count": 0, "daily_total": 0, "session_count": 0})
+    rules = [
+        Rule("flag", lambda ctx: "flagged", needs=("withdrawal_count",), severity="MEDIUM", action="ALLOW"),
+        Rule("daily", lambda ctx: None, needs=("daily_total", "session_count")),
+        Rule("count", lambda ctx: None, needs=("withdrawal_count",)),
+    ]
+
+    result = evaluate(_context(loader), rules)
+
+    assert loader.calls == [{"withdrawal_count", "daily_total", "session_count"}]
+    assert (result.hits, result.severity, result.action) == (["flag"], "MEDIUM", "ALLOW")
+
+
+def test_scalar_needs_share_one_query(atm_db, monkeypatch):
+    monkeypatch.setattr(velocity, "ENABLED", False)
+    ctx = FraudContext("CARD1", 100, "withdraw", conn=atm_db)
+    db.reset_request_stats()
+
+    fraud_engine.load_needs(ctx, ["withdrawal_count", "session_count", "daily_total"])
+
+    assert ctx.data == {"withdrawal_count": 0, "session_count": 0, "daily_total": 0}
+    assert db.request_stats()["queries"] == 1
+
+
+def test_unknown_need_is_refused(atm_db):
+    with pytest.raises(Exception, match="Unknown fraud rule need"):
+        fraud_engine.load_needs(FraudContext("CARD1", 100, "withdraw", conn=atm_db), ["nope"])
+
+
+def _withdrawals(card_id, amounts, when=None):
+    when = (when or datetime.now() - timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M:%S")
+    db.card_connection(card_id).executemany(
+        "INSERT INTO transactions (card_id, type, amount, status, timestamp) VALUES (?, 'withdraw', ?, 'COMPLETED', ?)",
+        [(card_id, amount, when) for amount in amounts]
+    )
+
+
+@pytest.mark.parametrize("cache", [True, False])
+def test_check_withdrawal_fraud_keeps_its_reasons(add_card, monkeypatch, cache):
+    monkeypatch.setattr(velocity, "ENABLED", cache)
+    for card_id in ("QUIET", "BUSY", "DAILY"):
+        add_card(card_id)
+    _withdrawals("BUSY", [100] * fraud_engine.MAX_TXN_IN_WINDOW)
+    # Spent earlier today
+    _withdrawals("DAILY", [fraud_engine.MAX_DAILY_WITHDRAWAL - 1000], datetime.now().replace(hour=0, minute=0, second=0))
+
+    assert check_withdrawal_fraud("QUIET", 100) == []
+    assert check_withdrawal_fraud("BUSY", 100) == ["Multiple withdrawals in short time"]
+    assert check_withdrawal_fraud("DAILY", 2000) == ["Daily withdrawal limit exceeded"]
+    # The single-withdrawal limit now reports through high_amount
+    assert check_withdrawal_fraud("QUIET", fraud_engine.HIGH_AMOUNT_THRESHOLD) == ["Unusually high withdrawal amount"]
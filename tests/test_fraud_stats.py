@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import admin_queries
+import fraud_stats
+import retention
+
+ROWS = [
+    ("CARD1", "High amount", "2026-01-01 09:15:00"),
+    ("CARD1", "High amount", "2026-01-01 17:40:00"),
+    ("CARD2", "Velocity", "2026-01-02 10:00:00"),
+    (None, "Unknown card probes", "2026-01-02 11:30:00"),
+    ("CARD3", None, "2026-01-03 08:00:00"),
+]
+
+
+def _log(conn, rows):
+    conn.executemany(
+        "INSERT INTO fraud_log (card_id, fraud_type, action_taken, timestamp) VALUES (?, ?, 'Flagged', ?)", rows
+    )
+
+
+def _rollups(conn):
+    return {
+        table: sorted(tuple(row) for row in conn.execute(f"SELECT * FROM {table}"))
+        for table in ("fraud_stats_type", "fraud_stats_card", "fraud_stats_bucket")
+    }
+
+
+def test_triggers_match_a_rebuild_after_inserts_and_deletes(atm_db):
+    _log(atm_db, ROWS)
+    atm_db.execute("DELETE FROM fraud_log WHERE card_id = 'CARD2' OR fraud_type IS NULL")
+    _log(atm_db, [("CARD2", "Velocity", "2026-01-04 12:00:00")])
+    atm_db.execute("DELETE FROM fraud_log WHERE id = (SELECT MIN(id) FROM fraud_log)")
+
+    triggered = _rollups(atm_db)
+    fraud_stats.rebuild(atm_db)
+    rebuilt = _rollups(atm_db)
+
+    # last_seen is only wound back by a rebuild
+    assert triggered["fraud_stats_type"] == rebuilt["fraud_stats_type"]
+    assert triggered["fraud_stats_bucket"] == rebuilt["fraud_stats_bucket"]
+    assert [row[:2] for row in triggered["fraud_stats_card"]] == [row[:2] for row in rebuilt["fraud_stats_card"]]
+    assert sum(row[1] for row in triggered["fraud_stats_type"]) == \
+        atm_db.execute("SELECT COUNT(*) FROM fraud_log").fetchone()[0]
+
+
+def test_archived_rows_leave_the_admin_totals(atm_db, tmp_path):
+    _log(atm_db, [("CARD1", "High amount", "2020-01-01 10:00:00")] + ROWS)
+    assert admin_queries.fraud_summary(atm_db)["fraud_count"] == len(ROWS) + 1
+
+    retention.run(["fraud_log"], vacuum_pages=0, archive_path=str(tmp_path / "archive.db"),
+                  now=datetime(2026, 6, 1))
+
+    assert admin_queries.fraud_summary(atm_db)["fraud_count"] == len(ROWS)
+    assert "2020-01-01" not in admin_queries.fraud_trend(atm_db)["labels"]
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import fraud_engine
+import geo
+from fraud_engine import FraudContext, evaluate
+
+NOW = datetime(2026, 3, 2, 12, 0, 0)
+TRAVEL_RULES = [r for r in fraud_engine.RULES if r.name == "impossible_travel"]
+
+
+def _withdrawal(card_id, location, minutes_ago):
+    when = (NOW - timedelta(minutes=minutes_ago)).strftime(geo.TIME_FORMAT)
+    db.card_connection(card_id).execute(
+        "INSERT INTO transactions (card_id, type, amount, status, location, timestamp) VALUES (?, 'withdraw', 100, 'COMPLETED', ?, ?)",
+        (card_id, location, when)
+    )
+
+
+def _travel_hits(card_id, location):
+    ctx = FraudContext(card_id, 100, "withdraw", location, conn=db.card_connection(card_id), now=NOW)
+    return evaluate(ctx, TRAVEL_RULES).hits
+
+
+@pytest.fixture
+def atms(atm_db):
+    # About 530 km apart, and a second machine on the Ikeja site
+    geo.registry.register("LAGOS_IKEJA_01", 6.6018, 3.3515)
+    geo.registry.register("LAGOS_IKEJA_02", 6.6030, 3.3520)
+    geo.registry.register("ABUJA_WUSE_01", 9.0765, 7.4729)
+
+
+@pytest.mark.parametrize("minutes_ago, blocked", [(20, True), (120, False)])
+def test_registered_atms_too_far_apart_for_the_time(add_card, atms, minutes_ago, blocked):
+    add_card("CARD1")
+    _withdrawal("CARD1", "LAGOS_IKEJA_01", minutes_ago)
+
+    assert (_travel_hits("CARD1", "ABUJA_WUSE_01") == ["impossible_travel"]) is blocked
+
+
+def test_same_site_is_not_travel(add_card, atms):
+    add_card("CARD1")
+    _withdrawal("CARD1", "LAGOS_IKEJA_01", 1)
+
+    assert _travel_hits("CARD1", "LAGOS_IKEJA_02") == []
+
+
+@pytest.mark.parametrize("minutes_ago, blocked", [(5, True), (fraud_engine.TXN_WINDOW_MINUTES + 5, False)])
+def test_unregistered_location_falls_back_to_the_time_window(add_card, atms, minutes_ago, blocked):
+    add_card("CARD1")
+    _withdrawal("CARD1", "CORNER_SHOP_ATM", minutes_ago)
+
+    assert (_travel_hits("CARD1", "LAGOS_IKEJA_01") == ["impossible_travel"]) is blocked
+
+
+def test_unknown_location_is_not_checked(add_card, atms):
+    add_card("CARD1")
+    _withdrawal("CARD1", "LAGOS_IKEJA_01", 1)
+
+    assert _travel_hits("CARD1", "UNKNOWN") == []
+
+
+def test_evicted_card_is_hydrated_from_the_database(add_card):
+    history = geo.TravelHistory(max_cards=1)
+    for card_id, location in (("CARD1", "LAGOS_IKEJA_01"), ("CARD2", "ABUJA_WUSE_01")):
+        add_card(card_id)
+        _withdrawal(card_id, location, 30)
+
+    assert [loc for loc, _ in history.recent("CARD1", NOW)] == ["LAGOS_IKEJA_01"]
+    history.recent("CARD2", NOW)
+    assert "CARD1" not in history._cards
+
+    db.reset_request_stats()
+    recent = history.recent("CARD1", NOW)
+
+    assert recent == [("LAGOS_IKEJA_01", NOW - timedelta(minutes=30))]
+    assert db.request_stats()["queries"] == 1
+
+
+def test_record_after_eviction_loads_the_stored_rows(add_card):
+    history = geo.TravelHistory(max_cards=1)
+    add_card("CARD1")
+    add_card("CARD2")
+    _withdrawal("CARD1", "LAGOS_IKEJA_01", 30)
+    history.recent("CARD1", NOW)
+    history.recent("CARD2", NOW)
+
+    # The new withdrawal is inserted before it is recorded
+    _withdrawal("CARD1", "ABUJA_WUSE_01", 0)
+    history.record("CARD1", "ABUJA_WUSE_01", NOW)
+
+    assert [loc for loc, _ in history.recent("CARD1", NOW)] == ["LAGOS_IKEJA_01", "ABUJA_WUSE_01"]
+
+
+def test_warm_history_skips_queries_until_an_eviction(add_card):
+    history = geo.TravelHistory(max_cards=10)
+    add_card("CARD1")
+    history.warm()
+
+    db.reset_request_stats()
+    assert history.recent("CARD1", NOW) == []
+    assert db.request_stats()["queries"] == 0
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import app
+import db
+import ledger
+from conftest import ROOT
+
+
+def test_importing_app_touches_no_database(tmp_path):
+    path = tmp_path / "fresh.db"
+    env = {**os.environ, "ATMGUARD_DB": str(path), "ATMGUARD_RECONCILE_INTERVAL": "30"}
+
+    subprocess.run([sys.executable, "-c", "import app"], cwd=ROOT, env=env, check=True)
+
+    assert not path.exists()
+
+
+def test_startup_runs_once_per_process(atm_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "_started_pid", None)
+    monkeypatch.setattr(app, "migrate", lambda: calls.append(1))
+
+    app.startup()
+    app.startup()
+    app.app.test_client().get("/metrics")
+
+    assert calls == [1]
+
+
+def test_only_one_reconciler_claims_the_lock(atm_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ledger, "RECONCILE_LOCK", str(tmp_path / "reconcile.lock"))
+    first, second = ledger.Reconciler(), ledger.Reconciler()
+    try:
+        assert first.claim()
+        assert not second.claim()
+
+        # The holder exits: the next attempt takes over
+        first.release()
+        assert second.claim()
+    finally:
+        first.release()
+        second.release()
+
+
+def test_reconcile_finds_balance_changed_outside_the_ledger(add_card):
+    card_id = add_card("CARD1", balance=5000)
+    reconciler = ledger.Reconciler()
+    assert reconciler.run_pass() == []
+
+    db.card_connection(card_id).execute("UPDATE card SET balance = balance + 100 WHERE card_id = ?", (card_id,))
+
+    mismatches = reconciler.run_pass()
+    assert [mismatch["card_id"] for mismatch in mismatches] == [card_id]
+    assert ledger.balance(None, card_id) == 5000
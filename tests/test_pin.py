@@ -0,0 +1,70 @@
+import threading
+
+import atm_logic
+import db
+import pin_hasher
+from atm_states import ATMState
+from conftest import PIN
+
+
+def _stored_pin(card_id):
+    return db.card_connection(card_id).execute("SELECT pin FROM card WHERE card_id = ?", (card_id,)).fetchone()[0]
+
+
+def _plaintext_card(card_id):
+    db.card_connection(card_id).execute(
+        "INSERT INTO card (card_id, pin, status, pin_attempts, balance) VALUES (?, ?, 'active', 0, 1000)",
+        (card_id, PIN)
+    )
+    return card_id
+
+
+def test_busy_pool_does_not_fail_a_verified_pin(atm_db, monkeypatch):
+    card_id = _plaintext_card("CARD1")
+    monkeypatch.setattr(pin_hasher, "_slots", threading.BoundedSemaphore(1))
+    pin_hasher._slots.acquire()
+    session = atm_logic.start_session(card_id)
+
+    atm_logic.verify_pin(session, PIN)
+
+    assert session.state == ATMState.PIN_VERIFIED
+    # Left for the next login
+    assert _stored_pin(card_id) == PIN
+
+
+def test_rehash_on_login_when_a_slot_is_free(atm_db):
+    card_id = _plaintext_card("CARD1")
+    session = atm_logic.start_session(card_id)
+
+    atm_logic.verify_pin(session, PIN)
+
+    stored = _stored_pin(card_id)
+    assert pin_hasher.is_hashed(stored)
+    assert pin_hasher.check_pin(stored, PIN)
+
+
+def test_only_failed_checks_are_cached(monkeypatch):
+    monkeypatch.setattr(pin_hasher, "_cache", pin_hasher.OrderedDict())
+    stored = pin_hasher.hash_pin(PIN)
+
+    assert pin_hasher.check_pin(stored, PIN)
+    assert not pin_hasher.check_pin(stored, "9999")
+
+    assert pin_hasher._cache_get(pin_hasher._cache_key(stored, PIN)) is None
+    assert pin_hasher._cache_get(pin_hasher._cache_key(stored, "9999")) is False
+
+
+def test_failed_rehash_is_logged_and_login_succeeds(atm_db, monkeypatch, caplog):
+    card_id = _plaintext_card("CARD1")
+
+    def broken(pin):
+        raise RuntimeError("hasher crashed")
+
+    monkeypatch.setattr(pin_hasher, "try_hash_pin", broken)
+    session = atm_logic.start_session(card_id)
+
+    atm_logic.verify_pin(session, PIN)
+
+    assert session.state == ATMState.PIN_VERIFIED
+    assert _stored_pin(card_id) == PIN
+    assert "PIN rehash failed for card CARD1" in caplog.text
@@ -0,0 +1,116 @@
+import pytest
+
+import db
+import pin_hasher
+import provision
+from conftest import PIN
+
+
+def _csv(tmp_path, lines):
+    path = tmp_path / "cards.csv"
+    path.write_text("card_id,pin,balance\n" + "".join(line + "\n" for line in lines), encoding="utf-8")
+    return str(path)
+
+
+def _cards():
+    return {
+        row[0]: row[1:]
+        for conn in db.shard_connections()
+        for row in conn.execute("SELECT card_id, balance, status FROM card")
+    }
+
+
+def test_import_counts_duplicate_and_invalid_rows(atm_db, add_card, tmp_path):
+    add_card("CARD0")
+    path = _csv(tmp_path, [
+        "CARD0,1234,100",   # already provisioned
+        "CARD1,1234,100",
+        "CARD1,9999,500",   # listed twice: the first row wins
+        "CARD2,12,100",     # PIN too short
+        ",1234,100",        # no card_id
+        "CARD3,1234,-5",    # negative balance
+        "CARD4,4321,250",
+    ])
+
+    job = provision.import_csv(path, batch_size=3)
+
+    assert (job["status"], job["lines_done"]) == ("done", 7)
+    assert (job["imported"], job["skipped"], job["invalid"]) == (2, 2, 3)
+    assert job["last_error"].startswith("row 6:")
+    assert _cards()["CARD1"] == (100, "active")
+    assert _cards()["CARD4"] == (250, "active")
+    assert "CARD3" not in _cards()
+    assert pin_hasher.check_pin(atm_db.execute("SELECT pin FROM card WHERE card_id = 'CARD1'").fetchone()[0], PIN)
+
+
+def test_resume_continues_after_the_last_recorded_batch(atm_db, tmp_path):
+    path = _csv(tmp_path, [f"CARD{i},1234,{i}" for i in range(10)])
+    job_id = provision.create_job(path)
+
+    def interrupt(job):
+        if job["lines_done"] == 4:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        provision.run_job(job_id, batch_size=4, progress=interrupt)
+    # The first batch was recorded before the interruption
+    assert provision.get_job(job_id)["lines_done"] == 4
+    assert len(_cards()) == 4
+
+    job = provision.run_job(job_id, batch_size=4)
+
+    assert job["status"] == "done"
+    assert (job["lines_done"], job["imported"], job["skipped"], job["invalid"]) == (10, 10, 0, 0)
+    assert sorted(_cards()) == sorted(f"CARD{i}" for i in range(10))
+
+
+def test_resume_of_a_batch_that_committed_skips_its_cards(atm_db, tmp_path):
+    path = _csv(tmp_path, [f"CARD{i},1234,{i}" for i in range(6)])
+    job_id = provision.create_job(path)
+    # Killed after the batch committed but before the job row was saved
+    provision._insert_batch([provision.parse_row({"card_id": f"CARD{i}", "pin": PIN, "balance": str(i)}) for i in range(3)])
+
+    job = provision.run_job(job_id, batch_size=3)
+
+    assert (job["imported"], job["skipped"]) == (3, 3)
+    assert len(_cards()) == 6
+
+
+def test_finished_job_is_not_run_again(atm_db, tmp_path):
+    job = provision.import_csv(_csv(tmp_path, ["CARD1,1234,100"]))
+
+    again = provision.run_job(job["id"])
+
+    assert (again["imported"], again["skipped"]) == (1, 0)
+
+
+@pytest.mark.parametrize("shards", [3])
+def test_filter_update_reaches_every_shard(add_card):
+    card_ids = [f"CARD{i}" for i in range(12)]
+    for card_id in card_ids:
+        add_card(card_id)
+        db.card_connection(card_id).execute("UPDATE card SET pin_attempts = 2 WHERE card_id = ?", (card_id,))
+    add_card("BLOCKED", status="blocked")
+    db.card_connection("BLOCKED").execute("UPDATE card SET pin_attempts = 3 WHERE card_id = 'BLOCKED'")
+    assert len({db.shard_of(card_id) for card_id in card_ids}) == 3
+
+    assert provision.bulk_update("reset_attempts", status="active", min_attempts=1) == 12
+
+    attempts = {
+        row[0]: row[1]
+        for conn in db.shard_connections()
+        for row in conn.execute("SELECT card_id, pin_attempts FROM card")
+    }
+    assert attempts == {**{card_id: 0 for card_id in card_ids}, "BLOCKED": 3}
+
+
+@pytest.mark.parametrize("shards", [3])
+def test_listed_update_touches_only_those_cards(add_card):
+    for card_id in ("CARD1", "CARD2", "CARD3", "CARD4"):
+        add_card(card_id)
+
+    assert provision.bulk_update("block", card_ids=["CARD1", "CARD3", "MISSING"]) == 2
+
+    assert {card_id: status for card_id, (_, status) in _cards().items()} == {
+        "CARD1": "blocked", "CARD2": "active", "CARD3": "blocked", "CARD4": "active",
+    }
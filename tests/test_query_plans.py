@@ -0,0 +1,6 @@
+from query_plans import check_query_plans
+
+
+def test_hot_queries_use_indexes_without_sorting():
+    failed = [(name, plan) for name, ok, plan in check_query_plans() if not ok]
+    assert failed == []
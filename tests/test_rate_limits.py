@@ -0,0 +1,63 @@
+import pytest
+
+import app
+import atm_service
+import rate_limiter
+from conftest import PIN
+
+
+@pytest.fixture
+def limiters(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "ENABLED", True)
+    monkeypatch.setattr(rate_limiter, "LIMITERS", {
+        "ip": rate_limiter.TokenBucketLimiter(100, 100),
+        "card": rate_limiter.TokenBucketLimiter(100, 100),
+        "location": rate_limiter.TokenBucketLimiter(0.001, 1),
+    })
+    return rate_limiter.LIMITERS
+
+
+def test_requests_without_location_share_no_bucket(add_card, limiters):
+    for card_id in ("CARD1", "CARD2", "CARD3"):
+        add_card(card_id)
+        _, status, _ = atm_service.handle_atm({"card_id": card_id, "pin": PIN}, "10.0.0.1")
+        assert status == 200
+    assert len(limiters["location"]) == 0
+
+
+def test_reported_location_is_limited(add_card, limiters):
+    add_card("CARD1")
+    add_card("CARD2")
+
+    _, first, _ = atm_service.handle_atm({"card_id": "CARD1", "pin": PIN, "location": "LAGOS_01"}, "10.0.0.1")
+    _, second, headers = atm_service.handle_atm({"card_id": "CARD2", "pin": PIN, "location": "LAGOS_01"}, "10.0.0.2")
+
+    assert first == 200
+    assert second == 429
+    assert "Retry-After" in headers
+
+
+@pytest.mark.parametrize("card_id", [["CARD1"], {"card": "CARD1"}, True])
+def test_unhashable_card_id_is_rejected_before_limiting(atm_db, limiters, card_id):
+    payload, status, _ = atm_service.handle_atm({"card_id": card_id, "pin": PIN}, "10.0.0.1")
+
+    assert status == 400
+    assert payload == {"status": "error", "message": "Invalid card ID"}
+    assert len(limiters["card"]) == 0
+
+
+def test_unhashable_location_is_rejected(add_card, limiters):
+    add_card("CARD1")
+
+    payload, status, _ = atm_service.handle_atm({"card_id": "CARD1", "pin": PIN, "location": ["LAGOS_01"]}, "10.0.0.1")
+
+    assert status == 400
+    assert payload["message"] == "Invalid location"
+
+
+@pytest.mark.parametrize("card_id", [["CARD1"], {"card": "CARD1"}])
+def test_unhashable_card_id_over_http(atm_db, limiters, card_id):
+    response = app.app.test_client().post("/atm", json={"card_id": card_id, "pin": PIN})
+
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
@@ -0,0 +1,44 @@
+import pytest
+
+import retention
+
+
+def _add_sessions(conn, created_at, count):
+    conn.executemany(
+        "INSERT INTO atm_session (card_id, state, created_at) VALUES (?, 'COMPLETED', ?)",
+        [(f"CARD{i}", created_at) for i in range(count)]
+    )
+
+
+def test_moves_only_rows_past_retention(atm_db, tmp_path):
+    _add_sessions(atm_db, "2020-01-01 00:00:00", 5)
+    _add_sessions(atm_db, "2999-01-01 00:00:00", 2)
+    archive_path = str(tmp_path / "archive.db")
+
+    report = retention.run(["atm_session"], batch_size=2, vacuum_pages=0, archive_path=archive_path)
+
+    assert report["atm_session"]["moved"] == 5
+    assert atm_db.execute("SELECT COUNT(*) FROM atm_session").fetchone()[0] == 2
+    conn = retention.open_archive(archive_path=archive_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM archive.atm_session").fetchone()[0] == 5
+    finally:
+        conn.close()
+
+
+def test_rows_missing_from_the_archive_stay_live(atm_db, tmp_path):
+    _add_sessions(atm_db, "2020-01-01 00:00:00", 3)
+    conn = retention.open_archive(archive_path=str(tmp_path / "archive.db"))
+    try:
+        retention._prepare_archive(conn, "atm_session")
+        # The archive copy is lost (e.g. the archive write did not persist)
+        conn.execute("CREATE TRIGGER archive.drop_copy AFTER INSERT ON atm_session BEGIN "
+                     "DELETE FROM atm_session WHERE id = NEW.id; END")
+        cutoff = retention.cutoff_for(2)
+
+        with pytest.raises(Exception, match="nothing deleted"):
+            retention.archive_table(conn, "atm_session", cutoff)
+    finally:
+        conn.close()
+
+    assert atm_db.execute("SELECT COUNT(*) FROM atm_session").fetchone()[0] == 3
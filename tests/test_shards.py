@@ -0,0 +1,87 @@
+from contextlib import closing
+
+import pytest
+
+import admin_queries
+import atm_logic
+import db
+import reshard
+
+CARDS = [f"CARD{i}" for i in range(12)]
+
+pytestmark = pytest.mark.parametrize("shards", [3])
+
+
+def _card_shards(card_id, paths=None):
+    found = []
+    for index, path in enumerate(paths or db.shard_paths()):
+        with closing(db.connect(path)) as conn:
+            if conn.execute("SELECT 1 FROM card WHERE card_id = ?", (card_id,)).fetchone():
+                found.append(index)
+    return found
+
+
+def test_cards_live_on_their_own_shard(add_card):
+    for card_id in CARDS:
+        add_card(card_id)
+
+    assert {db.shard_of(card_id) for card_id in CARDS} == {0, 1, 2}
+    for card_id in CARDS:
+        assert _card_shards(card_id) == [db.shard_of(card_id)]
+
+
+def test_block_card_writes_the_cards_shard(add_card):
+    card_id = next(card_id for card_id in CARDS if db.shard_of(card_id) != 0)
+    add_card(card_id)
+
+    atm_logic.block_card(card_id, "TEST_RULE")
+
+    conn = db.card_connection(card_id)
+    assert conn.execute("SELECT status FROM card WHERE card_id = ?", (card_id,)).fetchone()[0] == "blocked"
+    assert conn.execute("SELECT COUNT(*) FROM fraud_log WHERE card_id = ?", (card_id,)).fetchone()[0] == 1
+    assert db.get_connection().execute("SELECT COUNT(*) FROM fraud_log").fetchone()[0] == 0
+
+
+def test_ids_do_not_collide_across_shards(add_card):
+    ids = []
+    for card_id in CARDS:
+        add_card(card_id)
+        ids.append(db.card_connection(card_id).execute(
+            "INSERT INTO transactions (card_id, type, amount, status) VALUES (?, 'withdraw', 100, 'COMPLETED')",
+            (card_id,)
+        ).lastrowid)
+
+    assert len(set(ids)) == len(ids)
+
+
+def test_admin_pages_merge_shards_newest_first(add_card):
+    for minute, card_id in enumerate(CARDS):
+        add_card(card_id)
+        db.card_connection(card_id).execute(
+            "INSERT INTO transactions (card_id, type, amount, status, timestamp) "
+            "VALUES (?, 'withdraw', 100, 'COMPLETED', ?)",
+            (card_id, f"2026-01-01 10:{minute:02d}:00")
+        )
+
+    seen, cursor = [], None
+    while True:
+        items, cursor = admin_queries.page_transactions(db.shard_connections(), limit=5, cursor=cursor)
+        seen += [item["card_id"] for item in items]
+        if cursor is None:
+            break
+
+    assert seen == list(reversed(CARDS))
+
+
+def test_reshard_moves_every_card_to_its_new_shard(add_card, tmp_path):
+    for card_id in CARDS:
+        add_card(card_id)
+    out = str(tmp_path / "new" / "atm.db")
+    (tmp_path / "new").mkdir()
+
+    report = reshard.reshard(2, out)
+
+    assert report["card"] == len(CARDS)
+    new_paths = db.shard_paths(out, 2)
+    for card_id in CARDS:
+        assert _card_shards(card_id, new_paths) == [db.shard_of(card_id, 2)]
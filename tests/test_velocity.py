@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import atm_logic
+import velocity
+from atm_states import ATMState
+from conftest import PIN
+
+
+def test_start_session_on_cold_card_counts_once(add_card):
+    card_id = add_card("CARD1")
+
+    atm_logic.start_session(card_id)
+
+    assert velocity.store.count_sessions(card_id, 15) == 1
+
+
+def test_withdrawal_on_cold_card_counts_once(add_card):
+    card_id = add_card("CARD1")
+    session = atm_logic.start_session(card_id)
+    atm_logic.verify_pin(session, PIN)
+    atm_logic.select_transaction(session, "withdraw")
+    atm_logic.enter_amount(session, 1000)
+    # Forget the card, as after an eviction: the next record hydrates from SQLite
+    velocity.store._cards.clear()
+
+    atm_logic.complete_transaction(session)
+
+    assert session.state == ATMState.COMPLETED
+    assert velocity.store.count_transactions(card_id, 10, "withdraw") == 1
+    assert velocity.store.daily_total(card_id) == 1000
+
+
+def test_warm_card_records_in_memory(add_card):
+    card_id = add_card("CARD1")
+    velocity.store.warm()
+
+    atm_logic.start_session(card_id)
+    atm_logic.start_session(card_id)
+
+    assert velocity.store.count_sessions(card_id, 15, now=datetime.now()) == 2
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+import atm_logic
+import db
+import fraud_engine
+from atm_session import ATMSession
+from atm_states import ATMState
+
+
+def _ready_withdrawal(card_id, amount):
+    # As after enter_amount: each request checked the balance before either debit
+    session = ATMSession(card_id)
+    session.state = ATMState.AMOUNT_ENTERED
+    session.selected_transaction = "withdraw"
+    session.amount = amount
+    return session
+
+
+def _card(card_id):
+    return db.card_connection(card_id).execute(
+        "SELECT balance, status FROM card WHERE card_id = ?", (card_id,)
+    ).fetchone()
+
+
+def _count(card_id, table):
+    return db.card_connection(card_id).execute(
+        f"SELECT COUNT(*) FROM {table} WHERE card_id = ?", (card_id,)
+    ).fetchone()[0]
+
+
+def test_concurrent_withdrawals_never_overdraw(add_card):
+    card_id = add_card("CARD1", balance=1000)
+    barrier = threading.Barrier(2)
+    outcomes = []
+
+    def withdraw():
+        session = _ready_withdrawal(card_id, 700)
+        barrier.wait()
+        try:
+            atm_logic.complete_transaction(session)
+            outcomes.append("completed")
+        except Exception as e:
+            outcomes.append(str(e))
+
+    threads = [threading.Thread(target=withdraw) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes) == ["Insufficient balance", "completed"]
+    assert _card(card_id)["balance"] == 300
+    # The refused debit rolled its transaction row back with it
+    assert _count(card_id, "transactions") == 1
+
+
+def test_blocked_withdrawal_records_no_transaction(add_card):
+    card_id = add_card("CARD1", balance=fraud_engine.HIGH_AMOUNT_THRESHOLD * 2)
+    session = _ready_withdrawal(card_id, fraud_engine.HIGH_AMOUNT_THRESHOLD)
+
+    with pytest.raises(Exception, match="suspected fraud"):
+        atm_logic.complete_transaction(session)
+
+    assert _count(card_id, "transactions") == 0
+    assert tuple(_card(card_id)) == (fraud_engine.HIGH_AMOUNT_THRESHOLD * 2, "blocked")
+    assert _count(card_id, "fraud_log") == 1
@@ -0,0 +1,211 @@
+"""
+In-memory sliding-window counters for the fraud rules.
+
+Each card keeps the timestamps of its recent transactions and sessions plus
+a running total for the current day, so velocity and daily-limit checks do
+not re-count history in SQLite. The database stays the source of truth: the
+store is warmed from it on startup, cards missing from memory are loaded on
+demand, and idle cards are evicted (LRU) to bound memory.
+
+Counters are per process. Set ATMGUARD_VELOCITY_CACHE=0 to fall back to the
+SQL queries (e.g. when several workers serve the same card concurrently).
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+from db import card_connection, shard_connections
+
+ENABLED = os.environ.get("ATMGUARD_VELOCITY_CACHE", "1") != "0"
+
+MAX_CARDS = 100000
+MAX_EVENTS_PER_CARD = 256
+# Longest window any rule asks about (fraud_engine session window)
+RETENTION_MINUTES = 15
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _parse(value):
+    return datetime.strptime(value[:19], TIME_FORMAT)
+
+
+class CardWindow:
+    __slots__ = ("transactions", "sessions", "day", "day_total")
+
+    def __init__(self):
+        # (timestamp, type) of recent transactions, oldest first
+        self.transactions = deque(maxlen=MAX_EVENTS_PER_CARD)
+        self.sessions = deque(maxlen=MAX_EVENTS_PER_CARD)
+        self.day = None
+        self.day_total = 0
+
+    def is_empty(self):
+        return not self.transactions and not self.sessions and not self.day_total
+
+    def prune(self, now):
+        horizon = now - timedelta(minutes=RETENTION_MINUTES)
+        while self.transactions and self.transactions[0][0] < horizon:
+            self.transactions.popleft()
+        while self.sessions and self.sessions[0] < horizon:
+            self.sessions.popleft()
+        if self.day != now.date():
+            self.day = now.date()
+            self.day_total = 0
+
+    def add_transaction(self, when, txn_type, amount):
+        self.transactions.append((when, txn_type))
+        if self.day == when.date():
+            self.day_total += amount or 0
+        elif self.day is None or when.date() > self.day:
+            self.day = when.date()
+            self.day_total = amount or 0
+
+
+class VelocityStore:
+    def __init__(self, max_cards=MAX_CARDS, enabled=True, hydrate=True):
+        self.max_cards = max_cards
+        self.enabled = enabled
+        # False for stores fed purely from events (e.g. fraud_replay)
+        self.hydrate = hydrate
+        self._cards = OrderedDict()
+        self._lock = threading.RLock()
+        # True once warm() has loaded every active card and nothing with
+        # data has been evicted since, so a miss means "no recent activity"
+        self._complete = False
+
+    # ---------------- LOADING ----------------
+    def warm(self, conn=None):
+        # Every shard unless one database is given
+        conns = [conn] if conn is not None else shard_connections()
+        now = datetime.now()
+        with self._lock:
+            self._cards.clear()
+            for conn in conns:
+                for card_id, txn_type, amount, timestamp in conn.execute(
+                    """
+                    SELECT card_id, type, amount, timestamp FROM transactions
+                    WHERE timestamp >= ? ORDER BY timestamp
+                    """, (self._since(now),)
+                ):
+                    self._entry(card_id, now).add_transaction(_parse(timestamp), txn_type, amount)
+                for card_id, created_at in conn.execute(
+                    """
+                    SELECT card_id, created_at FROM atm_session
+                    WHERE created_at >= ? ORDER BY created_at
+                    """, (self._session_since(now),)
+                ):
+                    self._entry(card_id, now).sessions.append(_parse(created_at))
+            self._complete = True
+
+    def _since(self, now):
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return min(day_start, now - timedelta(minutes=RETENTION_MINUTES)).strftime(TIME_FORMAT)
+
+    def _session_since(self, now):
+        return (now - timedelta(minutes=RETENTION_MINUTES)).strftime(TIME_FORMAT)
+
+    def _load(self, card_id, now, conn):
+        window = CardWindow()
+        window.prune(now)
+        for txn_type, amount, timestamp in conn.execute(
+            """
+            SELECT type, amount, timestamp FROM transactions
+            WHERE card_id = ? AND timestamp >= ? ORDER BY timestamp
+            """, (card_id, self._since(now))
+        ):
+            window.add_transaction(_parse(timestamp), txn_type, amount)
+        for (created_at,) in conn.execute(
+            """
+            SELECT created_at FROM atm_session
+            WHERE card_id = ? AND created_at >= ? ORDER BY created_at
+            """, (card_id, self._session_since(now))
+        ):
+            window.sessions.append(_parse(created_at))
+        return window
+
+    def _entry(self, card_id, now):
+        window = self._cards.get(card_id)
+        if window is None:
+            window = self._cards[card_id] = CardWindow()
+            self._evict()
+        else:
+            self._cards.move_to_end(card_id)
+        window.prune(now)
+        return window
+
+    def _get(self, card_id, now, conn=None):
+        window = self._cards.get(card_id)
+        if window is None and self.hydrate and not self._complete:
+            window = self._load(card_id, now, conn or card_connection(card_id))
+            self._cards[card_id] = window
+            self._evict()
+        return self._entry(card_id, now)
+
+    def _loads_event(self, card_id, now):
+        # Events are recorded after their row is INSERTed, so a window loaded
+        # from the DB right now already holds the event being recorded
+        if card_id in self._cards or not self.hydrate or self._complete:
+            return False
+        self._get(card_id, now)
+        return True
+
+    def _evict(self):
+        while len(self._cards) > self.max_cards:
+            _, evicted = self._cards.popitem(last=False)
+            if not evicted.is_empty():
+                self._complete = False
+
+    # ---------------- UPDATES ----------------
+    def record_session(self, card_id, when=None):
+        if not self.enabled:
+            return
+        when = when or datetime.now()
+        with self._lock:
+            if not self._loads_event(card_id, when):
+                self._get(card_id, when).sessions.append(when)
+
+    def record_transaction(self, card_id, amount, txn_type, when=None):
+        if not self.enabled:
+            return
+        when = when or datetime.now()
+        with self._lock:
+            if not self._loads_event(card_id, when):
+                self._get(card_id, when).add_transaction(when, txn_type, amount)
+
+    # ---------------- QUERIES ----------------
+    def count_transactions(self, card_id, minutes, txn_type=None, now=None, conn=None):
+        now = now or datetime.now()
+        cutoff = now - timedelta(minutes=minutes)
+        count = 0
+        with self._lock:
+            # Newest first; stops at the window edge
+            for when, kind in reversed(self._get(card_id, now, conn).transactions):
+                if when < cutoff:
+                    break
+                if txn_type is None or kind == txn_type:
+                    count += 1
+        return count
+
+    def count_sessions(self, card_id, minutes, now=None, conn=None):
+        now = now or datetime.now()
+        cutoff = now - timedelta(minutes=minutes)
+        count = 0
+        with self._lock:
+            for when in reversed(self._get(card_id, now, conn).sessions):
+                if when < cutoff:
+                    break
+                count += 1
+        return count
+
+    def daily_total(self, card_id, now=None, conn=None):
+        now = now or datetime.now()
+        with self._lock:
+            return self._get(card_id, now, conn).day_total
+
+    def __len__(self):
+        return len(self._cards)
+
+
+store = VelocityStore(enabled=ENABLED)